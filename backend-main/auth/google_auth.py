@@ -1,8 +1,8 @@
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 from config import settings
+from services.discovery import discovery_cache
 from fastapi import HTTPException
 import json
 import logging
@@ -108,15 +108,20 @@ class GoogleAuth:
                 detail=f"Failed to get credentials: {str(e)}"
             )
 
+    def refresh_credentials(self, credentials: Credentials) -> Credentials:
+        """Exchange the refresh token of credentials for a new access token (blocking)"""
+        credentials.refresh(Request())
+        return credentials
+
     def get_gmail_service(self, credentials: Credentials):
         """Get Gmail service instance"""
-        return build('gmail', 'v1', credentials=credentials)
+        return discovery_cache.build('gmail', 'v1', credentials=credentials)
 
     def get_user_info(self, credentials: Credentials):
         """Get user information from Google"""
         try:
             logger.debug("Attempting to get user info")
-            service = build('oauth2', 'v2', credentials=credentials)
+            service = discovery_cache.build('oauth2', 'v2', credentials=credentials)
             user_info = service.userinfo().get().execute()
             logger.debug(f"Successfully retrieved user info: {user_info}")
             return user_info
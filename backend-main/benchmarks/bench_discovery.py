@@ -0,0 +1,51 @@
+"""
+Measure the per-request cost of constructing Google API clients.
+
+Run from backend-main with: python -m benchmarks.bench_discovery
+"""
+from googleapiclient.discovery import build
+from google.oauth2.credentials import Credentials
+from services.discovery import discovery_cache
+import time
+
+ROUNDS = 200
+MESSAGES_PER_FETCH = 50
+
+
+def _per_call_ms(func, rounds: int = ROUNDS) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - started) / rounds * 1000
+
+
+def main():
+    credentials = Credentials(token="benchmark-token")
+    discovery_cache.preload()
+
+    print(f"{'client':<10} {'build() ms':>12} {'cached ms':>12} {'saved ms':>10}")
+    for name, version in (("gmail", "v1"), ("oauth2", "v2")):
+        uncached = _per_call_ms(lambda: build(name, version, credentials=credentials))
+        cached = _per_call_ms(lambda: discovery_cache.build(name, version, credentials=credentials))
+        print(f"{name:<10} {uncached:>12.3f} {cached:>12.3f} {uncached - cached:>10.3f}")
+
+    service = discovery_cache.build("gmail", "v1", credentials=credentials)
+
+    def per_message_lookup():
+        for i in range(MESSAGES_PER_FETCH):
+            service.users().messages().get(userId="me", id=str(i))
+
+    def hoisted_lookup():
+        messages = service.users().messages()
+        for i in range(MESSAGES_PER_FETCH):
+            messages.get(userId="me", id=str(i))
+
+    per_message = _per_call_ms(per_message_lookup, rounds=20)
+    hoisted = _per_call_ms(hoisted_lookup, rounds=20)
+    print(f"\nBuilding {MESSAGES_PER_FETCH} messages.get requests")
+    print(f"resource per message: {per_message:.3f} ms")
+    print(f"resource reused:      {hoisted:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
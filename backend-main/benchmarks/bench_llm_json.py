@@ -0,0 +1,60 @@
+"""
+Measure JSON extraction from model output against the regex cleanup it replaced.
+
+The corpus in llm_outputs.jsonl holds the response shapes the models return:
+clean JSON, code fences, prose before and after the object, trailing commas,
+output cut off at the token limit and responses with no JSON at all.
+
+Run from backend-main with: python -m benchmarks.bench_llm_json
+"""
+from pathlib import Path
+from services.llm_json import LLMJSONError, extract_json
+import json
+import re
+import time
+
+ROUNDS = 2000
+CORPUS = Path(__file__).with_name("llm_outputs.jsonl")
+
+
+def legacy_extract(text: str) -> dict:
+    """The cleanup and parse sequence previously copied into main.py"""
+    clean_text = re.sub(r'```json\s*|\s*```', '', text)
+    clean_text = re.sub(r'^\s*\.\.\.\s*$', '', clean_text, flags=re.MULTILINE)
+    clean_text = '\n'.join(line for line in clean_text.splitlines() if line.strip())
+    json_match = re.search(r'({[\s\S]*})', clean_text)
+    if not json_match:
+        raise ValueError("No valid JSON found in the response")
+    return json.loads(json_match.group(1))
+
+
+def _attempt(func, text: str) -> bool:
+    try:
+        return isinstance(func(text), dict)
+    except (ValueError, LLMJSONError):
+        return False
+
+
+def _per_call_us(func, text: str) -> float:
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        _attempt(func, text)
+    return (time.perf_counter() - started) / ROUNDS * 1e6
+
+
+def main():
+    corpus = [json.loads(line) for line in CORPUS.read_text().splitlines() if line.strip()]
+
+    print(f"{'sample':<26} {'legacy us':>10} {'ok':>3} {'new us':>8} {'ok':>3}")
+    totals = [0.0, 0, 0.0, 0]
+    for sample in corpus:
+        text = sample["text"]
+        legacy_us, legacy_ok = _per_call_us(legacy_extract, text), _attempt(legacy_extract, text)
+        new_us, new_ok = _per_call_us(extract_json, text), _attempt(extract_json, text)
+        totals = [totals[0] + legacy_us, totals[1] + legacy_ok, totals[2] + new_us, totals[3] + new_ok]
+        print(f"{sample['name']:<26} {legacy_us:>10.1f} {'y' if legacy_ok else 'n':>3} {new_us:>8.1f} {'y' if new_ok else 'n':>3}")
+    print(f"{'total':<26} {totals[0]:>10.1f} {totals[1]:>3} {totals[2]:>8.1f} {totals[3]:>3}  (of {len(corpus)} samples)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Measure rendering of the notification email against the inline f-string it replaced.
+
+Run from backend-main with: python -m benchmarks.bench_templates
+"""
+from services.templates import TemplateRenderer
+import time
+
+ROUNDS = 5000
+
+
+def _summary(user: int) -> dict:
+    return {
+        "email_summary": {
+            "greeting": "Hey there!",
+            "overview": f"You have 8 new emails (3 work, 2 newsletters) for user {user}.",
+            "attention_needed": ["Contract renewal due Friday", f"Reply to ticket #{user}"],
+            "action_items": ["Approve the budget sheet", "Book the offsite venue"],
+            "email_list": [f"Subject {i} (From: sender{i}@example.com)" for i in range(8)],
+            "closing": "Let me know if you need anything else!"
+        }
+    }
+
+
+def legacy_render(summary: dict) -> str:
+    """The f-string previously inlined in main.send_notification"""
+    email_summary = summary.get('email_summary', {})
+    greeting = email_summary.get('greeting', 'Hey there!')
+    overview = email_summary.get('overview', '')
+    attention_needed = email_summary.get('attention_needed', [])
+    action_items = email_summary.get('action_items', [])
+    email_list = email_summary.get('email_list', [])
+    closing = email_summary.get('closing', '')
+    return f"""
+                <html>
+                    <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px; line-height: 1.6;">
+                        <h2 style="color: #2c3e50; border-bottom: 2px solid #3498db; padding-bottom: 10px;">📧 New Email Summary</h2>
+                        
+                        <div style="background-color: #f8f9fa; padding: 20px; border-radius: 8px; margin: 20px 0;">
+                            <p style="color: #34495e; font-size: 18px; margin-top: 0;">{greeting}</p>
+                            
+                            <p style="color: #34495e;">{overview}</p>
+                            
+                            {attention_needed and f'''
+                            <div style="margin: 15px 0;">
+                                <h3 style="color: #e74c3c; margin: 0 0 10px 0;">⚠️ Needs Your Attention</h3>
+                                <ul style="margin: 0; padding-left: 20px; color: #34495e;">
+                                    {"".join(f'<li style="margin-bottom: 5px;">{item}</li>' for item in attention_needed)}
+                                </ul>
+                            </div>
+                            ''' or ''}
+                            
+                            {action_items and f'''
+                            <div style="margin: 15px 0;">
+                                <h3 style="color: #27ae60; margin: 0 0 10px 0;">✅ Action Items</h3>
+                                <ul style="margin: 0; padding-left: 20px; color: #34495e;">
+                                    {"".join(f'<li style="margin-bottom: 5px;">{item}</li>' for item in action_items)}
+                                </ul>
+                            </div>
+                            ''' or ''}
+                            
+                            <div style="margin-top: 20px; border-top: 1px solid #eee; padding-top: 20px;">
+                                <h3 style="color: #2c3e50; margin: 0 0 15px 0;">📥 Your Emails</h3>
+                                <div style="color: #34495e;">
+                                    {"".join(f'<p style="margin: 0 0 15px 0;"><strong>{email}</strong></p>' for email in email_list)}
+                                </div>
+                            </div>
+                            
+                            {closing and f'''
+                            <p style="color: #7f8c8d; margin-top: 20px; font-style: italic;">{closing}</p>
+                            ''' or ''}
+                        </div>
+                        
+                        <div style="margin-top: 20px; padding-top: 20px; border-top: 1px solid #eee; color: #7f8c8d; font-size: 12px;">
+                            <p>Powered by mailbot</p>
+                        </div>
+                    </body>
+                </html>
+                """
+
+
+def _per_render_us(render, summaries) -> float:
+    started = time.perf_counter()
+    for summary in summaries:
+        render(summary)
+    return (time.perf_counter() - started) / len(summaries) * 1e6
+
+
+def main():
+    summaries = [_summary(user) for user in range(ROUNDS)]
+    renderer = TemplateRenderer()
+
+    legacy_us = _per_render_us(legacy_render, summaries)
+    new_us = _per_render_us(renderer.notification, summaries)
+    legacy_bytes = len(legacy_render(summaries[0]).encode("utf-8"))
+    new_bytes = len(renderer.notification(summaries[0]).encode("utf-8"))
+
+    print(f"{'renderer':<12} {'us/render':>10} {'bytes':>7}")
+    print(f"{'f-string':<12} {legacy_us:>10.1f} {legacy_bytes:>7}")
+    print(f"{'templates':<12} {new_us:>10.1f} {new_bytes:>7}")
+    print(f"{ROUNDS} distinct notifications; template output is escaped, the f-string output is not")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,15 +12,58 @@ class Settings:
     GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
     GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
     GOOGLE_REDIRECT_URI = os.getenv("GOOGLE_REDIRECT_URI", "http://localhost:8000/auth/google/callback")
+    TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("TOKEN_REFRESH_MARGIN_SECONDS", "300"))  # Access tokens are refreshed this long before they expire
     
     # Resend settings
     RESEND_API_KEY = os.getenv("RESEND_API_KEY")
+    RESEND_API_URL = os.getenv("RESEND_API_URL", "https://api.resend.com")
+    RESEND_BATCH_SIZE = int(os.getenv("RESEND_BATCH_SIZE", "100"))  # Emails per batch request (Resend allows up to 100)
+    RESEND_BATCH_WAIT_MS = int(os.getenv("RESEND_BATCH_WAIT_MS", "50"))  # How long queued emails wait for a batch to fill
+    RESEND_CONCURRENCY = int(os.getenv("RESEND_CONCURRENCY", "4"))  # Resend requests in flight at the same time
+    RESEND_TIMEOUT_SECONDS = float(os.getenv("RESEND_TIMEOUT_SECONDS", "30"))
     
     # Email processing settings
     BATCH_SIZE = 50  # Number of emails to process in one batch
     MAX_EMAILS_PER_SUMMARY = 10  # Maximum number of emails to include in notifications
     MAX_EMAILS = 10  # Maximum number of emails to fetch
-    
+    MAX_SYNC_EMAILS = int(os.getenv("MAX_SYNC_EMAILS", "100"))  # Maximum number of new emails returned by one incremental sync
+
+    # Gmail API settings
+    GMAIL_BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", "50"))  # Calls per batch request (Gmail allows up to 100)
+    GMAIL_MAX_WORKERS = int(os.getenv("GMAIL_MAX_WORKERS", "16"))  # Concurrent blocking Gmail fetches per process
+
+    # Local storage settings
+    DATA_DIR = os.getenv("DATA_DIR", "data")  # Directory for the app's SQLite databases
+    MESSAGE_STORE_MAX_BYTES = int(os.getenv("MESSAGE_STORE_MAX_BYTES", str(256 * 1024 * 1024)))  # Size bound of the local message store
+    ANALYSIS_CACHE_TTL_SECONDS = int(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))  # How long a per-email AI analysis stays valid
+    ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "50000"))  # Least recently used analyses are evicted past this
+    CREDENTIAL_CACHE_SIZE = int(os.getenv("CREDENTIAL_CACHE_SIZE", "10000"))  # Decoded user credentials kept in memory
+    LEGACY_CREDENTIALS_DIR = os.getenv("LEGACY_CREDENTIALS_DIR", "credentials")  # Per-user token files of earlier versions, imported at startup
+
+    # Upstream rate limits
+    GMAIL_UNITS_PER_SECOND = float(os.getenv("GMAIL_UNITS_PER_SECOND", "20000"))  # Project-wide Gmail quota units (1,200,000 per minute)
+    GMAIL_USER_UNITS_PER_SECOND = float(os.getenv("GMAIL_USER_UNITS_PER_SECOND", "250"))  # Gmail quota units per user
+    OPENROUTER_REQUESTS_PER_MINUTE = float(os.getenv("OPENROUTER_REQUESTS_PER_MINUTE", "20"))  # Request limit of the free OpenRouter models
+    OPENROUTER_BURST = float(os.getenv("OPENROUTER_BURST", "5"))  # OpenRouter requests allowed back to back
+    RESEND_REQUESTS_PER_SECOND = float(os.getenv("RESEND_REQUESTS_PER_SECOND", "2"))  # Resend's default API rate limit
+    RATE_LIMIT_DEFAULT_RETRY_AFTER_SECONDS = float(os.getenv("RATE_LIMIT_DEFAULT_RETRY_AFTER_SECONDS", "5"))  # Pause after a 429 without a Retry-After header
+    RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "3"))  # Throttled calls are retried this often before failing
+
+    # Daily digest settings
+    DIGEST_CONCURRENCY = int(os.getenv("DIGEST_CONCURRENCY", "32"))  # Digests generated at the same time
+    DIGEST_GMAIL_CONCURRENCY = int(os.getenv("DIGEST_GMAIL_CONCURRENCY", "16"))  # Digests fetching from Gmail at the same time
+    DIGEST_LLM_CONCURRENCY = int(os.getenv("DIGEST_LLM_CONCURRENCY", "8"))  # Digests waiting on OpenRouter at the same time
+    DIGEST_RESEND_CONCURRENCY = int(os.getenv("DIGEST_RESEND_CONCURRENCY", "8"))  # Digests being sent through Resend at the same time
+    DIGEST_USER_TIMEOUT_SECONDS = float(os.getenv("DIGEST_USER_TIMEOUT_SECONDS", "300"))  # A user's digest is abandoned after this long
+
+    # Notification settings
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))  # Delivery attempts before a notification is dead-lettered
+    OUTBOX_BASE_DELAY_SECONDS = float(os.getenv("OUTBOX_BASE_DELAY_SECONDS", "5"))  # First retry delay, doubled on every failed attempt
+    OUTBOX_MAX_DELAY_SECONDS = float(os.getenv("OUTBOX_MAX_DELAY_SECONDS", "3600"))
+    OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))  # Queued notifications attempted per pass
+    OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "30"))  # Longest the dispatcher sleeps between passes
+    TEMPLATE_FRAGMENT_CACHE_SIZE = int(os.getenv("TEMPLATE_FRAGMENT_CACHE_SIZE", "4096"))  # Rendered HTML fragments kept for reuse across notifications
+
     # Security settings
     SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
     ALGORITHM = "HS256"
@@ -37,6 +80,55 @@ class Settings:
     OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
     SITE_URL = os.getenv("SITE_URL", "http://localhost:8000")
     SITE_NAME = os.getenv("SITE_NAME", "mailbot")
+    STREAM_KEEPALIVE_SECONDS = float(os.getenv("STREAM_KEEPALIVE_SECONDS", "15"))  # Idle time before a streaming response sends a keep-alive
+    LLM_MODELS = [model.strip() for model in os.getenv(
+        "LLM_MODELS", "deepseek/deepseek-chat-v3-0324:free,meta-llama/llama-3.3-70b-instruct:free"
+    ).split(",") if model.strip()]  # Tried in order; later models are fallbacks
+    LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "45"))  # Budget for all attempts of one LLM request
+    LLM_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("LLM_ATTEMPT_TIMEOUT_SECONDS", "30"))  # Longest a single model is waited on
+    LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))  # A second request is sent once a call is slower than this latency percentile (0 disables)
+    LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))  # Calls of a model observed before hedging it
+    LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))  # Consecutive failures that open a model's circuit
+    LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))  # How long an open circuit skips its model
+    LLM_FAST_MODELS = [model.strip() for model in os.getenv(
+        "LLM_FAST_MODELS", "mistralai/mistral-small-3.1-24b-instruct:free,deepseek/deepseek-chat-v3-0324:free"
+    ).split(",") if model.strip()]  # Small, fast models for bulk per-email categorization
+    # Model list, output token limit, temperature and per-attempt timeout of each kind of request
+    LLM_ROUTES = {
+        "categorize": {
+            "models": LLM_FAST_MODELS,
+            "max_tokens": int(os.getenv("LLM_CATEGORIZE_MAX_TOKENS", "900")),
+            "temperature": float(os.getenv("LLM_CATEGORIZE_TEMPERATURE", "0")),
+            "timeout": float(os.getenv("LLM_CATEGORIZE_TIMEOUT_SECONDS", "15"))
+        },
+        "summary": {
+            "models": LLM_FAST_MODELS,
+            "max_tokens": int(os.getenv("LLM_SUMMARY_MAX_TOKENS", "400")),
+            "temperature": float(os.getenv("LLM_SUMMARY_TEMPERATURE", "0.3")),
+            "timeout": float(os.getenv("LLM_SUMMARY_TIMEOUT_SECONDS", "15"))
+        },
+        "notification": {
+            "models": LLM_MODELS,
+            "max_tokens": int(os.getenv("LLM_NOTIFICATION_MAX_TOKENS", "1000")),
+            "temperature": float(os.getenv("LLM_NOTIFICATION_TEMPERATURE", "0.7")),
+            "timeout": float(os.getenv("LLM_NOTIFICATION_TIMEOUT_SECONDS", "30"))
+        },
+        "digest": {
+            "models": LLM_MODELS,
+            "max_tokens": int(os.getenv("LLM_DIGEST_MAX_TOKENS", "1500")),
+            "temperature": float(os.getenv("LLM_DIGEST_TEMPERATURE", "0.7")),
+            "timeout": float(os.getenv("LLM_DIGEST_TIMEOUT_SECONDS", "30"))
+        }
+    }
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))  # OpenRouter calls in flight at the same time per AI service
+    LLM_BATCH_TOKEN_BUDGET = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "3000"))  # Estimated prompt tokens of emails packed into one LLM call
+    LLM_MAX_EMAIL_TOKENS = int(os.getenv("LLM_MAX_EMAIL_TOKENS", "400"))  # Longer email bodies are trimmed to about this many tokens
+    LLM_MAX_BATCH_EMAILS = int(os.getenv("LLM_MAX_BATCH_EMAILS", "12"))  # Caps emails per call so the answer fits the output token limit
+    LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "true").lower() == "true"  # Ask for categorization results matching a JSON schema
+    LLM_BATCH_RETRIES = int(os.getenv("LLM_BATCH_RETRIES", "2"))  # Rounds of re-asking for emails missing from a batch response, halving it when no progress is made
+    CLASSIFIER_ENABLED = os.getenv("CLASSIFIER_ENABLED", "true").lower() == "true"  # Classify obvious emails locally before the LLM
+    CLASSIFIER_CONFIDENCE = float(os.getenv("CLASSIFIER_CONFIDENCE", "0.9"))  # Minimum confidence to skip the LLM for an email
+    CLASSIFIER_MIN_TRAINING_EMAILS = int(os.getenv("CLASSIFIER_MIN_TRAINING_EMAILS", "200"))  # LLM-labeled emails needed before the learned model is trusted
 
     def __init__(self):
         # Log the loaded settings (without sensitive data)
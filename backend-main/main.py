@@ -1,23 +1,29 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2AuthorizationCodeBearer
-from typing import List, Dict
+from typing import List, Dict, Optional
 import os
 from dotenv import load_dotenv
-from apscheduler.schedulers.background import BackgroundScheduler
 from auth.google_auth import google_auth
 from services.email import EmailService
-from services.ai import AIService, ai_service
-from services.notification import NotificationService, notification_service
-from config import settings
+from services.ai import ai_service
+from services.notification import notification_service
+import json
 import logging
-from fastapi.responses import RedirectResponse
-from google.oauth2.credentials import Credentials
+import time
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 from fastapi import HTTPException
 from services.email_service import EmailService
 from services.user_service import user_service
-from datetime import datetime, timezone
-import pytz
+from services.discovery import discovery_cache
+from services.classifier import email_classifier
+from services.llm_json import extract_json
+from services.templates import template_renderer
+from services.digest_scheduler import DigestScheduler, validate_preferences
+from services.digest_pool import DigestWorkerPool
+from services.token_manager import token_manager
+from services.rate_limiter import rate_limiter
+from services.metrics import HTTP_LATENCY, HTTP_REQUESTS, cache_hit_ratios, metrics
 from models.user import UserCredentials
 
 # Configure logging
@@ -43,14 +49,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Count requests and time them per route template, so ids in paths do not multiply series"""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = route.path if route else "unmatched"
+        HTTP_LATENCY.observe(time.perf_counter() - started, method=request.method, route=path)
+        HTTP_REQUESTS.inc(method=request.method, route=path, status=str(status))
+
 # OAuth2 scheme
 oauth2_scheme = OAuth2AuthorizationCodeBearer(
     authorizationUrl="https://accounts.google.com/o/oauth2/v2/auth",
     tokenUrl="https://oauth2.googleapis.com/token",
 )
 
-# Initialize scheduler
-scheduler = BackgroundScheduler()
 
 async def get_current_user(credentials: str = Depends(oauth2_scheme)):
     """Get current user from credentials"""
@@ -104,7 +123,14 @@ async def google_auth_callback(code: str):
             refresh_token=credentials.refresh_token,
             token_expiry=credentials.expiry,
         )
+        existing = await user_service.get_user_credentials(user_creds.user_id)
+        if existing:
+            # Signing in again must not reset the user's digest preferences
+            user_creds.preferences = existing.preferences
+            user_creds.history_id = existing.history_id
         await user_service.store_user_credentials(user_creds)
+        token_manager.remember(credentials.token, user_creds.user_id, credentials.expiry)
+        digest_scheduler.reschedule(user_creds)
         
         # Return a JSON-serializable response
         return {
@@ -132,21 +158,17 @@ async def fetch_emails(token: str):
     try:
         logger.debug("Starting fetch_emails endpoint")
         
-        # Create credentials with required fields
-        creds = Credentials(
-            token=token,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=settings.GOOGLE_CLIENT_ID,
-            client_secret=settings.GOOGLE_CLIENT_SECRET,
-            scopes=['https://www.googleapis.com/auth/gmail.readonly']
-        )
+        # Refreshed first if the token is about to expire
+        creds = await token_manager.credentials_for_token(token)
         logger.debug("Successfully created credentials")
         
         # Create email service instance
         email_service = EmailService()
         emails = await email_service.fetch_emails(creds)
         logger.debug(f"Successfully fetched {len(emails)} emails")
-        return {"emails": emails}
+        return {"emails": [email.to_dict() for email in emails]}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in fetch_emails endpoint: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -154,228 +176,131 @@ async def fetch_emails(token: str):
             detail=f"Failed to fetch emails: {str(e)}"
         )
 
+@app.get("/api/emails/sync")
+async def sync_emails(token: str):
+    """Fetch only the emails that arrived since the user's last sync"""
+    try:
+        # The sync cursor is stored per user, so find out who this token belongs to
+        user_creds = await token_manager.user_for_token(token)
+        if not user_creds:
+            raise HTTPException(status_code=404, detail="User not found")
+        creds = await token_manager.credentials_for(user_creds)
+        
+        email_service = EmailService()
+        result = await email_service.sync_emails(creds, user_creds.history_id)
+        await user_service.update_history_id(user_creds.user_id, result["history_id"])
+        logger.debug(f"Synced {len(result['emails'])} emails for user {user_creds.email}")
+        return {
+            "emails": [email.to_dict() for email in result["emails"]],
+            "full_sync": result["full_sync"],
+            "has_more": result["has_more"]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in sync_emails endpoint: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to sync emails: {str(e)}"
+        )
+
 @app.post("/api/emails/summarize")
 async def summarize_emails(emails: List[Dict]):
     """Summarize a batch of emails"""
     try:
-        summary = ai_service.summarize_emails(emails)
+        summary = await ai_service.summarize_emails(emails)
         return summary
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.post("/api/emails/summarize/stream")
+async def stream_summarize_emails(emails: List[Dict]):
+    """Summarize a batch of emails, streaming each result as a server-sent event"""
+    async def event_stream():
+        async for event in ai_service.stream_summarize_emails(emails):
+            if event["event"] == "ping":
+                # SSE comment lines keep proxies from timing out idle connections
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/api/notifications")
-async def send_notification(token: str, email_address: str, email_data: Dict):
-    """Send notification about new emails"""
+async def send_notification(token: str, email_address: str, email_data: Dict, idempotency_key: Optional[str] = None):
+    """Queue a notification about new emails; it is delivered in the background"""
     try:
         # Extract the emails list from email_data
         emails = email_data.get("emails", [])
         if not isinstance(emails, list):
             raise HTTPException(status_code=400, detail="emails must be a list")
             
-        summary = ai_service.generate_notification_summary(emails)
+        summary = await ai_service.generate_notification_summary(emails)
         
         # Parse the JSON if it's in the response
         try:
-            import json
-            import re
-            
-            # First, clean up the response by removing all JSON markers and extra whitespace
-            clean_text = re.sub(r'```json\s*|\s*```', '', summary)
-            clean_text = re.sub(r'^\s*\.\.\.\s*$', '', clean_text, flags=re.MULTILINE)  # Remove lines with just dots
-            clean_text = '\n'.join(line for line in clean_text.splitlines() if line.strip())  # Remove empty lines
-            
-            # Find the actual JSON content
-            json_match = re.search(r'({[\s\S]*})', clean_text)
-            if json_match:
-                json_str = json_match.group(1)
-                # Parse the JSON
-                summary_data = json.loads(json_str)
-                
-                # Extract components from the structured data
-                email_summary = summary_data.get('email_summary', {})
-                greeting = email_summary.get('greeting', 'Hey there!')
-                overview = email_summary.get('overview', '')
-                attention_needed = email_summary.get('attention_needed', [])
-                action_items = email_summary.get('action_items', [])
-                email_list = email_summary.get('email_list', [])
-                closing = email_summary.get('closing', '')
-                
-                # Create HTML content with structured data
-                content = f"""
-                <html>
-                    <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px; line-height: 1.6;">
-                        <h2 style="color: #2c3e50; border-bottom: 2px solid #3498db; padding-bottom: 10px;">📧 New Email Summary</h2>
-                        
-                        <div style="background-color: #f8f9fa; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                            <p style="color: #34495e; font-size: 18px; margin-top: 0;">{greeting}</p>
-                            
-                            <p style="color: #34495e;">{overview}</p>
-                            
-                            {attention_needed and f'''
-                            <div style="margin: 15px 0;">
-                                <h3 style="color: #e74c3c; margin: 0 0 10px 0;">⚠️ Needs Your Attention</h3>
-                                <ul style="margin: 0; padding-left: 20px; color: #34495e;">
-                                    {"".join(f'<li style="margin-bottom: 5px;">{item}</li>' for item in attention_needed)}
-                                </ul>
-                            </div>
-                            ''' or ''}
-                            
-                            {action_items and f'''
-                            <div style="margin: 15px 0;">
-                                <h3 style="color: #27ae60; margin: 0 0 10px 0;">✅ Action Items</h3>
-                                <ul style="margin: 0; padding-left: 20px; color: #34495e;">
-                                    {"".join(f'<li style="margin-bottom: 5px;">{item}</li>' for item in action_items)}
-                                </ul>
-                            </div>
-                            ''' or ''}
-                            
-                            <div style="margin-top: 20px; border-top: 1px solid #eee; padding-top: 20px;">
-                                <h3 style="color: #2c3e50; margin: 0 0 15px 0;">📥 Your Emails</h3>
-                                <div style="color: #34495e;">
-                                    {"".join(f'<p style="margin: 0 0 15px 0;"><strong>{email}</strong></p>' for email in email_list)}
-                                </div>
-                            </div>
-                            
-                            {closing and f'''
-                            <p style="color: #7f8c8d; margin-top: 20px; font-style: italic;">{closing}</p>
-                            ''' or ''}
-                        </div>
-                        
-                        <div style="margin-top: 20px; padding-top: 20px; border-top: 1px solid #eee; color: #7f8c8d; font-size: 12px;">
-                            <p>Powered by mailbot</p>
-                        </div>
-                    </body>
-                </html>
-                """
-            else:
-                raise ValueError("No valid JSON found in the response")
-                
+            summary_data = extract_json(summary, "email_summary")
+            content = template_renderer.notification(summary_data)
         except Exception as e:
             logger.error(f"Error parsing summary JSON: {str(e)}")
             # Log the raw summary for debugging
             logger.debug(f"Raw summary: {summary}")
             
             # Fallback to simple format
-            content = f"""
-            <html>
-                <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px; line-height: 1.6;">
-                    <h2 style="color: #2c3e50; border-bottom: 2px solid #3498db; padding-bottom: 10px;">📧 New Email Summary</h2>
-                    
-                    <div style="background-color: #f8f9fa; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                        <div style="white-space: pre-line; color: #34495e;">
-                            {summary}
-                        </div>
-                    </div>
-                    
-                    <div style="margin-top: 20px; padding-top: 20px; border-top: 1px solid #eee; color: #7f8c8d; font-size: 12px;">
-                        <p>Powered by mailbot</p>
-                    </div>
-                </body>
-            </html>
-            """
+            content = template_renderer.plain_summary("📧 New Email Summary", summary)
         
-        # Send notification using Resend
-        response = await notification_service.send_email_notification(
+        # Queued durably; the outbox dispatcher delivers it through Resend and retries failures
+        entry = notification_service.enqueue_notification(
             to=email_address,
             subject="📧 New Email Summary",
-            content=content
+            content=content,
+            idempotency_key=idempotency_key
         )
         
-        return {"message": "Notification sent successfully", "resend_response": response}
+        return {"message": "Notification queued", "notification_id": entry["id"], "status": entry["status"]}
     except Exception as e:
         logger.error(f"Error sending notification: {str(e)}", exc_info=True)
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/api/notifications/{notification_id}")
+async def notification_status(notification_id: int):
+    """Delivery status of a queued notification"""
+    entry = notification_service.outbox.get(notification_id)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Notification not found")
+    return {key: entry[key] for key in ("id", "status", "attempts", "last_error", "provider_id", "created_at", "sent_at")}
+
 @app.get("/api/digest")
 async def generate_daily_digest(token: str):
     """Generate and send daily digest"""
     try:
-        # Create credentials with required fields
-        creds = Credentials(
-            token=token,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=settings.GOOGLE_CLIENT_ID,
-            client_secret=settings.GOOGLE_CLIENT_SECRET,
-            scopes=['https://www.googleapis.com/auth/gmail.readonly']
-        )
+        creds = await token_manager.credentials_for_token(token)
         email_service = EmailService()
         emails = await email_service.fetch_emails(creds)
-        digest_content = ai_service.generate_daily_digest(emails)
+        digest_content = await ai_service.generate_daily_digest(emails)
         
         # Parse the JSON if it's in the response
         try:
-            import json
-            import re
-            
-            # Clean up the response by removing all JSON markers and extra whitespace
-            clean_text = re.sub(r'```json\s*|\s*```', '', digest_content)
-            clean_text = re.sub(r'^\s*\.\.\.\s*$', '', clean_text, flags=re.MULTILINE)  # Remove lines with just dots
-            clean_text = '\n'.join(line for line in clean_text.splitlines() if line.strip())  # Remove empty lines
-            
-            # Find the actual JSON content
-            json_match = re.search(r'({[\s\S]*})', clean_text)
-            if json_match:
-                json_str = json_match.group(1)
-                # Parse and re-serialize to ensure clean JSON
-                digest_data = json.loads(json_str)
-                return digest_data
-            else:
-                raise ValueError("No valid JSON found in the response")
-                
+            return extract_json(digest_content)
         except Exception as e:
             logger.error(f"Error parsing digest JSON: {str(e)}")
             # Return the raw digest content as fallback
             return {"digest": digest_content}
             
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-# Schedule daily digest
-@scheduler.scheduled_job('cron', hour=0, minute=0)
-async def scheduled_daily_digest():
-    """Scheduled task to generate and send daily digest"""
-    try:
-        # Get all users who have enabled daily digest
-        users = await user_service.get_all_users_for_digest()
-        
-        for user in users:
-            # Check if it's the right time for this user's timezone
-            user_tz = pytz.timezone(user.preferences.get("timezone", "UTC"))
-            user_time = datetime.now(user_tz)
-            digest_time = datetime.strptime(
-                user.preferences.get("digest_time", "00:00"),
-                "%H:%M"
-            ).time()
-            
-            if user_time.time().hour == digest_time.hour and \
-               user_time.time().minute == digest_time.minute:
-                try:
-                    # Create services
-                    email_service = EmailService()
-                    ai_service = AIService()
-                    notification_service = NotificationService()
-                    
-                    # Fetch emails from the last 24 hours
-                    emails = await email_service.fetch_emails(
-                        user.access_token,
-                        time_range="1d"
-                    )
-                    
-                    # Generate digest
-                    digest_content = ai_service.generate_daily_digest(emails)
-                    
-                    # Send notification
-                    await notification_service.send_daily_digest(
-                        to=user.email,
-                        digest_content=digest_content
-                    )
-                    
-                except Exception as e:
-                    logger.error(f"Error processing digest for user {user.email}: {str(e)}")
-                    continue
-    
-    except Exception as e:
-        logger.error(f"Error in scheduled daily digest: {str(e)}")
+# Generates due digests with bounded concurrency per upstream
+digest_pool = DigestWorkerPool()
+
+# Runs each user's daily digest at their own digest time
+digest_scheduler = DigestScheduler(job=digest_pool.process)
 
 # Add new endpoint to update user preferences
 @app.post("/api/preferences")
@@ -384,42 +309,88 @@ async def update_preferences(
     preferences: dict
 ):
     try:
-        # Create credentials with required fields
-        creds = Credentials(
-            token=token,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=settings.GOOGLE_CLIENT_ID,
-            client_secret=settings.GOOGLE_CLIENT_SECRET,
-            scopes=['https://www.googleapis.com/auth/gmail.readonly']
-        )
-        
-        # Get user info to get user ID
-        user_info = google_auth.get_user_info(creds)
-        if not user_info:
-            raise HTTPException(status_code=404, detail="User not found")
-            
-        # Get user credentials
-        user_creds = await user_service.get_user_credentials(user_info["id"])
+        # Get the user this token belongs to
+        user_creds = await token_manager.user_for_token(token)
         if not user_creds:
             raise HTTPException(status_code=404, detail="User not found")
         
         # Update preferences
         if not hasattr(user_creds, 'preferences'):
             user_creds.preferences = {}
-        user_creds.preferences.update(preferences)
+        updated = {**user_creds.preferences, **preferences}
+        # Rejected here rather than silently unscheduling the user's digest
+        validate_preferences(updated)
+        user_creds.preferences = updated
         await user_service.store_user_credentials(user_creds)
+        digest_scheduler.reschedule(user_creds)
         
         return {"status": "success", "preferences": user_creds.preferences}
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/api/stats/classifier")
+async def classifier_stats():
+    """Hit rate of the local classifier and the LLM calls it saved"""
+    return email_classifier.stats()
+
+@app.get("/api/stats/digests")
+async def digest_stats():
+    """Progress, throughput and stage timings of scheduled digests"""
+    return digest_pool.metrics()
+
+@app.get("/api/stats/llm")
+async def llm_stats():
+    """Latency per task, and calls, failures, hedges and circuit state per model"""
+    return ai_service.router.stats()
+
+@app.get("/api/rate-limits")
+async def rate_limits():
+    """Token bucket levels per upstream, with time spent waiting for capacity"""
+    return rate_limiter.levels()
+
+@app.get("/api/stats/notifications")
+async def notification_stats():
+    """Outbox backlog by status and Resend request counts"""
+    return {"outbox": notification_service.outbox.counts(), "resend": notification_service.client.stats}
+
+def _queue_depths():
+    digests = digest_pool.metrics()
+    return {
+        ("outbox_pending",): notification_service.outbox.counts()["pending"],
+        ("resend_batch",): notification_service.client.queued,
+        ("digests_queued",): digests["queued"],
+        ("digests_in_progress",): digests["in_progress"]
+    }
+
+def _cache_hit_ratios():
+    ratios = cache_hit_ratios()
+    for name, info in template_renderer.cache_info().items():
+        lookups = info["hits"] + info["misses"]
+        if lookups:
+            ratios[(f"template_{name}",)] = info["hits"] / lookups
+    return ratios
+
+metrics.gauge("mailbot_queue_depth", "Work waiting in each queue", ("queue",), function=_queue_depths)
+metrics.gauge("mailbot_cache_hit_ratio", "Share of lookups served from each cache since startup", ("cache",), function=_cache_hit_ratios)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Request, stage, LLM call, queue and cache metrics in the Prometheus text format"""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Start scheduler when application starts
 @app.on_event("startup")
 async def startup_event():
-    scheduler.start()
+    discovery_cache.preload()
+    await digest_scheduler.start()
+    notification_service.start()
 
 # Stop scheduler when application shuts down
 @app.on_event("shutdown")
 async def shutdown_event():
-    scheduler.shutdown()
\ No newline at end of file
+    await digest_scheduler.stop()
+    await notification_service.aclose()
+    email_classifier.save()
@@ -0,0 +1,85 @@
+from typing import Dict, Iterable, List, Optional, Union
+
+class EmailRecord:
+    """
+    A parsed email and, once analyzed, its AI analysis.
+
+    Records use __slots__ because batches of them are held for every request;
+    JSON uses the API's keys ("from", "ai_summary") via from_dict/to_dict.
+    """
+
+    __slots__ = (
+        "id", "subject", "sender", "date", "body", "labels",
+        "list_unsubscribe", "precedence", "category", "summary", "importance"
+    )
+
+    def __init__(
+        self,
+        id: str,
+        subject: str = "No Subject",
+        sender: str = "Unknown",
+        date: str = "",
+        body: str = "",
+        labels: Optional[List[str]] = None,
+        list_unsubscribe: str = "",
+        precedence: str = "",
+        category: Optional[str] = None,
+        summary: str = "",
+        importance: str = ""
+    ):
+        self.id = id
+        self.subject = subject
+        self.sender = sender
+        self.date = date
+        self.body = body
+        self.labels = labels or []
+        self.list_unsubscribe = list_unsubscribe
+        self.precedence = precedence
+        self.category = category
+        self.summary = summary
+        self.importance = importance
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "EmailRecord":
+        """Build a record from an email dict, accepting a Gmail snippet in place of the body"""
+        return cls(
+            id=str(data.get("id", "")),
+            subject=data.get("subject") or "No Subject",
+            sender=data.get("from") or "Unknown",
+            date=data.get("date", ""),
+            body=data.get("body") or data.get("snippet") or "",
+            labels=data.get("labels"),
+            list_unsubscribe=data.get("list_unsubscribe", ""),
+            precedence=data.get("precedence", ""),
+            category=data.get("category"),
+            summary=data.get("ai_summary", ""),
+            importance=data.get("importance", "")
+        )
+
+    def to_dict(self) -> Dict:
+        data = {
+            "id": self.id,
+            "subject": self.subject,
+            "from": self.sender,
+            "date": self.date,
+            "body": self.body,
+            "labels": self.labels,
+            "list_unsubscribe": self.list_unsubscribe,
+            "precedence": self.precedence
+        }
+        if self.category is not None:
+            data.update({"category": self.category, "ai_summary": self.summary, "importance": self.importance})
+        return data
+
+    def apply_analysis(self, analysis: Dict) -> None:
+        """Attach an AI analysis (category, summary, importance) to the record"""
+        self.category = analysis["category"]
+        self.summary = analysis.get("summary", "")
+        self.importance = analysis.get("importance", "")
+
+    def __repr__(self) -> str:
+        return f"EmailRecord(id={self.id!r}, subject={self.subject!r})"
+
+def to_records(emails: Iterable[Union[EmailRecord, Dict]]) -> List[EmailRecord]:
+    """Convert email dicts to records, leaving records as they are"""
+    return [email if isinstance(email, EmailRecord) else EmailRecord.from_dict(email) for email in emails]
@@ -8,6 +8,7 @@ class UserCredentials(BaseModel):
     access_token: str
     refresh_token: str
     token_expiry: datetime
+    history_id: Optional[str] = None  # Gmail history cursor of the last incremental sync
     preferences: dict = {
         "digest_time": "00:00",  # Default digest time
         "timezone": "UTC",
@@ -1,103 +1,236 @@
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict, Optional, Tuple, Union
 import json
 from config import settings
-from openai import OpenAI
+from openai import AsyncOpenAI, RateLimitError
+from services.analysis_cache import AnalysisCache, analysis_cache
+from services.classifier import EmailClassifier, email_classifier
+from models.email import EmailRecord, to_records
+from services.prompt_packer import PromptPacker
+from services.llm_json import JSONObjectStream, LLMJSONError, extract_json, validate_schema
+from services.rate_limiter import RateLimiter, rate_limiter, retry_after_seconds
+from services.llm_client import LLMError, LLMRouter, Throttled
+from services.metrics import STAGE_LATENCY
+import asyncio
 import logging
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+CATEGORIES = ("work", "personal", "newsletters", "other", "important")
+
+# One email's result in a categorization response
+EMAIL_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "id": {"type": "string"},
+        "category": {"type": "string", "enum": list(CATEGORIES)},
+        "summary": {"type": "string"},
+        "importance": {"type": "string"}
+    },
+    "required": ["id", "category", "summary", "importance"],
+    "additionalProperties": False
+}
+
+# Categorization response, sent to models that support structured output
+BATCH_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {"emails": {"type": "array", "items": EMAIL_ANALYSIS_SCHEMA}},
+    "required": ["emails"],
+    "additionalProperties": False
+}
+
+# Digest returned when the emails could not be analyzed at all
+DIGEST_ERROR_FALLBACK = {
+    "daily_digest": {
+        "overview": {
+            "description": "Sorry, I encountered an error while generating your daily digest.",
+            "total_emails_processed": "0",
+            "main_topics": []
+        },
+        "important_updates_and_announcements": {
+            "updates": [],
+            "announcements": [],
+            "notes": "Unable to process updates at this time."
+        },
+        "action_items_and_follow_ups": {
+            "key_action_items": [],
+            "follow_ups": [],
+            "deadlines": "None"
+        },
+        "key_discussions_and_decisions": {
+            "discussions": [],
+            "decisions": [],
+            "notes": "Unable to process discussions at this time."
+        },
+        "additional_notes": "Please try again later."
+    }
+}
+
 class AIService:
-    def __init__(self):
-        self.client = OpenAI(
+    def __init__(
+        self,
+        cache: Optional[AnalysisCache] = analysis_cache,
+        classifier: Optional[EmailClassifier] = email_classifier if settings.CLASSIFIER_ENABLED else None,
+        limiter: RateLimiter = rate_limiter
+    ):
+        self.cache = cache
+        self.classifier = classifier
+        self.limiter = limiter
+        self.client = AsyncOpenAI(
             base_url="https://openrouter.ai/api/v1",
             api_key=settings.OPENROUTER_API_KEY,
+            # Retries happen in the router, which knows the deadline, the breakers and the rate limiter
+            max_retries=0,
         )
-        self.model = "deepseek/deepseek-chat-v3-0324:free"
-        self.max_tokens = 1000
-        self.temperature = 0.7
-
-    def _prepare_email_batch(self, emails: List[Dict]) -> str:
-        """Prepare a batch of emails for AI processing"""
-        batch_text = ""
-        for email in emails:
-            batch_text += f"""
-            Subject: {email.get('subject', 'No Subject')}
-            From: {email.get('from', 'Unknown')}
-            Date: {email.get('date', 'Unknown')}
-            Body: {email.get('body', '')[:500]}...  # Truncate long bodies
-            ---
-            """
-        return batch_text
+        # Each task has its own models (primary first, fallbacks after it) and generation settings
+        self.router = LLMRouter(create=self._create_completion, acquire=self._acquire_capacity)
+        # Analyses are cached under the primary categorization model, whichever model produced them
+        self.model = self.router.route("categorize").models[0]
+        self.packer = PromptPacker()
+        # Bounds how many LLM calls this service has in flight at once
+        self.semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
 
-    def _call_openrouter(self, prompt: str) -> str:
-        """Make API call to OpenRouter"""
-        try:
-            completion = self.client.chat.completions.create(
-                extra_headers={
-                    "HTTP-Referer": settings.SITE_URL,
-                    "X-Title": settings.SITE_NAME,
-                },
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are an AI assistant that helps categorize and summarize emails. Always respond with valid JSON when asked for structured data."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=self.max_tokens,
-                temperature=self.temperature,
-                timeout=30  # 30 second timeout
-            )
-            if not completion or not completion.choices:
-                raise Exception("No response from OpenRouter API")
-            return completion.choices[0].message.content
-        except Exception as e:
-            logger.error(f"Error calling OpenRouter API: {str(e)}")
-            # Return a fallback response instead of raising an exception
-            return f"Error processing request: {str(e)}. Using fallback categorization."
+    def _render_blocks(self, uncached: List[Tuple[EmailRecord, str]]) -> List[str]:
+        """Render (email, cache key) pairs as blocks of the batch prompt"""
+        with STAGE_LATENCY.time(stage="prompt_build"):
+            return [self.packer.render(email) for email, _ in uncached]
+
+    def _pack_batches(self, uncached: List[Tuple[EmailRecord, str]], blocks: List[str]) -> List[Tuple[List[Tuple[EmailRecord, str]], str]]:
+        """Pack (email, cache key) pairs and their rendered blocks into batches that fill the prompt token budget"""
+        batches = self.packer.pack(uncached, blocks)
+        logger.debug(f"Packed {len(uncached)} emails into {len(batches)} LLM batches")
+        return batches
+
+    def _plan_batches(self, uncached: List[Tuple[EmailRecord, str]]) -> Tuple[List[Tuple[EmailRecord, Dict]], List[Tuple[List[Tuple[EmailRecord, str]], str]]]:
+        """
+        Classify the uncached emails the local classifier is confident about
+        and pack the rest into LLM batches, rendering each email only once.
+
+        Returns the (email, analysis) pairs classified locally and the batches.
+        """
+        blocks = self._render_blocks(uncached)
+        local, remaining, remaining_blocks = self._preclassify(uncached, blocks)
+        batches = self._pack_batches(remaining, remaining_blocks)
+        if local:
+            # Count the batches the classified emails would have added
+            self.classifier.record_llm_calls_avoided(len(self.packer.pack(uncached, blocks)) - len(batches))
+        return local, batches
+
+    def _completion_kwargs(self, prompt: str, task: str = "categorize") -> Dict:
+        """Arguments of a chat completion request for a prompt"""
+        kwargs = {
+            "extra_headers": {
+                "HTTP-Referer": settings.SITE_URL,
+                "X-Title": settings.SITE_NAME,
+            },
+            "messages": [
+                {"role": "system", "content": "You are an AI assistant that helps categorize and summarize emails. Always respond with valid JSON when asked for structured data."},
+                {"role": "user", "content": prompt}
+            ]
+        }
+        if task == "categorize" and settings.LLM_STRUCTURED_OUTPUT:
+            # Models without structured output ignore this and are validated the same way
+            kwargs["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "email_analysis", "strict": True, "schema": BATCH_ANALYSIS_SCHEMA}
+            }
+        return kwargs
+
+    async def _acquire_capacity(self) -> None:
+        """Wait for OpenRouter capacity; the router does this before timing a model call"""
+        await self.limiter.acquire("openrouter")
 
-    def _parse_json_response(self, response: str) -> Dict:
-        """Parse JSON response with multiple attempts and error handling"""
+    async def _create_completion(self, **kwargs):
+        """
+        Create a chat completion. A 429 pauses the OpenRouter bucket and is
+        raised as Throttled, so the router waits it out outside the attempt
+        timeout and retries.
+        """
         try:
-            # First attempt: direct JSON parsing
-            return json.loads(response)
-        except json.JSONDecodeError:
+            return await self.client.chat.completions.create(**kwargs)
+        except RateLimitError as e:
+            raise Throttled(self.limiter.throttled("openrouter", retry_after_seconds(e.response.headers))) from e
+
+    async def _call_openrouter(self, prompt: str, task: str = "categorize") -> str:
+        """
+        Make API call to OpenRouter with the models and settings of task,
+        failing over between models.
+
+        Raises LLMError if no model answered within the deadline budget.
+        """
+        async with self.semaphore:
             try:
-                # Second attempt: try to extract JSON from the response
-                # Look for content between curly braces
-                start = response.find('{')
-                end = response.rfind('}') + 1
-                if start != -1 and end != 0:
-                    json_str = response[start:end]
-                    return json.loads(json_str)
-            except (json.JSONDecodeError, ValueError):
-                logger.warning("Failed to parse JSON response, using fallback")
-                return {"emails": []}  # Return empty structure for fallback
-        return {"emails": []}  # Default fallback
-
-    def summarize_emails(self, emails: List[Dict]) -> Dict:
+                return await self.router.complete(task, **self._completion_kwargs(prompt, task))
+            except LLMError as e:
+                logger.error(f"Error calling OpenRouter API: {str(e)}")
+                raise
+
+    async def _stream_openrouter(self, prompt: str, task: str = "categorize") -> AsyncIterator[str]:
+        """Make a streaming API call to OpenRouter, yielding text as it is generated"""
+        async with self.semaphore:
+            async for text in self.router.stream(task, **self._completion_kwargs(prompt, task)):
+                yield text
+
+    def _parse_batch_response(self, response: str) -> List:
         """
-        Summarize a batch of emails and categorize them using OpenRouter
+        The per-email results of a batch response.
+
+        Raises LLMJSONError if the response holds no "emails" list.
         """
-        try:
-            if not emails:
-                return {"error": "No emails provided"}
+        result = extract_json(response, "emails")
+        validate_schema(result, {"type": "object", "properties": {"emails": {"type": "array"}}})
+        return result["emails"]
 
-            # Process emails in batches to avoid token limits
-            batch_size = 5  # Adjust based on email size and token limits
-            all_categories = {
-                "work": [],
-                "personal": [],
-                "newsletters": [],
-                "other": [],
-                "important": []
-            }
-            all_summaries = []
+    def _split_cached(self, emails: List[EmailRecord]) -> Tuple[List[Tuple[EmailRecord, Dict]], List[Tuple[EmailRecord, str]]]:
+        """
+        Split emails into (email, analysis) pairs served from the cache and
+        (email, cache key) pairs that still have to go to the model
+        """
+        cache_keys = [AnalysisCache.make_key(email, self.model) for email in emails]
+        found = self.cache.get_many(cache_keys) if self.cache else {}
+        cached = []
+        uncached = []
+        for email, key in zip(emails, cache_keys):
+            if key in found:
+                cached.append((email, found[key]))
+            else:
+                uncached.append((email, key))
+        logger.debug(f"{len(cached)} emails analyzed from cache, {len(uncached)} sent to the model")
+        return cached, uncached
+
+    def _preclassify(
+        self,
+        uncached: List[Tuple[EmailRecord, str]],
+        blocks: List[str]
+    ) -> Tuple[List[Tuple[EmailRecord, Dict]], List[Tuple[EmailRecord, str]], List[str]]:
+        """
+        Split uncached emails into (email, analysis) pairs the local classifier
+        is confident about and (email, cache key) pairs that still need the
+        model, with the rendered blocks of the latter
+        """
+        if not self.classifier or not uncached:
+            return [], uncached, blocks
+        local = []
+        remaining = []
+        remaining_blocks = []
+        for (email, key), block in zip(uncached, blocks):
+            analysis = self.classifier.classify(email)
+            if analysis:
+                local.append((email, analysis))
+            else:
+                remaining.append((email, key))
+                remaining_blocks.append(block)
+        logger.debug(f"{len(local)} emails classified locally, {len(remaining)} sent to the model")
+        return local, remaining, remaining_blocks
 
-            for i in range(0, len(emails), batch_size):
-                batch = emails[i:i + batch_size]
-                batch_text = self._prepare_email_batch(batch)
+    def _learn(self, email: EmailRecord, analysis: Dict) -> None:
+        """Train the local classifier on a category the model assigned"""
+        if self.classifier:
+            self.classifier.observe(email, analysis["category"])
 
-                prompt = f"""
+    def _build_batch_prompt(self, batch_text: str) -> str:
+        """Build the prompt asking the model to analyze a batch of rendered emails"""
+        return f"""
                 Analyze the following emails and provide a JSON response with this exact structure:
                 {{
                     "emails": [
@@ -120,24 +253,9 @@ class AIService:
                 Respond ONLY with the JSON structure, no additional text.
                 """
 
-                response = self._call_openrouter(prompt)
-                result = self._parse_json_response(response)
-                
-                for email_result in result.get("emails", []):
-                    category = email_result.get("category", "other").lower()
-                    if category in all_categories:
-                        # Find the original email and add the AI analysis
-                        original_email = next((e for e in batch if e.get('id') == email_result.get('id')), None)
-                        if original_email:
-                            original_email.update({
-                                "ai_summary": email_result.get("summary", ""),
-                                "importance": email_result.get("importance", "")
-                            })
-                            all_categories[category].append(original_email)
-                            all_summaries.append(email_result.get("summary", ""))
-
-            # Generate overall summary
-            summary_prompt = f"""
+    def _build_summary_prompt(self, all_summaries: List[str]) -> str:
+        """Build the prompt for the overall summary of a set of email summaries"""
+        return f"""
             Based on these email summaries:
             {chr(10).join(all_summaries)}
 
@@ -149,12 +267,181 @@ class AIService:
             Keep the summary under 200 words.
             """
 
-            overall_summary = self._call_openrouter(summary_prompt)
+    def _valid_result(self, email_result) -> Optional[Dict]:
+        """An email result normalized and checked against the schema, None if it does not match"""
+        if not isinstance(email_result, dict):
+            return None
+        email_result = {
+            **email_result,
+            "id": str(email_result.get("id", "")).strip(),
+            "category": str(email_result.get("category", "")).strip().lower(),
+            "importance": email_result.get("importance") or ""
+        }
+        try:
+            validate_schema(email_result, EMAIL_ANALYSIS_SCHEMA)
+        except LLMJSONError as e:
+            logger.debug(f"Discarding email result: {str(e)}")
+            return None
+        return email_result
+
+    def _match_results(
+        self,
+        batch: List[Tuple[EmailRecord, str]],
+        email_results: List,
+        pair_unknown_ids: bool = True
+    ) -> List[Tuple[EmailRecord, str, Dict]]:
+        """
+        Pair the model's per-email results with the (email, cache key) pairs
+        they describe. Results that do not match the schema are left out.
+
+        With pair_unknown_ids, results whose id matches no email are paired in
+        order with the emails left without a result when there are as many of
+        both, since models sometimes renumber or reformat ids.
+        """
+        by_id = {email.id: (email, key) for email, key in batch}
+        matches = []
+        matched = set()
+        unknown = []
+        for email_result in email_results:
+            email_result = self._valid_result(email_result)
+            if email_result is None:
+                continue
+            analysis = {
+                "category": email_result["category"],
+                "summary": email_result["summary"],
+                "importance": email_result["importance"]
+            }
+            match = by_id.get(email_result["id"])
+            if match and match[1] not in matched:
+                matched.add(match[1])
+                matches.append((match[0], match[1], analysis))
+            else:
+                unknown.append(analysis)
+        unmatched = [(email, key) for email, key in batch if key not in matched]
+        if pair_unknown_ids and unknown and len(unknown) == len(unmatched):
+            logger.debug(f"Pairing {len(unknown)} results with unknown ids by position")
+            matches.extend((email, key, analysis) for (email, key), analysis in zip(unmatched, unknown))
+        return matches
+
+    async def _analyze_batch(
+        self,
+        batch: List[Tuple[EmailRecord, str]],
+        batch_text: Optional[str] = None,
+        retries: Optional[int] = None
+    ) -> Tuple[List[Tuple[EmailRecord, str, Dict]], List[Tuple[EmailRecord, str]], int]:
+        """
+        Analyze a batch of (email, cache key) pairs with one LLM call, then ask
+        again for only the emails the response left out or got wrong. When an
+        attempt yields nothing the remaining emails are split in halves, so a
+        response that keeps failing (cut off at the token limit, or tripped up
+        by one email) does not take the whole batch with it.
+
+        A batch no model answered is not retried; the router has already
+        failed over between models. Returns the matches, the emails left
+        without an analysis and the number of LLM calls made.
+        """
+        retries = settings.LLM_BATCH_RETRIES if retries is None else retries
+        if batch_text is None:
+            batch_text = "".join(self.packer.render(email) for email, _ in batch)
+        try:
+            response = await self._call_openrouter(self._build_batch_prompt(batch_text))
+        except LLMError as e:
+            logger.error(f"Batch of {len(batch)} emails failed: {str(e)}")
+            return [], batch, 1
+        try:
+            matches = self._match_results(batch, self._parse_batch_response(response))
+        except LLMJSONError as e:
+            logger.warning(f"Unusable response for a batch of {len(batch)} emails: {str(e)}")
+            matches = []
+
+        done = {key for _, key, _ in matches}
+        missing = [(email, key) for email, key in batch if key not in done]
+        if not missing or retries <= 0:
+            return matches, missing, 1
+
+        logger.info(f"Retrying {len(missing)} of {len(batch)} emails missing from a batch response")
+        if matches or len(missing) == 1:
+            parts = [missing]
+        else:
+            half = len(missing) // 2
+            parts = [missing[:half], missing[half:]]
+        results = await asyncio.gather(*(self._analyze_batch(part, retries=retries - 1) for part in parts))
+        calls = 1
+        missing = []
+        for part_matches, part_missing, part_calls in results:
+            matches.extend(part_matches)
+            missing.extend(part_missing)
+            calls += part_calls
+        return matches, missing, calls
+
+    def _apply_analysis(self, email: EmailRecord, analysis: Dict, all_categories: Dict, all_summaries: List[str]) -> None:
+        """Attach an email's AI analysis to it and file it under its category"""
+        email.apply_analysis(analysis)
+        all_categories[email.category].append(email)
+        all_summaries.append(email.summary)
+
+    async def _analyze_emails(self, emails: List[EmailRecord]) -> Tuple[Dict[str, List[EmailRecord]], List[str], int]:
+        """
+        Categorize and summarize each email, from the cache or the local
+        classifier where possible.
+
+        Returns the emails by category, their summaries and how many LLM calls it took.
+        """
+        all_categories = {category: [] for category in CATEGORIES}
+        all_summaries = []
+
+        cached, uncached = self._split_cached(emails)
+        local, batches = self._plan_batches(uncached)
+        for email, analysis in cached + local:
+            self._apply_analysis(email, analysis, all_categories, all_summaries)
+
+        # Send all batches at once; the semaphore caps how many are in flight
+        # and gather keeps the results in batch order
+        results = await asyncio.gather(
+            *(self._analyze_batch(batch, batch_text) for batch, batch_text in batches),
+            return_exceptions=True
+        )
+
+        new_analyses = {}
+        calls = 0
+        for result in results:
+            if isinstance(result, Exception):
+                # The batch's emails stay unanalyzed; the others are still used
+                logger.error(f"Error analyzing batch: {str(result)}")
+                continue
+            matches, missing, batch_calls = result
+            calls += batch_calls
+            if missing:
+                logger.warning(f"{len(missing)} emails left without an analysis")
+            for original_email, key, analysis in matches:
+                self._apply_analysis(original_email, analysis, all_categories, all_summaries)
+                self._learn(original_email, analysis)
+                new_analyses[key] = analysis
+
+        if self.cache:
+            self.cache.put_many(new_analyses)
+        return all_categories, all_summaries, calls
+
+    async def summarize_emails(self, emails: List[Union[EmailRecord, Dict]]) -> Dict:
+        """
+        Summarize a batch of emails and categorize them using OpenRouter.
+
+        Each analyzed email is listed once under "emails"; the categories and
+        important emails refer to them by id.
+        """
+        try:
+            if not emails:
+                return {"error": "No emails provided"}
+
+            emails = to_records(emails)
+            all_categories, all_summaries, _ = await self._analyze_emails(emails)
+            overall_summary = await self._overall_summary(all_categories, all_summaries)
 
             return {
                 "total_emails": len(emails),
-                "categories": all_categories,
-                "important_emails": all_categories["important"],
+                "emails": [email.to_dict() for email in emails if email.category is not None],
+                "categories": {category: [email.id for email in items] for category, items in all_categories.items()},
+                "important_emails": [email.id for email in all_categories["important"]],
                 "summary_text": overall_summary,
                 "processed_at": datetime.now().isoformat()
             }
@@ -162,7 +449,196 @@ class AIService:
             logger.error(f"Error in summarize_emails: {str(e)}")
             raise Exception(f"Failed to summarize emails: {str(e)}")
 
-    def generate_notification_summary(self, emails: List[Dict]) -> str:
+    async def _overall_summary(self, all_categories: Dict[str, List[EmailRecord]], all_summaries: List[str]) -> str:
+        """The model's overall summary, or a count per category when no model answered"""
+        try:
+            return await self._call_openrouter(self._build_summary_prompt(all_summaries), task="summary")
+        except LLMError:
+            overview = self._category_overview(all_categories)
+            return f"Summary unavailable right now. Your emails: {overview}." if overview else "Summary unavailable right now."
+
+    def _format_analyses(self, all_categories: Dict[str, List[EmailRecord]]) -> str:
+        """List every analyzed email with its category, summary and importance for a prompt"""
+        lines = []
+        for category, items in all_categories.items():
+            for email in items:
+                line = f"- [{category}] {email.subject} (From: {email.sender}): {email.summary}"
+                if email.importance:
+                    line += f" Why it matters: {email.importance}"
+                lines.append(line)
+        return "\n".join(lines)
+
+    def _category_overview(self, all_categories: Dict[str, List[EmailRecord]]) -> str:
+        """Describe how many emails fell into each category, e.g. '3 work, 1 personal'"""
+        return ", ".join(f"{len(items)} {category}" for category, items in all_categories.items() if items)
+
+    def _describe(self, email: EmailRecord) -> str:
+        return f"{email.subject}: {email.summary}".rstrip(": ")
+
+    def _compose_notification(self, emails: List[EmailRecord], all_categories: Dict[str, List[EmailRecord]]) -> Dict:
+        """Build the notification summary directly from the per-email analyses, without the model"""
+        overview = self._category_overview(all_categories)
+        return {
+            "email_summary": {
+                "greeting": "Hey there!",
+                "overview": f"You have {len(emails)} new emails" + (f" ({overview})." if overview else "."),
+                "attention_needed": [
+                    f"{email.subject}: {email.importance or email.summary}"
+                    for email in all_categories["important"]
+                ],
+                "action_items": [
+                    email.importance
+                    for category, items in all_categories.items() if category != "important"
+                    for email in items if email.importance
+                ],
+                "email_list": [
+                    f"{email.subject} (From: {email.sender})"
+                    + (f" - {email.summary}" if email.summary else "")
+                    for email in emails
+                ],
+                "closing": "Let me know if you need anything else!"
+            }
+        }
+
+    def _compose_daily_digest(self, emails: List[EmailRecord], all_categories: Dict[str, List[EmailRecord]]) -> Dict:
+        """Build the daily digest directly from the per-email analyses, without the model"""
+        overview = self._category_overview(all_categories)
+        return {
+            "daily_digest": {
+                "overview": {
+                    "description": f"You received {len(emails)} emails" + (f" ({overview})." if overview else "."),
+                    "total_emails_processed": str(len(emails)),
+                    "main_topics": [f"{category.capitalize()} ({len(items)})" for category, items in all_categories.items() if items]
+                },
+                "important_updates_and_announcements": {
+                    "updates": [self._describe(email) for email in all_categories["important"]],
+                    "announcements": [self._describe(email) for email in all_categories["newsletters"]],
+                    "notes": ""
+                },
+                "action_items_and_follow_ups": {
+                    "key_action_items": [
+                        email.importance
+                        for items in all_categories.values()
+                        for email in items if email.importance
+                    ],
+                    "follow_ups": [self._describe(email) for email in all_categories["personal"]],
+                    "deadlines": ""
+                },
+                "key_discussions_and_decisions": {
+                    "discussions": [self._describe(email) for email in all_categories["work"]],
+                    "decisions": [],
+                    "notes": ""
+                },
+                "additional_notes": ""
+            }
+        }
+
+    async def stream_summarize_emails(self, emails: List[Union[EmailRecord, Dict]]) -> AsyncIterator[Dict]:
+        """
+        Summarize emails like summarize_emails, yielding events as results arrive.
+
+        Yields an "email" event for each email as soon as the model has finished
+        its analysis, an "error" event for each batch that failed, "ping" events
+        while waiting on the model, and a final "summary" event.
+        """
+        if not emails:
+            yield {"event": "error", "data": {"error": "No emails provided"}}
+            return
+
+        emails = to_records(emails)
+        all_categories = {category: [] for category in CATEGORIES}
+        all_summaries = []
+
+        cached, uncached = self._split_cached(emails)
+        local, batches = self._plan_batches(uncached)
+        for email, analysis in cached + local:
+            self._apply_analysis(email, analysis, all_categories, all_summaries)
+            yield {"event": "email", "data": email.to_dict()}
+
+        queue = asyncio.Queue()
+
+        async def run_batch(batch, batch_text):
+            scanner = JSONObjectStream()
+            emitted = set()
+            try:
+                prompt = self._build_batch_prompt(batch_text)
+                async for chunk in self._stream_openrouter(prompt):
+                    for match in self._match_results(batch, scanner.feed(chunk), pair_unknown_ids=False):
+                        if match[1] not in emitted:
+                            emitted.add(match[1])
+                            await queue.put(("email", match))
+                # Pick up results the incremental scan could not attribute
+                try:
+                    matches = [match for match in self._match_results(batch, self._parse_batch_response(scanner.text)) if match[1] not in emitted]
+                except LLMJSONError:
+                    matches = []
+                # Ask again for only the emails the response left out
+                found = emitted | {key for _, key, _ in matches}
+                pending = [(email, key) for email, key in batch if key not in found]
+                missing = pending
+                if pending and settings.LLM_BATCH_RETRIES > 0:
+                    retried, missing, _ = await self._analyze_batch(pending, retries=settings.LLM_BATCH_RETRIES - 1)
+                    matches.extend(retried)
+                for match in matches:
+                    emitted.add(match[1])
+                    await queue.put(("email", match))
+                if missing:
+                    raise LLMError(f"No analysis for {len(missing)} emails after retrying")
+            except Exception as e:
+                logger.error(f"Error streaming batch analysis: {str(e)}")
+                await queue.put(("error", {
+                    "ids": [email.id for email, key in batch if key not in emitted],
+                    "error": str(e)
+                }))
+            finally:
+                await queue.put(("done", None))
+
+        tasks = [asyncio.create_task(run_batch(batch, batch_text)) for batch, batch_text in batches]
+        new_analyses = {}
+        try:
+            remaining = len(tasks)
+            while remaining:
+                try:
+                    kind, payload = await asyncio.wait_for(queue.get(), timeout=settings.STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield {"event": "ping", "data": {}}
+                    continue
+                if kind == "done":
+                    remaining -= 1
+                elif kind == "email":
+                    email, key, analysis = payload
+                    self._apply_analysis(email, analysis, all_categories, all_summaries)
+                    self._learn(email, analysis)
+                    new_analyses[key] = analysis
+                    yield {"event": "email", "data": email.to_dict()}
+                else:
+                    yield {"event": "error", "data": payload}
+        finally:
+            # Stop outstanding batches if the client went away
+            for task in tasks:
+                task.cancel()
+
+        if self.cache:
+            self.cache.put_many(new_analyses)
+
+        summary_task = asyncio.create_task(self._overall_summary(all_categories, all_summaries))
+        try:
+            while not summary_task.done():
+                await asyncio.wait({summary_task}, timeout=settings.STREAM_KEEPALIVE_SECONDS)
+                if not summary_task.done():
+                    yield {"event": "ping", "data": {}}
+        finally:
+            summary_task.cancel()
+
+        yield {"event": "summary", "data": {
+            "total_emails": len(emails),
+            "category_counts": {category: len(items) for category, items in all_categories.items()},
+            "important_emails": [email.id for email in all_categories["important"]],
+            "summary_text": summary_task.result(),
+            "processed_at": datetime.now().isoformat()
+        }}
+
+    async def generate_notification_summary(self, emails: List[Union[EmailRecord, Dict]]) -> str:
         """
         Generate a concise summary for notifications using OpenRouter
         """
@@ -170,11 +646,19 @@ class AIService:
             if not emails:
                 return "No new emails to summarize."
 
+            emails = to_records(emails)
+            all_categories, _, llm_calls = await self._analyze_emails(emails)
+            if llm_calls == 0:
+                # Every analysis came from the cache or the local classifier, so the summary can be built without the model
+                logger.debug("All emails analyzed from cache, composing notification summary locally")
+                return json.dumps(self._compose_notification(emails, all_categories))
+
             try:
-                summary = self.summarize_emails(emails)
-                
+                # One call turns the per-email analyses into the final structure
                 prompt = f"""
-                Based on this email analysis: {summary.get('summary_text', '')}
+                Based on these email analyses:
+                {self._format_analyses(all_categories)}
+
                 Create a friendly email summary in the following JSON structure. Return ONLY the JSON, no other text:
 
                 {{
@@ -197,39 +681,15 @@ class AIService:
                 IMPORTANT: Return ONLY the JSON object, no additional text, no code blocks, no explanations.
                 """
 
-                response = self._call_openrouter(prompt)
-                if "Error processing request" in response:
-                    raise Exception(response)
-                    
-                # Try to parse the response to ensure it's valid JSON
-                try:
-                    json.loads(response)
-                    return response
-                except json.JSONDecodeError:
-                    # If not valid JSON, try to extract JSON from the response
-                    import re
-                    json_match = re.search(r'({[\s\S]*})', response)
-                    if json_match:
-                        return json_match.group(1)
-                    raise ValueError("Response is not valid JSON")
+                response = await self._call_openrouter(prompt, task="notification")
+
+                # Return the object alone, without fences or text around it
+                return json.dumps(extract_json(response, "email_summary"))
                 
             except Exception as e:
                 logger.error(f"Error generating AI summary: {str(e)}")
-                # Create a basic JSON structure as fallback
-                email_list = [f"{email.get('subject', 'No Subject')} (From: {email.get('from', 'Unknown Sender')})" 
-                            for email in emails]
-                
-                basic_summary = {
-                    "email_summary": {
-                        "greeting": "Hey there!",
-                        "overview": "Here's a quick summary of your emails:",
-                        "attention_needed": [],
-                        "action_items": [],
-                        "email_list": email_list,
-                        "closing": "Let me know if you need anything else!"
-                    }
-                }
-                return json.dumps(basic_summary)
+                # Fall back to the structure built from the per-email analyses
+                return json.dumps(self._compose_notification(emails, all_categories))
                 
         except Exception as e:
             logger.error(f"Error in generate_notification_summary: {str(e)}")
@@ -244,15 +704,27 @@ class AIService:
                 }
             })
 
-    def generate_daily_digest(self, emails: List[Dict]) -> str:
+    async def generate_daily_digest(self, emails: List[Union[EmailRecord, Dict]]) -> str:
         """
         Generate a detailed daily digest using OpenRouter
         """
         try:
-            summary = self.summarize_emails(emails)
-            
+            emails = to_records(emails)
+            all_categories, _, llm_calls = await self._analyze_emails(emails)
+            if llm_calls == 0:
+                # Every analysis came from the cache or the local classifier, so the digest can be built without the model
+                logger.debug("All emails analyzed from cache, composing daily digest locally")
+                return json.dumps(self._compose_daily_digest(emails, all_categories))
+        except Exception as e:
+            logger.error(f"Error analyzing emails for daily digest: {str(e)}")
+            return json.dumps(DIGEST_ERROR_FALLBACK)
+
+        try:
+            # One call turns the per-email analyses into the final structure
             prompt = f"""
-            Based on this email analysis: {summary['summary_text']}
+            Based on these email analyses ({len(emails)} emails in total):
+            {self._format_analyses(all_categories)}
+
             Create a comprehensive daily digest in the following JSON structure. Return ONLY the JSON, no markdown or code blocks:
 
             {{
@@ -285,49 +757,14 @@ class AIService:
             Make it friendly and conversational while maintaining professionalism.
             """
 
-            response = self._call_openrouter(prompt)
-            if "Error processing request" in response:
-                raise Exception(response)
-                
-            # Try to parse the response to ensure it's valid JSON
-            try:
-                json.loads(response)
-                return response
-            except json.JSONDecodeError:
-                # If not valid JSON, try to extract JSON from the response
-                import re
-                json_match = re.search(r'({[\s\S]*})', response)
-                if json_match:
-                    return json_match.group(1)
-                raise ValueError("Response is not valid JSON")
+            response = await self._call_openrouter(prompt, task="digest")
+
+            # Return the object alone, without fences or text around it
+            return json.dumps(extract_json(response, "daily_digest"))
                 
         except Exception as e:
             logger.error(f"Error generating daily digest: {str(e)}")
-            # Return a basic digest structure as fallback
-            return json.dumps({
-                "daily_digest": {
-                    "overview": {
-                        "description": "Sorry, I encountered an error while generating your daily digest.",
-                        "total_emails_processed": "0",
-                        "main_topics": []
-                    },
-                    "important_updates_and_announcements": {
-                        "updates": [],
-                        "announcements": [],
-                        "notes": "Unable to process updates at this time."
-                    },
-                    "action_items_and_follow_ups": {
-                        "key_action_items": [],
-                        "follow_ups": [],
-                        "deadlines": "None"
-                    },
-                    "key_discussions_and_decisions": {
-                        "discussions": [],
-                        "decisions": [],
-                        "notes": "Unable to process discussions at this time."
-                    },
-                    "additional_notes": "Please try again later."
-                }
-            })
+            # Fall back to the digest built from the per-email analyses
+            return json.dumps(self._compose_daily_digest(emails, all_categories))
 
 ai_service = AIService() 
\ No newline at end of file
@@ -0,0 +1,103 @@
+from services.db import in_chunks, open_database
+from services.metrics import record_cache
+from models.email import EmailRecord
+from config import settings
+from typing import Dict, Iterable, Optional
+import hashlib
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class AnalysisCache:
+    """
+    Persistent cache of per-email AI analysis results (category, summary, importance).
+
+    Entries are keyed by message id, the model name and a hash of the email
+    content the prompt is built from, so an edited email or a model change
+    gets analyzed again. Entries expire after a TTL and the least recently
+    used ones are evicted once the cache is full.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl_seconds: Optional[int] = None, max_entries: Optional[int] = None):
+        self.ttl_seconds = ttl_seconds or settings.ANALYSIS_CACHE_TTL_SECONDS
+        self.max_entries = max_entries or settings.ANALYSIS_CACHE_MAX_ENTRIES
+        self._lock = threading.Lock()
+        self._conn = open_database("analysis_cache.db", path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS analyses (
+                key TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS analyses_last_access ON analyses (last_access)")
+        self._size = self._conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+
+    @staticmethod
+    def make_key(email: EmailRecord, model: str) -> str:
+        """Build the cache key of an email's analysis by a model"""
+        content = json.dumps([model, email.subject, email.sender, email.date, email.body])
+        digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        return f"{email.id}:{digest}"
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict]:
+        """Get the unexpired cached analyses among keys"""
+        keys = list(dict.fromkeys(keys))
+        now = time.time()
+        found = {}
+        with self._lock:
+            # One parameter of each statement is the expiry time
+            for chunk, placeholders in in_chunks(keys, reserved=1):
+                rows = self._conn.execute(
+                    f"SELECT key, data FROM analyses WHERE key IN ({placeholders}) AND created_at > ?",
+                    [*chunk, now - self.ttl_seconds]
+                ).fetchall()
+                for row in rows:
+                    found[row["key"]] = json.loads(row["data"])
+                if rows:
+                    hits = [row["key"] for row in rows]
+                    self._conn.execute(
+                        f"UPDATE analyses SET last_access = ? WHERE key IN ({','.join('?' * len(hits))})",
+                        [now, *hits]
+                    )
+        logger.debug(f"Analysis cache hit {len(found)} of {len(keys)} emails")
+        record_cache("analysis", len(found), len(keys) - len(found))
+        return found
+
+    def put_many(self, analyses: Dict[str, Dict]) -> None:
+        """Cache analyses by key, evicting expired and least recently used entries when full"""
+        if not analyses:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO analyses (key, data, created_at, last_access) VALUES (?, ?, ?, ?)",
+                    [(key, json.dumps(analysis), now, now) for key, analysis in analyses.items()]
+                )
+                self._size = self._conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+                if self._size > self.max_entries:
+                    self._evict(now)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries, then the least recently used ones down to 90% of capacity"""
+        self._conn.execute("DELETE FROM analyses WHERE created_at <= ?", (now - self.ttl_seconds,))
+        excess = self._conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0] - int(self.max_entries * 0.9)
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM analyses WHERE key IN (SELECT key FROM analyses ORDER BY last_access LIMIT ?)",
+                (excess,)
+            )
+        self._size = self._conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+        logger.debug(f"Analysis cache evicted down to {self._size} entries")
+
+analysis_cache = AnalysisCache()
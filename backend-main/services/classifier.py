@@ -0,0 +1,168 @@
+from config import settings
+from models.email import EmailRecord
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import json
+import logging
+import math
+import re
+
+logger = logging.getLogger(__name__)
+
+# Mailing platforms that only ever send bulk mail
+BULK_SENDER_DOMAINS = (
+    "mailchimp.com", "mcsv.net", "mcdlv.net", "sendgrid.net", "sendgrid.com", "mailgun.org",
+    "amazonses.com", "hubspotemail.net", "hs-email.net", "constantcontact.com", "substack.com",
+    "sparkpostmail.com", "mandrillapp.com", "cmail19.com", "cmail20.com", "klaviyomail.com",
+    "exacttarget.com", "rsgsv.net", "beehiiv.com", "convertkit-mail.com", "mailerlite.com"
+)
+_NO_REPLY = re.compile(r"^(no[-_.]?reply|do[-_.]?not[-_.]?reply|newsletters?|news|marketing|promo(tions)?|mailer|digest|updates?)\b")
+_ADDRESS = re.compile(r"<?([\w.+-]+)@([\w.-]+)>?\s*$")
+_WORD = re.compile(r"[a-z0-9]{2,}")
+
+class EmailClassifier:
+    """
+    Local classifier run before the LLM so obvious emails skip it.
+
+    Header rules catch bulk mail (List-Unsubscribe, Precedence: bulk, bulk
+    mailing platforms, no-reply senders). A multinomial naive Bayes model over
+    subject and sender tokens learns from the categories the LLM assigns and
+    takes over once it has seen enough emails. Only confident answers are used.
+    """
+
+    def __init__(self, path: Optional[str] = None, confidence: Optional[float] = None, min_training_emails: Optional[int] = None):
+        self.path = Path(path) if path else Path(settings.DATA_DIR) / "classifier.json"
+        self.confidence = confidence or settings.CLASSIFIER_CONFIDENCE
+        self.min_training_emails = min_training_emails if min_training_emails is not None else settings.CLASSIFIER_MIN_TRAINING_EMAILS
+        self._class_docs = Counter()
+        self._token_counts: Dict[str, Counter] = {}
+        self._class_tokens = Counter()
+        self._vocabulary = set()
+        self._unsaved = 0
+        self._stats = Counter()
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text())
+            self._class_docs = Counter(data["class_docs"])
+            self._token_counts = {category: Counter(counts) for category, counts in data["token_counts"].items()}
+        except Exception as e:
+            logger.error(f"Error loading classifier model, starting empty: {str(e)}")
+            self._class_docs = Counter()
+            self._token_counts = {}
+        for category, counts in self._token_counts.items():
+            self._class_tokens[category] = sum(counts.values())
+            self._vocabulary.update(counts)
+
+    def save(self) -> None:
+        """Persist the learned model"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps({
+            "class_docs": self._class_docs,
+            "token_counts": self._token_counts
+        }))
+        self._unsaved = 0
+
+    def _tokens(self, email: EmailRecord) -> List[str]:
+        tokens = _WORD.findall(email.subject.lower())
+        match = _ADDRESS.search(email.sender.lower())
+        if match:
+            local, domain = match.groups()
+            tokens.append(f"from:{domain}")
+            tokens.extend(f"sender:{word}" for word in _WORD.findall(local))
+        return tokens
+
+    def _rule(self, email: EmailRecord) -> Optional[Tuple[float, str]]:
+        """Match the bulk mail header rules, returning (confidence, rule name)"""
+        if email.list_unsubscribe:
+            return 0.97, "list_unsubscribe"
+        if email.precedence.strip().lower() in ("bulk", "list", "junk"):
+            return 0.95, "precedence"
+        if "CATEGORY_PROMOTIONS" in email.labels:
+            return 0.95, "promotions_label"
+        match = _ADDRESS.search(email.sender.lower())
+        if match:
+            local, domain = match.groups()
+            if any(domain == bulk or domain.endswith("." + bulk) for bulk in BULK_SENDER_DOMAINS):
+                return 0.93, "bulk_sender_domain"
+            if _NO_REPLY.match(local):
+                return 0.9, "no_reply_sender"
+        return None
+
+    def _predict(self, tokens: List[str]) -> Tuple[Optional[str], float]:
+        """Most likely category and its posterior probability under the learned model"""
+        total_docs = sum(self._class_docs.values())
+        if total_docs < self.min_training_emails or not tokens:
+            return None, 0.0
+        vocabulary_size = len(self._vocabulary) + 1
+        scores = {}
+        for category, docs in self._class_docs.items():
+            counts = self._token_counts.get(category, Counter())
+            denominator = self._class_tokens[category] + vocabulary_size
+            score = math.log(docs / total_docs)
+            for token in tokens:
+                score += math.log((counts[token] + 1) / denominator)
+            scores[category] = score
+        best = max(scores, key=scores.get)
+        # Normalize in log space to get the posterior of the best category
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / total
+
+    def classify(self, email: EmailRecord) -> Optional[Dict]:
+        """
+        Classify an email locally, returning an analysis like the LLM's
+        or None when the email should go to the LLM
+        """
+        self._stats["emails"] += 1
+        rule = self._rule(email)
+        if rule:
+            confidence, reason = rule
+            category = "newsletters"
+        else:
+            category, confidence = self._predict(self._tokens(email))
+            reason = "naive_bayes"
+        if category is None or confidence < self.confidence:
+            return None
+        self._stats["hits"] += 1
+        self._stats[f"hits_{reason}"] += 1
+        return {
+            "category": category,
+            "summary": email.subject,
+            "importance": "",
+            "classified_by": reason
+        }
+
+    def observe(self, email: EmailRecord, category: str) -> None:
+        """Learn from the category the LLM assigned to an email"""
+        tokens = self._tokens(email)
+        self._class_docs[category] += 1
+        counts = self._token_counts.setdefault(category, Counter())
+        counts.update(tokens)
+        self._class_tokens[category] += len(tokens)
+        self._vocabulary.update(tokens)
+        self._unsaved += 1
+        if self._unsaved >= 100:
+            self.save()
+
+    def record_llm_calls_avoided(self, count: int) -> None:
+        self._stats["llm_calls_avoided"] += count
+
+    def stats(self) -> Dict:
+        """Hit rate and LLM calls avoided since startup"""
+        emails = self._stats["emails"]
+        return {
+            "emails": emails,
+            "hits": self._stats["hits"],
+            "hit_rate": self._stats["hits"] / emails if emails else 0.0,
+            "llm_calls_avoided": self._stats["llm_calls_avoided"],
+            "hits_by_rule": {
+                key[len("hits_"):]: value for key, value in self._stats.items() if key.startswith("hits_")
+            },
+            "training_emails": sum(self._class_docs.values())
+        }
+
+email_classifier = EmailClassifier()
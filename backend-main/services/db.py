@@ -0,0 +1,34 @@
+from config import settings
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple
+import sqlite3
+
+# SQLite limits the number of bound parameters per statement
+MAX_PARAMS = 500
+
+def open_database(filename: str, path: Optional[str] = None) -> sqlite3.Connection:
+    """
+    Open (and create) a SQLite database in the app's data directory.
+
+    Connections are shared between the event loop and the worker threads, so
+    callers must serialize access to them with their own lock.
+    """
+    db_path = Path(path) if path else Path(settings.DATA_DIR) / filename
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    # WAL lets readers proceed while a write is in progress
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def in_chunks(values: Sequence, reserved: int = 0) -> Iterator[Tuple[List, str]]:
+    """
+    Split values for a `column IN (...)` condition into chunks that fit in a
+    statement, yielding each chunk with its placeholders. reserved is the
+    number of the statement's other parameters.
+    """
+    size = MAX_PARAMS - reserved
+    for i in range(0, len(values), size):
+        chunk = list(values[i:i + size])
+        yield chunk, ",".join("?" * len(chunk))
@@ -0,0 +1,116 @@
+from collections import deque
+from config import settings
+from models.user import UserCredentials
+from services.ai import AIService, ai_service
+from services.email_service import EmailService
+from services.notification import NotificationService, notification_service
+from services.token_manager import TokenManager, token_manager
+from typing import Dict, Optional
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("gmail", "openrouter", "resend")
+
+class DigestWorkerPool:
+    """
+    Generates and sends daily digests for many users at once.
+
+    A global limit bounds how many digests are in progress, and each stage
+    (Gmail fetch, OpenRouter digest, Resend delivery) has its own limit so no
+    upstream is flooded. A user's failure or timeout only affects that user.
+    """
+
+    def __init__(
+        self,
+        email_service: Optional[EmailService] = None,
+        ai: AIService = ai_service,
+        notifications: NotificationService = notification_service,
+        tokens: TokenManager = token_manager,
+        concurrency: Optional[int] = None,
+        stage_concurrency: Optional[Dict[str, int]] = None,
+        user_timeout: Optional[float] = None
+    ):
+        self.email_service = email_service or EmailService()
+        self.ai = ai
+        self.notifications = notifications
+        self.tokens = tokens
+        self.user_timeout = user_timeout or settings.DIGEST_USER_TIMEOUT_SECONDS
+        self._slots = asyncio.Semaphore(concurrency or settings.DIGEST_CONCURRENCY)
+        stage_concurrency = {
+            "gmail": settings.DIGEST_GMAIL_CONCURRENCY,
+            "openrouter": settings.DIGEST_LLM_CONCURRENCY,
+            "resend": settings.DIGEST_RESEND_CONCURRENCY,
+            **(stage_concurrency or {})
+        }
+        self._stage_limits = {stage: asyncio.Semaphore(stage_concurrency[stage]) for stage in STAGES}
+        self._stage_active = dict.fromkeys(STAGES, 0)
+        self._stage_seconds = dict.fromkeys(STAGES, 0.0)
+        self._stage_runs = dict.fromkeys(STAGES, 0)
+        self._counts = {"submitted": 0, "queued": 0, "in_progress": 0, "completed": 0, "failed": 0, "timed_out": 0}
+        self._finished_at = deque(maxlen=10000)
+        self._recent_errors = deque(maxlen=20)
+
+    async def _stage(self, stage: str, coro):
+        async with self._stage_limits[stage]:
+            self._stage_active[stage] += 1
+            started = time.monotonic()
+            try:
+                return await coro
+            finally:
+                self._stage_active[stage] -= 1
+                self._stage_seconds[stage] += time.monotonic() - started
+                self._stage_runs[stage] += 1
+
+    async def _generate(self, user: UserCredentials) -> None:
+        # Refreshed up front if the access token is about to expire
+        credentials = await self.tokens.credentials_for(user)
+        # Fetch emails from the last 24 hours
+        emails = await self._stage("gmail", self.email_service.fetch_emails(credentials, time_range="1d"))
+        digest_content = await self._stage("openrouter", self.ai.generate_daily_digest(emails))
+        await self._stage("resend", self.notifications.send_daily_digest(to=user.email, digest_content=digest_content))
+
+    async def process(self, user: UserCredentials) -> bool:
+        """Generate and send one user's digest, returning whether it was delivered"""
+        self._counts["submitted"] += 1
+        self._counts["queued"] += 1
+        async with self._slots:
+            self._counts["queued"] -= 1
+            self._counts["in_progress"] += 1
+            try:
+                await asyncio.wait_for(self._generate(user), timeout=self.user_timeout)
+                self._counts["completed"] += 1
+                return True
+            except asyncio.TimeoutError:
+                self._counts["timed_out"] += 1
+                self._recent_errors.append({"user_id": user.user_id, "error": f"Timed out after {self.user_timeout}s"})
+                logger.error(f"Digest for user {user.email} timed out after {self.user_timeout}s")
+                return False
+            except Exception as e:
+                self._counts["failed"] += 1
+                self._recent_errors.append({"user_id": user.user_id, "error": str(e)})
+                logger.error(f"Error processing digest for user {user.email}: {str(e)}")
+                return False
+            finally:
+                self._counts["in_progress"] -= 1
+                self._finished_at.append(time.monotonic())
+
+    def metrics(self) -> Dict:
+        """Progress, throughput and per-stage timings for sizing the pool"""
+        now = time.monotonic()
+        last_minute = sum(1 for finished in self._finished_at if now - finished <= 60)
+        return {
+            **self._counts,
+            "digests_per_minute": last_minute,
+            "stages": {
+                stage: {
+                    "active": self._stage_active[stage],
+                    "runs": self._stage_runs[stage],
+                    "avg_seconds": self._stage_seconds[stage] / self._stage_runs[stage] if self._stage_runs[stage] else 0.0
+                }
+                for stage in STAGES
+            },
+            "recent_errors": list(self._recent_errors)
+        }
@@ -0,0 +1,162 @@
+from datetime import datetime, time, timedelta, timezone
+from models.user import UserCredentials
+from services.user_service import UserService, user_service
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import heapq
+import logging
+import pytz
+
+logger = logging.getLogger(__name__)
+
+DigestJob = Callable[[UserCredentials], Awaitable[None]]
+
+def parse_digest_time(value: str) -> time:
+    """A digest_time preference ("HH:MM", hours may be a single digit)"""
+    return datetime.strptime(value, "%H:%M").time()
+
+def validate_preferences(preferences: Dict) -> None:
+    """Raise ValueError if the digest_time or timezone preference cannot be scheduled"""
+    try:
+        parse_digest_time(preferences.get("digest_time", "00:00"))
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid digest_time {preferences.get('digest_time')!r}, expected HH:MM")
+    try:
+        pytz.timezone(preferences.get("timezone", "UTC"))
+    except (pytz.UnknownTimeZoneError, AttributeError):
+        raise ValueError(f"Unknown timezone {preferences.get('timezone')!r}")
+
+def next_fire_time(preferences: Dict, now: datetime) -> datetime:
+    """
+    The next UTC time after now at which a user's digest is due, from the
+    user's digest_time ("HH:MM") and timezone preferences.
+    """
+    user_tz = pytz.timezone(preferences.get("timezone", "UTC"))
+    digest_time = parse_digest_time(preferences.get("digest_time", "00:00"))
+    local_date = now.astimezone(user_tz).date()
+    for days in range(3):
+        # localize and normalize settle times that fall in a DST gap
+        local = user_tz.normalize(user_tz.localize(datetime.combine(local_date + timedelta(days=days), digest_time)))
+        fire_at = local.astimezone(timezone.utc)
+        if fire_at > now:
+            return fire_at
+    raise ValueError(f"No upcoming digest time for preferences {preferences}")
+
+class DigestScheduler:
+    """
+    Runs each user's daily digest at their own digest_time.
+
+    The next UTC fire time of every user is kept in a heap, so the loop sleeps
+    until exactly the earliest one and each wakeup only touches the users that
+    are due. Entries for users whose preferences changed are invalidated
+    lazily by a per-user version number.
+    """
+
+    def __init__(
+        self,
+        job: DigestJob,
+        users: UserService = user_service,
+        clock: Callable[[], datetime] = lambda: datetime.now(timezone.utc)
+    ):
+        self.job = job
+        self.users = users
+        self.clock = clock
+        self._heap: List[Tuple[datetime, int, str]] = []
+        self._versions: Dict[str, int] = {}
+        self._version = 0
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running = set()
+
+    def reschedule(self, user: UserCredentials) -> None:
+        """(Re)index a user after their preferences changed; disabled users are dropped"""
+        self._index(user.user_id, user.preferences)
+
+    def _index(self, user_id: str, preferences: Dict) -> None:
+        self._version += 1
+        if not preferences.get("digest_enabled", True):
+            self._versions.pop(user_id, None)
+            return
+        try:
+            fire_at = next_fire_time(preferences, self.clock())
+        except Exception as e:
+            logger.error(f"Invalid digest preferences for user {user_id}: {str(e)}")
+            self._versions.pop(user_id, None)
+            return
+        self._versions[user_id] = self._version
+        heapq.heappush(self._heap, (fire_at, self._version, user_id))
+        self._changed.set()
+
+    def next_due(self) -> Optional[datetime]:
+        """Fire time of the earliest scheduled digest"""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def _drop_stale(self) -> None:
+        while self._heap and self._versions.get(self._heap[0][2]) != self._heap[0][1]:
+            heapq.heappop(self._heap)
+
+    def _pop_due(self, now: datetime) -> List[str]:
+        due = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            _, _, user_id = heapq.heappop(self._heap)
+            del self._versions[user_id]
+            due.append(user_id)
+
+    async def load(self) -> None:
+        """Index every user with the digest enabled"""
+        # Only the indexed preference columns are read; credentials are decoded when a digest is due
+        for user_id, preferences in await self.users.get_digest_schedules():
+            self._index(user_id, preferences)
+        logger.debug(f"Scheduled daily digests for {len(self._versions)} users")
+
+    async def _run_due(self, user_id: str) -> None:
+        # Read the user again so the digest uses current tokens and preferences
+        user = await self.users.get_user_credentials(user_id)
+        if not user:
+            return
+        self.reschedule(user)
+        try:
+            await self.job(user)
+        except Exception as e:
+            logger.error(f"Error processing digest for user {user.email}: {str(e)}")
+
+    async def run(self) -> None:
+        while True:
+            self._changed.clear()
+            next_due = self.next_due()
+            if next_due is not None:
+                delay = (next_due - self.clock()).total_seconds()
+                if delay > 0:
+                    try:
+                        # Wake early if a preference change moved a digest forward
+                        await asyncio.wait_for(self._changed.wait(), timeout=delay)
+                        continue
+                    except asyncio.TimeoutError:
+                        pass
+            else:
+                await self._changed.wait()
+                continue
+
+            due = self._pop_due(self.clock())
+            if due:
+                logger.debug(f"Running daily digests for {len(due)} users")
+            # Digests run in the background so a slow one cannot delay the next wakeup
+            for user_id in due:
+                task = asyncio.create_task(self._run_due(user_id))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def start(self) -> None:
+        await self.load()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        tasks = [self._task, *self._running] if self._task else list(self._running)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
@@ -0,0 +1,62 @@
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from google.oauth2.credentials import Credentials
+from typing import Dict, Optional, Tuple
+import httplib2
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# APIs the app talks to, loaded at startup
+DEFAULT_APIS = (("gmail", "v1"), ("oauth2", "v2"))
+
+class DiscoveryCache:
+    """
+    Process-wide cache of parsed Google API discovery documents.
+
+    build() re-reads and re-parses the discovery document on every call; building
+    from the already parsed document skips that and never touches the network.
+
+    googleapiclient fixes up a resource's part of the document in place the
+    first time the resource is used, so a document is settled (every
+    resource used once, under the lock) before clients share it.
+    """
+
+    def __init__(self):
+        self._documents: Dict[Tuple[str, str], Dict] = {}
+        self._lock = threading.Lock()
+
+    def preload(self, apis=DEFAULT_APIS) -> None:
+        """Parse the static discovery documents shipped with googleapiclient"""
+        for name, version in apis:
+            self.get_document(name, version)
+        logger.debug(f"Loaded discovery documents: {sorted(self._documents)}")
+
+    def get_document(self, name: str, version: str) -> Dict:
+        """Get the parsed discovery document for an API"""
+        key = (name, version)
+        document = self._documents.get(key)
+        if document is None:
+            with self._lock:
+                document = self._documents.get(key)
+                if document is None:
+                    content = get_static_doc(name, version)
+                    if content is None:
+                        raise ValueError(f"No static discovery document for {name} {version}")
+                    document = json.loads(content)
+                    self._settle(build_from_document(document, http=httplib2.Http()), document)
+                    self._documents[key] = document
+        return document
+
+    def _settle(self, resource, description: Dict) -> None:
+        """Use every resource of a client once, so later clients no longer modify the document"""
+        for name, child in description.get("resources", {}).items():
+            self._settle(getattr(resource, name)(), child)
+
+    def build(self, name: str, version: str, credentials: Optional[Credentials] = None, **kwargs):
+        """Build an API client from the cached discovery document"""
+        return build_from_document(self.get_document(name, version), credentials=credentials, **kwargs)
+
+discovery_cache = DiscoveryCache()
@@ -1,18 +1,20 @@
-from googleapiclient.discovery import build
 from google.oauth2.credentials import Credentials
 import base64
 from email.mime.text import MIMEText
 import json
 from typing import List, Dict
 from config import settings
+from services.gmail import batch_get_messages
+from services.discovery import discovery_cache
+from models.email import EmailRecord
 import datetime
 from datetime import timezone
 
 class EmailService:
     def __init__(self, credentials: Credentials):
-        self.service = build('gmail', 'v1', credentials=credentials)
+        self.service = discovery_cache.build('gmail', 'v1', credentials=credentials)
 
-    def fetch_emails(self, max_results: int = 50) -> List[Dict]:
+    def fetch_emails(self, max_results: int = 50) -> List[EmailRecord]:
         """
         Fetch emails from Gmail inbox
         """
@@ -26,28 +28,48 @@ class EmailService:
             messages = results.get('messages', [])
             emails = []
             
-            for message in messages:
-                msg = self.service.users().messages().get(
-                    userId='me',
-                    id=message['id'],
-                    format='metadata',
-                    metadataHeaders=['From', 'Subject', 'Date']
-                ).execute()
-                
+            fetched, _ = batch_get_messages(
+                self.service,
+                [message['id'] for message in messages],
+                format='metadata',
+                metadataHeaders=['From', 'Subject', 'Date']
+            )
+            
+            for message_id, msg in fetched.items():
                 headers = msg['payload']['headers']
-                email_data = {
-                    'id': message['id'],
-                    'from': next((h['value'] for h in headers if h['name'] == 'From'), ''),
-                    'subject': next((h['value'] for h in headers if h['name'] == 'Subject'), ''),
-                    'date': next((h['value'] for h in headers if h['name'] == 'Date'), ''),
-                    'snippet': msg.get('snippet', '')
-                }
-                emails.append(email_data)
+                emails.append(EmailRecord(
+                    id=message_id,
+                    sender=next((h['value'] for h in headers if h['name'] == 'From'), ''),
+                    subject=next((h['value'] for h in headers if h['name'] == 'Subject'), ''),
+                    date=next((h['value'] for h in headers if h['name'] == 'Date'), ''),
+                    body=msg.get('snippet', ''),
+                    labels=msg.get('labelIds', [])
+                ))
             
             return emails
         except Exception as e:
             raise Exception(f"Error fetching emails: {str(e)}") from e
 
+    def _extract_content(self, message: Dict) -> str:
+        """
+        Decode the text content of a full Gmail message
+        """
+        if 'payload' in message:
+            parts = message['payload'].get('parts', [])
+            for part in parts:
+                if part['mimeType'] == 'text/plain':
+                    data = part['body'].get('data', '')
+                    return base64.urlsafe_b64decode(data).decode('utf-8')
+                elif part['mimeType'] == 'text/html':
+                    data = part['body'].get('data', '')
+                    return base64.urlsafe_b64decode(data).decode('utf-8')
+       
+        # If no parts are found, check if payload itself has data
+        if 'body' in message['payload'] and 'data' in message['payload']['body']:
+            data = message['payload']['body'].get('data', '')
+            return base64.urlsafe_b64decode(data).decode('utf-8')
+        return ''
+
     def get_email_content(self, message_id: str) -> str:
         """
         Get the full content of a specific email
@@ -59,25 +81,11 @@ class EmailService:
                 format='full'
             ).execute()
             
-            if 'payload' in message:
-                parts = message['payload'].get('parts', [])
-                for part in parts:
-                    if part['mimeType'] == 'text/plain':
-                        data = part['body'].get('data', '')
-                        return base64.urlsafe_b64decode(data).decode('utf-8')
-                    elif part['mimeType'] == 'text/html':
-                        data = part['body'].get('data', '')
-                        return base64.urlsafe_b64decode(data).decode('utf-8')
-           
-            # If no parts are found, check if payload itself has data
-            if 'body' in message['payload'] and 'data' in message['payload']['body']:
-                data = message['payload']['body'].get('data', '')
-                return base64.urlsafe_b64decode(data).decode('utf-8')
-            return ''
+            return self._extract_content(message)
         except Exception as e:
             raise Exception(f"Error getting email content: {str(e)}") from e
 
-    def fetch_recent_emails(self, max_results: int = 10) -> List[Dict]:
+    def fetch_recent_emails(self, max_results: int = 10) -> List[EmailRecord]:
         """
         Fetch recent emails for notifications
         """
@@ -106,9 +114,14 @@ class EmailService:
             messages = results.get('messages', [])
             emails = []
             
-            for message in messages:
-                # Process each message as in fetch_emails
-                email_data = self.get_email_content(message['id'])
+            fetched, _ = batch_get_messages(
+                self.service,
+                [message['id'] for message in messages],
+                format='full'
+            )
+            
+            for message in fetched.values():
+                email_data = self._extract_content(message)
                 emails.append(email_data)
             
             return emails
@@ -1,66 +1,135 @@
 import base64
-from googleapiclient.discovery import build
+import threading
+from collections import OrderedDict
 from fastapi import HTTPException
 from google.oauth2.credentials import Credentials
+from typing import Callable, Dict, List, Optional, Tuple
 import logging
 from config import settings
+from services.gmail import batch_get_messages, is_history_expired, is_message_gone, list_history, list_label_changes, run_blocking
+from services.discovery import discovery_cache
+from services.message_store import MessageStore, message_store
+from services.metrics import STAGE_LATENCY
+from services.rate_limiter import GMAIL_UNIT_COSTS, RateLimiter, rate_limiter, user_key
+from models.email import EmailRecord
 logger = logging.getLogger(__name__)
 
+# Gmail address of each mailbox by quota key; services are built per request,
+# so the addresses are kept here to read each profile only once
+_mailbox_addresses: "OrderedDict[str, str]" = OrderedDict()
+_mailbox_lock = threading.Lock()
+
+def build_gmail_service(credentials: Credentials):
+    """Build a Gmail API client for the given credentials"""
+    return discovery_cache.build('gmail', 'v1', credentials=credentials)
+
 class EmailService:
-    def __init__(self):
-        pass
+    def __init__(
+        self,
+        service_factory: Callable = build_gmail_service,
+        store: Optional[MessageStore] = message_store,
+        limiter: RateLimiter = rate_limiter
+    ):
+        self.service_factory = service_factory
+        self.store = store
+        self.limiter = limiter
+
+    def _quota_user(self, credentials: Credentials) -> Optional[str]:
+        """Gmail quotas are per user; the refresh token identifies the user across token refreshes"""
+        return user_key(getattr(credentials, "refresh_token", None) or getattr(credentials, "token", None))
+
+    def _mailbox(self, service, user: Optional[str]) -> Tuple[str, Optional[str]]:
+        """
+        The Gmail address of the mailbox. Unlike the quota key, which changes
+        with the access token of users without a refresh token, it identifies
+        the mailbox for good, so stored messages are kept under it.
+
+        Also returns the mailbox's current history id when the profile had to
+        be read for the address, None otherwise.
+        """
+        with _mailbox_lock:
+            address = _mailbox_addresses.get(user) if user else None
+        if address:
+            return address, None
+        self.limiter.acquire_blocking("gmail", GMAIL_UNIT_COSTS["users.getProfile"], user)
+        profile = service.users().getProfile(userId='me').execute()
+        if user:
+            with _mailbox_lock:
+                _mailbox_addresses[user] = profile['emailAddress']
+                if len(_mailbox_addresses) > settings.CREDENTIAL_CACHE_SIZE:
+                    _mailbox_addresses.popitem(last=False)
+        return profile['emailAddress'], profile['historyId']
+
+    def _update_labels(
+        self,
+        service,
+        mailbox: str,
+        user: Optional[str],
+        history_id: Optional[str] = None
+    ) -> Tuple[str, bool]:
+        """
+        Replay the label changes since the store's cursor for the mailbox.
 
-    async def fetch_emails(self, credentials: Credentials):
+        Returns the history id to record as the cursor once this fetch is
+        stored, and whether the stored labels are up to date. They are not
+        when the mailbox has no cursor yet or Gmail has expired it; then the
+        cursor is history_id, read before this fetch, or the current one.
+        """
+        cursor = self.store.label_cursor(mailbox)
+        if cursor:
+            try:
+                with STAGE_LATENCY.time(stage="gmail_history"):
+                    changes, latest_history_id = list_label_changes(service, cursor, user=user, limiter=self.limiter)
+            except Exception as e:
+                if not is_history_expired(e):
+                    raise
+                logger.debug(f"Label history id {cursor} has expired, fetching stored labels again")
+            else:
+                self.store.apply_label_changes(mailbox, changes)
+                return latest_history_id, True
+        if history_id:
+            return history_id, False
+        # Read the cursor before fetching, so changes made after the fetch are replayed next time
+        self.limiter.acquire_blocking("gmail", GMAIL_UNIT_COSTS["users.getProfile"], user)
+        return service.users().getProfile(userId='me').execute()['historyId'], False
+
+    def _parse_message(self, message_id: str, msg: dict) -> EmailRecord:
+        """Extract the fields we use from a full Gmail message"""
+        headers = msg['payload']['headers']
+        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+        from_email = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
+        date = next((h['value'] for h in headers if h['name'] == 'Date'), '')
+        # Bulk mail markers used by the local classifier
+        list_unsubscribe = next((h['value'] for h in headers if h['name'].lower() == 'list-unsubscribe'), '')
+        precedence = next((h['value'] for h in headers if h['name'].lower() == 'precedence'), '')
+        
+        # Get message body
+        body = ''
+        if 'parts' in msg['payload']:
+            for part in msg['payload']['parts']:
+                if part['mimeType'] == 'text/plain':
+                    body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
+                    break
+        elif 'body' in msg['payload'] and 'data' in msg['payload']['body']:
+            body = base64.urlsafe_b64decode(msg['payload']['body']['data']).decode('utf-8')
+        
+        return EmailRecord(
+            id=message_id,
+            subject=subject,
+            sender=from_email,
+            date=date,
+            body=body,
+            labels=msg.get('labelIds', []),
+            list_unsubscribe=list_unsubscribe,
+            precedence=precedence
+        )
+
+    async def fetch_emails(self, credentials: Credentials, time_range: Optional[str] = None):
         """Fetch emails from Gmail"""
         try:
             logger.debug("Starting to fetch emails")
-            logger.debug("Using credentials for Gmail API access")
-            
-            # Build the Gmail service
-            service = build('gmail', 'v1', credentials=credentials)
-            logger.debug("Successfully built Gmail service")
-            
-            # Get the list of messages
-            results = service.users().messages().list(userId='me').execute()
-            messages = results.get('messages', [])
-            logger.debug(f"Found {len(messages)} messages")
-            
-            if not messages:
-                return []
-                
-            # Fetch full message details
-            emails = []
-            for message in messages[:settings.MAX_EMAILS]:  # Limit to 10 emails for testing
-                try:
-                    msg = service.users().messages().get(userId='me', id=message['id']).execute()
-                    
-                    # Extract email data
-                    headers = msg['payload']['headers']
-                    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-                    from_email = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
-                    date = next((h['value'] for h in headers if h['name'] == 'Date'), '')
-                    
-                    # Get message body
-                    body = ''
-                    if 'parts' in msg['payload']:
-                        for part in msg['payload']['parts']:
-                            if part['mimeType'] == 'text/plain':
-                                body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-                                break
-                    elif 'body' in msg['payload'] and 'data' in msg['payload']['body']:
-                        body = base64.urlsafe_b64decode(msg['payload']['body']['data']).decode('utf-8')
-                    
-                    emails.append({
-                        'id': message['id'],
-                        'subject': subject,
-                        'from': from_email,
-                        'date': date,
-                        'body': body
-                    })
-                except Exception as e:
-                    logger.error(f"Error processing message {message['id']}: {str(e)}")
-                    continue
-                    
+            # The Gmail client blocks, so run the whole fetch on the Gmail thread pool
+            emails = await run_blocking(self._fetch_emails, credentials, time_range)
             logger.debug(f"Successfully processed {len(emails)} emails")
             return emails
         except Exception as e:
@@ -68,4 +137,137 @@ class EmailService:
             raise HTTPException(
                 status_code=500,
                 detail=f"Failed to fetch emails: {str(e)}"
-            ) from e
\ No newline at end of file
+            ) from e
+
+    async def sync_emails(self, credentials: Credentials, history_id: Optional[str] = None) -> Dict:
+        """
+        Fetch only the emails added to the inbox since history_id.
+
+        Without a cursor, or when Gmail has expired it, this falls back to a
+        full fetch. At most about MAX_SYNC_EMAILS messages are returned at a
+        time, oldest first, with has_more set when more are waiting. The
+        returned history_id is the cursor for the next sync; it only moves past
+        messages that were returned, so a message that could not be fetched
+        fails the sync instead of being skipped for good.
+        """
+        try:
+            logger.debug(f"Starting to sync emails from history id {history_id}")
+            result = await run_blocking(self._sync_emails, credentials, history_id)
+            logger.debug(f"Synced {len(result['emails'])} emails (full sync: {result['full_sync']})")
+            return result
+        except Exception as e:
+            logger.error(f"Error syncing emails: {str(e)}", exc_info=True)
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to sync emails: {str(e)}"
+            ) from e
+
+    def _fetch_emails(self, credentials: Credentials, time_range: Optional[str] = None) -> List[EmailRecord]:
+        """List and fetch messages with the blocking Gmail client"""
+        logger.debug("Using credentials for Gmail API access")
+        
+        # Build the Gmail service
+        service = self.service_factory(credentials)
+        logger.debug("Successfully built Gmail service")
+        user = self._quota_user(credentials)
+        return self._get_emails(service, self._list_message_ids(service, time_range, user), user)
+
+    def _sync_emails(self, credentials: Credentials, history_id: Optional[str]) -> Dict:
+        """Incremental sync with the blocking Gmail client"""
+        service = self.service_factory(credentials)
+        user = self._quota_user(credentials)
+        if history_id:
+            try:
+                with STAGE_LATENCY.time(stage="gmail_history"):
+                    message_ids, next_history_id, has_more = list_history(
+                        service, history_id, user=user, limiter=self.limiter, max_messages=settings.MAX_SYNC_EMAILS
+                    )
+            except Exception as e:
+                if not is_history_expired(e):
+                    raise
+                logger.debug(f"History id {history_id} has expired, falling back to a full sync")
+            else:
+                return {
+                    'emails': self._get_emails(service, message_ids, user, strict=True),
+                    'history_id': next_history_id,
+                    'full_sync': False,
+                    'has_more': has_more
+                }
+
+        # Read the cursor before listing so mail arriving in between is picked up next time
+        self.limiter.acquire_blocking("gmail", GMAIL_UNIT_COSTS["users.getProfile"], user)
+        latest_history_id = service.users().getProfile(userId='me').execute()['historyId']
+        return {
+            'emails': self._get_emails(service, self._list_message_ids(service, user=user), user, strict=True),
+            'history_id': latest_history_id,
+            'full_sync': True,
+            'has_more': False
+        }
+
+    def _list_message_ids(self, service, time_range: Optional[str] = None, user: Optional[str] = None) -> List[str]:
+        """List the ids of the most recent inbox messages"""
+        # Get the list of messages, e.g. time_range="1d" for the last day
+        params = {'userId': 'me', 'maxResults': settings.MAX_EMAILS}
+        if time_range:
+            params['q'] = f"newer_than:{time_range}"
+        self.limiter.acquire_blocking("gmail", GMAIL_UNIT_COSTS["users.messages.list"], user)
+        with STAGE_LATENCY.time(stage="gmail_list"):
+            results = service.users().messages().list(**params).execute()
+        messages = results.get('messages', [])
+        logger.debug(f"Found {len(messages)} messages")
+        return [message['id'] for message in messages[:settings.MAX_EMAILS]]  # Limit to 10 emails for testing
+
+    def _get_emails(self, service, message_ids: List[str], user: Optional[str] = None, strict: bool = False) -> List[EmailRecord]:
+        """
+        Fetch and parse messages, downloading only those not already stored locally.
+
+        Labels of stored messages are brought up to date from the mailbox
+        history; only when the history cannot be replayed are they fetched
+        again with minimal format requests. Messages that could not be fetched
+        are skipped, or with strict raise an error, except for messages
+        deleted since they were listed.
+        """
+        if not message_ids:
+            return []
+
+        stored = {}
+        if self.store:
+            mailbox, history_id = self._mailbox(service, user)
+            label_cursor, labels_current = self._update_labels(service, mailbox, user, history_id)
+            stored = self.store.get_many(mailbox, message_ids)
+        errors = {}
+        if stored and not labels_current:
+            with STAGE_LATENCY.time(stage="gmail_get"):
+                labels, errors = batch_get_messages(service, list(stored), user=user, limiter=self.limiter, format='minimal')
+            for message_id, msg in labels.items():
+                stored[message_id].labels = msg.get('labelIds', [])
+            stored = {message_id: email for message_id, email in stored.items() if message_id in labels}
+        missing = [message_id for message_id in message_ids if message_id not in stored and message_id not in errors]
+        logger.debug(f"{len(stored)} messages stored locally, fetching {len(missing)} from Gmail")
+
+        fetched = {}
+        if missing:
+            with STAGE_LATENCY.time(stage="gmail_get"):
+                fetched, fetch_errors = batch_get_messages(service, missing, user=user, limiter=self.limiter)
+            errors.update(fetch_errors)
+        failed = [message_id for message_id, error in errors.items() if not is_message_gone(error)]
+        if strict and failed:
+            raise RuntimeError(f"Could not fetch {len(failed)} of {len(message_ids)} messages from Gmail")
+        if errors:
+            logger.debug(f"Skipping {len(errors)} messages that could not be fetched")
+
+        parsed = {}
+        for message_id, msg in fetched.items():
+            try:
+                with STAGE_LATENCY.time(stage="mime_decode"):
+                    parsed[message_id] = self._parse_message(message_id, msg)
+            except Exception as e:
+                logger.error(f"Error processing message {message_id}: {str(e)}")
+                continue
+        if self.store:
+            self.store.put_many(mailbox, list(parsed.values()))
+            self.store.set_label_cursor(mailbox, label_cursor)
+
+        return [stored.get(message_id) or parsed[message_id]
+                for message_id in message_ids
+                if message_id in stored or message_id in parsed]
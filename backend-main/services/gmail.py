@@ -0,0 +1,195 @@
+from googleapiclient.errors import HttpError
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from config import settings
+from services.rate_limiter import GMAIL_UNIT_COSTS, RateLimiter, rate_limiter, retry_after_seconds
+import asyncio
+import functools
+import logging
+
+logger = logging.getLogger(__name__)
+
+# googleapiclient and httplib2 are blocking, so Gmail work runs on a bounded
+# pool of threads instead of on the event loop. The pool size caps how many
+# fetches a worker has in flight at once.
+_executor = ThreadPoolExecutor(max_workers=settings.GMAIL_MAX_WORKERS, thread_name_prefix="gmail")
+
+# Gmail rejects batch requests with more than 100 calls
+MAX_BATCH_SIZE = 100
+
+# Per-message statuses worth a second attempt (rate limiting and transient backend errors)
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _is_retryable(error: Exception) -> bool:
+    return isinstance(error, HttpError) and error.resp.status in RETRYABLE_STATUSES
+
+
+def batch_get_messages(
+    service,
+    message_ids: List[str],
+    batch_size: Optional[int] = None,
+    retries: int = 1,
+    user: Optional[str] = None,
+    limiter: RateLimiter = rate_limiter,
+    **params
+) -> Tuple[Dict[str, Dict], Dict[str, Exception]]:
+    """
+    Fetch messages with users.messages.get calls grouped into batch requests.
+
+    Every call in a batch is charged to the Gmail quota of user (and of the
+    project), waiting for capacity before the batch is sent. Returns the
+    messages keyed by id (in the order of message_ids) and the errors keyed
+    by id for messages that could not be fetched.
+    """
+    batch_size = max(1, min(batch_size or settings.GMAIL_BATCH_SIZE, MAX_BATCH_SIZE))
+    # Request ids must be unique within a batch
+    pending = list(dict.fromkeys(message_ids))
+    messages = {}
+    errors = {}
+
+    def _callback(request_id, response, exception):
+        if exception is not None:
+            errors[request_id] = exception
+        else:
+            messages[request_id] = response
+
+    # Every users()/messages() access rebuilds that resource's method objects,
+    # so look the resource up once rather than once per message
+    messages_resource = service.users().messages()
+
+    for attempt in range(retries + 1):
+        for i in range(0, len(pending), batch_size):
+            chunk = pending[i:i + batch_size]
+            batch = service.new_batch_http_request(callback=_callback)
+            for message_id in chunk:
+                batch.add(
+                    messages_resource.get(userId='me', id=message_id, **params),
+                    request_id=message_id
+                )
+            limiter.acquire_blocking("gmail", GMAIL_UNIT_COSTS["users.messages.get"] * len(chunk), user)
+            try:
+                batch.execute()
+            except Exception as e:
+                # The batch request itself failed, so every call in it failed
+                logger.error(f"Gmail batch request of {len(chunk)} messages failed: {str(e)}")
+                for message_id in chunk:
+                    errors[message_id] = e
+
+        pending = [message_id for message_id, error in errors.items() if _is_retryable(error)]
+        if not pending or attempt == retries:
+            break
+        throttled = [errors[message_id] for message_id in pending if errors[message_id].resp.status == 429]
+        if throttled:
+            # The retry waits until the quota has recovered
+            limiter.throttled("gmail", retry_after_seconds(throttled[0].resp), user)
+        logger.debug(f"Retrying {len(pending)} messages after retryable batch errors")
+        for message_id in pending:
+            del errors[message_id]
+
+    for message_id, error in errors.items():
+        logger.error(f"Error fetching message {message_id}: {str(error)}")
+
+    ordered = {message_id: messages[message_id] for message_id in dict.fromkeys(message_ids) if message_id in messages}
+    return ordered, errors
+
+
+def list_history(
+    service,
+    start_history_id: str,
+    label_id: str = 'INBOX',
+    user: Optional[str] = None,
+    limiter: RateLimiter = rate_limiter,
+    max_messages: Optional[int] = None
+) -> Tuple[List[str], str, bool]:
+    """
+    List the ids of messages added to a label since start_history_id.
+
+    Returns the message ids (oldest first), the history id to continue from
+    and whether more messages were added after it. With max_messages, listing
+    stops at the first history record that reaches that many messages and
+    the returned history id is that record's, so the rest are listed by the
+    next call; otherwise it is the mailbox's latest history id. Gmail answers
+    404 once the start id is too old to be served.
+    """
+    history = service.users().history()
+    message_ids = []
+    page_token = None
+    while True:
+        params = {
+            'userId': 'me',
+            'startHistoryId': start_history_id,
+            'historyTypes': ['messageAdded'],
+            'labelId': label_id
+        }
+        if page_token:
+            params['pageToken'] = page_token
+        limiter.acquire_blocking("gmail", GMAIL_UNIT_COSTS["users.history.list"], user)
+        response = history.list(**params).execute()
+        records = response.get('history', [])
+        for index, record in enumerate(records):
+            for added in record.get('messagesAdded', []):
+                message_ids.append(added['message']['id'])
+            message_ids = list(dict.fromkeys(message_ids))
+            if max_messages and len(message_ids) >= max_messages and (index < len(records) - 1 or response.get('nextPageToken')):
+                return message_ids, record['id'], True
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return message_ids, response['historyId'], False
+
+
+def list_label_changes(
+    service,
+    start_history_id: str,
+    user: Optional[str] = None,
+    limiter: RateLimiter = rate_limiter
+) -> Tuple[List[Tuple[str, List[str], List[str]]], str]:
+    """
+    List the labels added to and removed from messages since start_history_id.
+
+    Returns (message id, labels added, labels removed) changes in the order
+    they happened and the mailbox's latest history id. Gmail answers 404
+    once the start id is too old to be served.
+    """
+    history = service.users().history()
+    changes = []
+    page_token = None
+    while True:
+        params = {
+            'userId': 'me',
+            'startHistoryId': start_history_id,
+            'historyTypes': ['labelAdded', 'labelRemoved']
+        }
+        if page_token:
+            params['pageToken'] = page_token
+        limiter.acquire_blocking("gmail", GMAIL_UNIT_COSTS["users.history.list"], user)
+        response = history.list(**params).execute()
+        for record in response.get('history', []):
+            for added in record.get('labelsAdded', []):
+                changes.append((added['message']['id'], added.get('labelIds', []), []))
+            for removed in record.get('labelsRemoved', []):
+                changes.append((removed['message']['id'], [], removed.get('labelIds', [])))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return changes, response['historyId']
+
+
+def is_message_gone(error: Exception) -> bool:
+    """Whether a messages.get error means the message was deleted, so no retry can fetch it"""
+    return isinstance(error, HttpError) and error.resp.status == 404
+
+
+def is_history_expired(error: Exception) -> bool:
+    """Whether an error from list_history or list_label_changes means the cursor has to be reset"""
+    return isinstance(error, HttpError) and error.resp.status == 404
+
+
+async def run_blocking(func: Callable, *args, **kwargs):
+    """
+    Run a blocking Gmail call on the Gmail thread pool without stalling the event loop.
+
+    httplib2 connections are not thread safe, so a service object must only be
+    used by one call at a time; build it inside func rather than sharing it.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
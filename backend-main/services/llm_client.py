@@ -0,0 +1,417 @@
+from collections import deque
+from config import settings
+from services.metrics import LLM_CALL_LATENCY
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class LLMError(Exception):
+    """Raised when no model produced a response within the request's deadline"""
+
+class Throttled(Exception):
+    """Raised by create when upstream answered 429; retry_after is the delay it asked for"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"rate limited, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a model after consecutive failures.
+
+    After failure_threshold failures in a row the circuit opens and the model
+    is skipped; once reset_seconds have passed a single probe request is let
+    through, and its outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.clock() - self.opened_at >= self.reset_seconds else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def abandon(self) -> None:
+        """The caller gave up on its request, so it tells nothing about the model"""
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+        self._probing = False
+
+class LatencyWindow:
+    """Latencies of a model's most recent successful calls"""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+class ResilientLLM:
+    """
+    Chat completions across an ordered list of fallback models.
+
+    Every request has a deadline budget shared by all its attempts. A model
+    whose circuit is open is skipped. When a call takes longer than the
+    model's usual latency (hedge_percentile of its recent calls), a second
+    identical request is started and the first answer wins, so one slow
+    upstream request does not set the response time.
+
+    acquire, if given, waits for local rate-limit capacity before each
+    request. That wait is not part of the attempt timeout and never counts
+    against a model's circuit, since it says nothing about the model. The
+    same goes for a request create answers with Throttled: the model is
+    retried up to RATE_LIMIT_MAX_RETRIES times once the delay has passed,
+    waiting in acquire (whose limiter create has paused) or else sleeping.
+    """
+
+    def __init__(
+        self,
+        create: Callable[..., Awaitable],
+        models: Optional[List[str]] = None,
+        deadline_seconds: Optional[float] = None,
+        attempt_timeout: Optional[float] = None,
+        hedge_percentile: Optional[float] = None,
+        hedge_min_samples: Optional[int] = None,
+        failure_threshold: Optional[int] = None,
+        reset_seconds: Optional[float] = None,
+        breakers: Optional[Dict[str, CircuitBreaker]] = None,
+        task: str = "default",
+        acquire: Optional[Callable[[], Awaitable]] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.create = create
+        self.task = task
+        self.acquire = acquire
+        self.models = models or settings.LLM_MODELS
+        self.deadline_seconds = deadline_seconds or settings.LLM_DEADLINE_SECONDS
+        self.attempt_timeout = attempt_timeout or settings.LLM_ATTEMPT_TIMEOUT_SECONDS
+        self.hedge_percentile = hedge_percentile if hedge_percentile is not None else settings.LLM_HEDGE_PERCENTILE
+        self.hedge_min_samples = hedge_min_samples or settings.LLM_HEDGE_MIN_SAMPLES
+        self.clock = clock
+        # Breakers may be shared with other instances using the same models
+        self.breakers = breakers if breakers is not None else {}
+        for model in self.models:
+            self.breakers.setdefault(model, CircuitBreaker(
+                failure_threshold or settings.LLM_BREAKER_FAILURES,
+                reset_seconds or settings.LLM_BREAKER_RESET_SECONDS,
+                clock
+            ))
+        self.latencies = {model: LatencyWindow() for model in self.models}
+        self.counts = {model: {"calls": 0, "failures": 0, "hedged": 0, "skipped": 0} for model in self.models}
+
+    def _hedge_delay(self, model: str) -> Optional[float]:
+        if not self.hedge_percentile or len(self.latencies[model]) < self.hedge_min_samples:
+            return None
+        return self.latencies[model].percentile(self.hedge_percentile)
+
+    async def _acquire(self, retry_after: float = 0) -> None:
+        if self.acquire is not None:
+            await self.acquire()
+        elif retry_after:
+            await asyncio.sleep(retry_after)
+
+    async def _call(self, model: str, kwargs: Dict, timeout: float, acquire: bool = False) -> str:
+        if acquire:
+            await self._acquire()
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            completion = await asyncio.wait_for(self.create(model=model, timeout=timeout, **kwargs), timeout=timeout)
+            if not completion or not completion.choices or not completion.choices[0].message.content:
+                raise LLMError(f"Empty response from {model}")
+            outcome = "ok"
+            return completion.choices[0].message.content
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            raise
+        except Throttled:
+            outcome = "throttled"
+            raise
+        except asyncio.CancelledError:
+            # The losing request of a hedged pair, or a caller that went away
+            outcome = "cancelled"
+            raise
+        finally:
+            LLM_CALL_LATENCY.observe(time.perf_counter() - started, task=self.task, model=model, outcome=outcome)
+
+    async def _attempt(self, model: str, kwargs: Dict, timeout: float) -> str:
+        """One attempt against a model, hedged with a second request if it runs slow"""
+        hedge_delay = self._hedge_delay(model)
+        first = asyncio.create_task(self._call(model, kwargs, timeout))
+        if hedge_delay is None or hedge_delay >= timeout:
+            return await first
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if not done:
+                self.counts[model]["hedged"] += 1
+                tasks.add(asyncio.create_task(self._call(model, kwargs, timeout - hedge_delay, acquire=True)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def complete(self, deadline: Optional[float] = None, **kwargs) -> str:
+        """
+        The text of a chat completion from the first model that answers.
+
+        Raises LLMError when every model failed, was skipped, or the deadline
+        budget ran out.
+        """
+        started = self.clock()
+        budget = deadline or self.deadline_seconds
+        errors = []
+        for model in self.models:
+            remaining = budget - (self.clock() - started)
+            if remaining <= 0:
+                errors.append("deadline exceeded")
+                break
+            # Checked one model at a time, so a half-open circuit is only probed when it is needed
+            if not self.breakers[model].allow():
+                self.counts[model]["skipped"] += 1
+                continue
+            self.counts[model]["calls"] += 1
+            retry_after = 0
+            for throttles in range(settings.RATE_LIMIT_MAX_RETRIES + 1):
+                # Upstream may ask for a longer wait than the deadline leaves
+                remaining = 0
+                if retry_after < budget - (self.clock() - started):
+                    try:
+                        await self._acquire(retry_after)
+                    except asyncio.CancelledError:
+                        self.breakers[model].abandon()
+                        raise
+                    # The attempt is timed from here, once capacity is available
+                    remaining = budget - (self.clock() - started)
+                if remaining <= 0:
+                    self.breakers[model].abandon()
+                    errors.append("deadline exceeded waiting for rate limit capacity")
+                    raise LLMError(f"No model answered: {'; '.join(errors)}")
+                call_started = self.clock()
+                try:
+                    content = await self._attempt(model, kwargs, min(remaining, self.attempt_timeout))
+                except asyncio.CancelledError:
+                    self.breakers[model].abandon()
+                    raise
+                except Throttled as e:
+                    # Upstream capacity, not the model, so the circuit is left alone
+                    logger.warning(f"LLM call to {model} was throttled, retrying after {e.retry_after}s")
+                    retry_after = e.retry_after
+                    continue
+                except Exception as e:
+                    error = "timed out" if isinstance(e, asyncio.TimeoutError) else str(e)
+                    logger.warning(f"LLM call to {model} failed: {error}")
+                    self.counts[model]["failures"] += 1
+                    self.breakers[model].record_failure()
+                    errors.append(f"{model}: {error}")
+                    break
+                self.breakers[model].record_success()
+                self.latencies[model].add(self.clock() - call_started)
+                return content
+            else:
+                self.breakers[model].abandon()
+                errors.append(f"{model}: still rate limited after {settings.RATE_LIMIT_MAX_RETRIES} retries")
+        raise LLMError(f"No model answered: {'; '.join(errors) or 'all circuits are open'}")
+
+    async def stream(self, **kwargs) -> AsyncIterator[str]:
+        """
+        Stream a chat completion from the first model that starts answering.
+
+        A model that fails before sending any text is skipped in favor of the
+        next one; a failure after text was sent is raised.
+        """
+        errors = []
+        for model in self.models:
+            if not self.breakers[model].allow():
+                self.counts[model]["skipped"] += 1
+                continue
+            self.counts[model]["calls"] += 1
+            retry_after = 0
+            for throttles in range(settings.RATE_LIMIT_MAX_RETRIES + 1):
+                sent = False
+                try:
+                    await self._acquire(retry_after)
+                except asyncio.CancelledError:
+                    self.breakers[model].abandon()
+                    raise
+                started = time.perf_counter()
+                outcome = "error"
+                try:
+                    stream = await asyncio.wait_for(
+                        self.create(model=model, stream=True, timeout=self.attempt_timeout, **kwargs),
+                        timeout=self.attempt_timeout
+                    )
+                    async for chunk in stream:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            sent = True
+                            yield chunk.choices[0].delta.content
+                    outcome = "ok"
+                except (asyncio.CancelledError, GeneratorExit):
+                    outcome = "cancelled"
+                    self.breakers[model].abandon()
+                    raise
+                except Throttled as e:
+                    # Upstream capacity, not the model, so the circuit is left alone
+                    outcome = "throttled"
+                    logger.warning(f"LLM stream from {model} was throttled, retrying after {e.retry_after}s")
+                    retry_after = e.retry_after
+                    continue
+                except Exception as e:
+                    outcome = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+                    self.counts[model]["failures"] += 1
+                    self.breakers[model].record_failure()
+                    if sent:
+                        raise
+                    errors.append(f"{model}: {str(e) or type(e).__name__}")
+                    break
+                finally:
+                    LLM_CALL_LATENCY.observe(time.perf_counter() - started, task=self.task, model=model, outcome=outcome)
+                self.breakers[model].record_success()
+                return
+            else:
+                self.breakers[model].abandon()
+                errors.append(f"{model}: still rate limited after {settings.RATE_LIMIT_MAX_RETRIES} retries")
+        raise LLMError(f"No model answered: {'; '.join(errors) or 'all circuits are open'}")
+
+    def stats(self) -> Dict:
+        return {
+            model: {
+                **self.counts[model],
+                "circuit": self.breakers[model].state,
+                "p50_seconds": self.latencies[model].percentile(50),
+                "p95_seconds": self.latencies[model].percentile(95)
+            }
+            for model in self.models
+        }
+
+class TaskRoute:
+    """Model list and generation settings for one kind of LLM request"""
+
+    __slots__ = ("task", "models", "max_tokens", "temperature", "timeout")
+
+    def __init__(self, task: str, models: List[str], max_tokens: int, temperature: float, timeout: float):
+        self.task = task
+        self.models = models
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.timeout = timeout
+
+    @classmethod
+    def from_dict(cls, task: str, route: Dict) -> "TaskRoute":
+        return cls(task, route["models"], route["max_tokens"], route["temperature"], route["timeout"])
+
+class LLMRouter:
+    """
+    Sends each kind of request (categorization, summary, notification,
+    digest) to its own models with its own token limit, temperature and
+    timeout, and records latency per task.
+
+    Every task gets its own ResilientLLM, so hedging thresholds follow the
+    task's latency, while circuit breakers are shared per model.
+    """
+
+    def __init__(self, create: Callable[..., Awaitable], routes: Optional[Dict[str, Dict]] = None, **llm_options):
+        routes = routes if routes is not None else settings.LLM_ROUTES
+        self.routes = {task: TaskRoute.from_dict(task, route) for task, route in routes.items()}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.llms = {
+            task: ResilientLLM(
+                create=create,
+                models=route.models,
+                attempt_timeout=route.timeout,
+                breakers=self.breakers,
+                task=task,
+                **llm_options
+            )
+            for task, route in self.routes.items()
+        }
+        self.latencies = {task: LatencyWindow() for task in self.routes}
+        self.counts = {task: {"calls": 0, "failures": 0} for task in self.routes}
+
+    def route(self, task: str) -> TaskRoute:
+        return self.routes[task]
+
+    def _generation(self, task: str) -> Dict:
+        route = self.routes[task]
+        return {"max_tokens": route.max_tokens, "temperature": route.temperature}
+
+    async def complete(self, task: str, **kwargs) -> str:
+        """The text of a completion for task; raises LLMError like ResilientLLM.complete"""
+        self.counts[task]["calls"] += 1
+        started = time.monotonic()
+        try:
+            content = await self.llms[task].complete(**self._generation(task), **kwargs)
+        except LLMError:
+            self.counts[task]["failures"] += 1
+            raise
+        self.latencies[task].add(time.monotonic() - started)
+        return content
+
+    async def stream(self, task: str, **kwargs) -> AsyncIterator[str]:
+        self.counts[task]["calls"] += 1
+        started = time.monotonic()
+        try:
+            async for text in self.llms[task].stream(**self._generation(task), **kwargs):
+                yield text
+        except LLMError:
+            self.counts[task]["failures"] += 1
+            raise
+        self.latencies[task].add(time.monotonic() - started)
+
+    def stats(self) -> Dict:
+        return {
+            "tasks": {
+                task: {
+                    **self.counts[task],
+                    "models": route.models,
+                    "p50_seconds": self.latencies[task].percentile(50),
+                    "p95_seconds": self.latencies[task].percentile(95)
+                }
+                for task, route in self.routes.items()
+            },
+            "models": {task: llm.stats() for task, llm in self.llms.items()}
+        }
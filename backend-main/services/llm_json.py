@@ -0,0 +1,198 @@
+from services.metrics import STAGE_LATENCY
+from typing import Any, Dict, Iterator, List, Optional
+import json
+import re
+
+# Characters that open, close or quote JSON structure
+_STRUCTURE = re.compile(r'[{}\[\]"]')
+# Inside a string only escapes and the closing quote matter; escapes are skipped as pairs
+_STRING_END = re.compile(r'\\.|"', re.DOTALL)
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+# Lines holding only "..." where a model elided part of the structure
+_ELLIPSIS_LINE = re.compile(r"^[ \t]*\.\.\.[ \t]*\n", re.MULTILINE)
+_decoder = json.JSONDecoder()
+
+class LLMJSONError(ValueError):
+    """Raised when no usable JSON object can be recovered from model output"""
+
+def _closers(stack: List[str]) -> str:
+    return "".join("}" if opener == "{" else "]" for opener in reversed(stack))
+
+def _candidates(text: str, start: int) -> Iterator[str]:
+    """
+    Yield every balanced top-level {...} in text in a single pass, skipping
+    braces inside strings. If the text ends inside an object (the model hit
+    its token limit) the object is yielded cut back to its last complete
+    nested value, then closed as is.
+    """
+    stack = []
+    object_start = None
+    safe = None  # (end, closers) just after the last complete nested value
+    pos = start
+    while True:
+        match = _STRUCTURE.search(text, pos)
+        if not match:
+            break
+        char = match.group()
+        pos = match.end()
+        if char == '"':
+            if not stack:
+                continue
+            while True:
+                end = _STRING_END.search(text, pos)
+                if not end:
+                    # Truncated inside a string
+                    if safe:
+                        yield text[object_start:safe[0]] + safe[1]
+                    yield text[object_start:] + '"' + _closers(stack)
+                    return
+                pos = end.end()
+                if end.group() == '"':
+                    break
+        elif char in "{[":
+            if not stack:
+                if char == "[":
+                    continue
+                object_start = match.start()
+                safe = None
+            stack.append(char)
+        elif stack:
+            if stack[-1] != ("{" if char == "}" else "["):
+                # Mismatched brackets: this is not JSON, look for the next object
+                stack = []
+                continue
+            stack.pop()
+            if stack:
+                safe = (pos, _closers(stack))
+            else:
+                yield text[object_start:pos]
+    if stack:
+        if safe:
+            yield text[object_start:safe[0]] + safe[1]
+        yield text[object_start:].rstrip().rstrip(",") + _closers(stack)
+
+def _loads(candidate: str) -> Optional[Any]:
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        pass
+    # Models often leave a comma before a closing bracket or elide lines with "..."
+    repaired = _TRAILING_COMMA.sub(r"\1", _ELLIPSIS_LINE.sub("", candidate))
+    if repaired != candidate:
+        try:
+            return json.loads(repaired)
+        except json.JSONDecodeError:
+            pass
+    return None
+
+def extract_json(text: Optional[str], required_key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Extract the JSON object from a model response.
+
+    Code fences, prose before or after the object, trailing commas, lines
+    elided with "..." and output truncated mid-object are tolerated. With required_key, only an
+    object that has that key is accepted. Raises LLMJSONError otherwise.
+    """
+    with STAGE_LATENCY.time(stage="json_parse"):
+        return _extract_json(text, required_key)
+
+def _extract_json(text: Optional[str], required_key: Optional[str]) -> Dict[str, Any]:
+    text = text or ""
+    start = text.find("{")
+    if start == -1:
+        raise LLMJSONError("No JSON object in model output")
+
+    # Fast path: the first object is valid JSON; anything after it is ignored
+    try:
+        value, _ = _decoder.raw_decode(text, start)
+        if isinstance(value, dict) and (required_key is None or required_key in value):
+            return value
+    except json.JSONDecodeError:
+        pass
+
+    for candidate in _candidates(text, start):
+        value = _loads(candidate)
+        if isinstance(value, dict) and (required_key is None or required_key in value):
+            return value
+    raise LLMJSONError(f"No valid JSON object{f' with {required_key!r}' if required_key else ''} in model output")
+
+_SCHEMA_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool
+}
+
+def validate_schema(value: Any, schema: Dict[str, Any], path: str = "$") -> None:
+    """
+    Check a value against the subset of JSON Schema used for structured model
+    output: type, enum, properties, required and items.
+
+    Raises LLMJSONError naming the first part of the value that does not match.
+    """
+    expected = schema.get("type")
+    if expected and (not isinstance(value, _SCHEMA_TYPES[expected]) or (expected != "boolean" and isinstance(value, bool))):
+        raise LLMJSONError(f"{path} should be of type {expected}")
+    if "enum" in schema and value not in schema["enum"]:
+        raise LLMJSONError(f"{path} should be one of {', '.join(map(str, schema['enum']))}")
+    if isinstance(value, dict):
+        for key in schema.get("required", ()):
+            if key not in value:
+                raise LLMJSONError(f"{path} is missing {key!r}")
+        for key, subschema in schema.get("properties", {}).items():
+            if key in value:
+                validate_schema(value[key], subschema, f"{path}.{key}")
+    elif isinstance(value, list) and "items" in schema:
+        for i, item in enumerate(value):
+            validate_schema(item, schema["items"], f"{path}[{i}]")
+
+class JSONObjectStream:
+    """
+    Incrementally scan streamed model output for complete JSON objects.
+
+    Text is fed in arbitrary chunks; feed() returns every object carrying an
+    "id" key that was closed by the chunk, so per-email results can be used
+    before the whole response has arrived. Braces inside strings, code fences
+    and prose around the JSON are ignored.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._starts = []
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: str) -> List[Dict]:
+        objects = []
+        offset = len(self._text)
+        self._text += chunk
+        text = self._text
+        for i in range(offset, len(text)):
+            char = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._starts.append(i)
+            elif char == "}" and self._starts:
+                start = self._starts.pop()
+                try:
+                    candidate = json.loads(text[start:i + 1])
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(candidate, dict) and "id" in candidate:
+                    objects.append(candidate)
+        return objects
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far"""
+        return self._text
@@ -0,0 +1,169 @@
+from services.db import in_chunks, open_database
+from services.metrics import record_cache
+from models.email import EmailRecord
+from config import settings
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class MessageStore:
+    """
+    On-disk store of parsed Gmail messages keyed by mailbox and message id.
+
+    Gmail messages never change content, so a stored message can be served
+    instead of downloading it again. Labels do change (a message is read,
+    archived or starred), so each mailbox has a history id from which callers
+    replay label changes into the store. The store is bounded by size and
+    evicts the least recently read messages first.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes or settings.MESSAGE_STORE_MAX_BYTES
+        self._lock = threading.Lock()
+        self._conn = open_database("messages.db", path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS mailbox_messages (
+                mailbox TEXT NOT NULL,
+                id TEXT NOT NULL,
+                data TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (mailbox, id)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS mailbox_messages_last_access ON mailbox_messages (last_access)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS label_cursors (
+                mailbox TEXT PRIMARY KEY,
+                history_id TEXT NOT NULL
+            )
+        """)
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM mailbox_messages").fetchone()[0]
+
+    def get_many(self, mailbox: str, message_ids: Iterable[str]) -> Dict[str, EmailRecord]:
+        """Get the stored messages of a mailbox among message_ids, keyed by id"""
+        message_ids = list(dict.fromkeys(message_ids))
+        found = {}
+        now = time.time()
+        with self._lock:
+            # One parameter of each statement is the mailbox
+            for chunk, placeholders in in_chunks(message_ids, reserved=1):
+                rows = self._conn.execute(
+                    f"SELECT id, data FROM mailbox_messages WHERE mailbox = ? AND id IN ({placeholders})", [mailbox, *chunk]
+                ).fetchall()
+                for row in rows:
+                    found[row["id"]] = EmailRecord.from_dict(json.loads(row["data"]))
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE mailbox_messages SET last_access = ? WHERE mailbox = ? AND id = ?",
+                        [(now, mailbox, row["id"]) for row in rows]
+                    )
+        logger.debug(f"Message store hit {len(found)} of {len(message_ids)} messages")
+        record_cache("messages", len(found), len(message_ids) - len(found))
+        return found
+
+    def put_many(self, mailbox: str, emails: List[EmailRecord]) -> None:
+        """Store parsed messages of a mailbox, evicting old ones if the store grows past its bound"""
+        if not emails:
+            return
+        now = time.time()
+        rows = []
+        for email in emails:
+            data = json.dumps(email.to_dict())
+            rows.append((email.id, data, len(data.encode("utf-8")), now))
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for message_id, data, size, last_access in rows:
+                    previous = self._conn.execute(
+                        "SELECT size FROM mailbox_messages WHERE mailbox = ? AND id = ?", (mailbox, message_id)
+                    ).fetchone()
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO mailbox_messages (mailbox, id, data, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                        (mailbox, message_id, data, size, last_access)
+                    )
+                    self._total_bytes += size - (previous["size"] if previous else 0)
+                if self._total_bytes > self.max_bytes:
+                    self._evict()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM mailbox_messages").fetchone()[0]
+                raise
+
+    def label_cursor(self, mailbox: str) -> Optional[str]:
+        """The history id the stored labels of a mailbox are up to date with"""
+        with self._lock:
+            row = self._conn.execute("SELECT history_id FROM label_cursors WHERE mailbox = ?", (mailbox,)).fetchone()
+        return row["history_id"] if row else None
+
+    def set_label_cursor(self, mailbox: str, history_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO label_cursors (mailbox, history_id) VALUES (?, ?)", (mailbox, history_id)
+            )
+
+    def apply_label_changes(self, mailbox: str, changes: List[Tuple[str, List[str], List[str]]]) -> int:
+        """
+        Replay (message id, labels added, labels removed) changes, in the order
+        they happened, on the stored messages of a mailbox. Returns how many
+        stored messages changed.
+        """
+        by_message: Dict[str, List[Tuple[List[str], List[str]]]] = {}
+        for message_id, added, removed in changes:
+            by_message.setdefault(message_id, []).append((added, removed))
+        updated = 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for chunk, placeholders in in_chunks(list(by_message), reserved=1):
+                    rows = self._conn.execute(
+                        f"SELECT id, data, size FROM mailbox_messages WHERE mailbox = ? AND id IN ({placeholders})",
+                        [mailbox, *chunk]
+                    ).fetchall()
+                    for row in rows:
+                        content = json.loads(row["data"])
+                        labels = list(content.get("labels") or [])
+                        for added, removed in by_message[row["id"]]:
+                            labels = [label for label in labels if label not in removed]
+                            labels.extend(label for label in added if label not in labels)
+                        content["labels"] = labels
+                        data = json.dumps(content)
+                        size = len(data.encode("utf-8"))
+                        self._conn.execute(
+                            "UPDATE mailbox_messages SET data = ?, size = ? WHERE mailbox = ? AND id = ?",
+                            (data, size, mailbox, row["id"])
+                        )
+                        self._total_bytes += size - row["size"]
+                        updated += 1
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM mailbox_messages").fetchone()[0]
+                raise
+        logger.debug(f"Applied {len(changes)} label changes to {updated} stored messages")
+        return updated
+
+    def _evict(self) -> None:
+        """Drop least recently read messages until the store is back under 90% of its bound"""
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        stale = []
+        for row in self._conn.execute("SELECT mailbox, id, size FROM mailbox_messages ORDER BY last_access"):
+            if self._total_bytes <= target:
+                break
+            stale.append((row["mailbox"], row["id"]))
+            self._total_bytes -= row["size"]
+            evicted += 1
+        self._conn.executemany("DELETE FROM mailbox_messages WHERE mailbox = ? AND id = ?", stale)
+        logger.debug(f"Evicted {evicted} messages from the message store")
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+message_store = MessageStore()
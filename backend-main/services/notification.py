@@ -1,74 +1,76 @@
-import resend
-from config import settings
-from typing import Dict, List
+from typing import Dict, List, Optional
+from models.email import EmailRecord
+from services.outbox import Outbox, OutboxDispatcher
+from services.resend_client import ResendClient
+from services.templates import template_renderer
+
+SENDER = "mailbot <notifications@aialexa.org>"
 
 class NotificationService:
-    def __init__(self):
-        resend.api_key = settings.RESEND_API_KEY
+    def __init__(self, client: Optional[ResendClient] = None, outbox: Optional[Outbox] = None):
+        self.client = client or ResendClient()
+        self.outbox = outbox or Outbox()
+        self.dispatcher = OutboxDispatcher(self.outbox, self.client)
+
+    def _message(self, to: str, subject: str, content: str) -> Dict:
+        return {
+            "from": SENDER,
+            "to": [to],  # Resend expects a list of recipients
+            "subject": subject,
+            "html": content
+        }
 
     async def send_email_notification(self, to: str, subject: str, content: str) -> Dict:
         """
         Send an email notification using Resend
         """
         try:
-            params = {
-                "from": "mailbot <notifications@aialexa.org>",
-                "to": [to],  # Resend expects a list of recipients
-                "subject": subject,
-                "html": content
-            }
-            email = resend.Emails.send(params)
-            return email
+            return await self.client.send(self._message(to, subject, content))
         except Exception as e:
             raise Exception(f"Error sending email notification: {str(e)}") from e
 
+    def enqueue_notification(self, to: str, subject: str, content: str, idempotency_key: Optional[str] = None) -> Dict:
+        """
+        Queue a notification for background delivery and return its outbox
+        entry right away; failed sends are retried by the dispatcher
+        """
+        entry = self.outbox.enqueue(self._message(to, subject, content), idempotency_key)
+        self.dispatcher.wake()
+        return entry
+
     async def send_daily_digest(self, to: str, digest_content: str) -> dict:
         """
         Send the daily email digest
         """
         try:
-            response = await self.send_email_notification(
-                to=to,
-                subject="📊 Your Daily Email Digest",
-                content=f"""
-                <html>
-                    <body>
-                        <h1>📊 Daily Email Digest</h1>
-                        <div style="white-space: pre-line;">
-                            {digest_content}
-                    </div>
-                    <p>Powered by mailbot</p>
-                </body>
-                </html>
-                """
-            )
-            return response
+            # Digests of many users go out together through Resend's batch endpoint
+            return await self.client.submit(self._message(
+                to,
+                "📊 Your Daily Email Digest",
+                template_renderer.plain_summary("📊 Daily Email Digest", digest_content)
+            ))
         except Exception as e:
             raise Exception(f"Error sending daily digest: {str(e)}") from e
 
-    async def send_important_notification(self, to: str, important_emails: List[Dict]) -> dict:
+    async def send_important_notification(self, to: str, important_emails: List[EmailRecord]) -> dict:
         """
         Send notification about important emails
         """
         try:
-            email_list = "\n".join([f"• {email.get('subject', 'No Subject')}" for email in important_emails])
             response = await self.send_email_notification(
                 to=to,
                 subject="⚠️ Important Emails Require Attention",
-                content=f"""
-                <html>
-                    <body>
-                        <h2>⚠️ Important Emails</h2>
-                        <p>The following emails require your attention:</p>
-                        <div style="white-space: pre-line;">
-                            {email_list}
-                        </div>
-                    </body>
-                </html>
-                """
+                content=template_renderer.important_emails(important_emails)
             )
             return response
         except Exception as e:
             raise Exception(f"Error sending important notification: {str(e)}") from e
 
+    def start(self) -> None:
+        self.dispatcher.start()
+
+    async def aclose(self) -> None:
+        await self.dispatcher.stop()
+        await self.client.aclose()
+
 notification_service = NotificationService() 
\ No newline at end of file
@@ -0,0 +1,209 @@
+from config import settings
+from services.db import open_database
+from services.resend_client import ResendClient, ResendError
+from typing import Callable, Dict, List, Optional
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+PENDING, SENT, DEAD = "pending", "sent", "dead"
+
+class Outbox:
+    """
+    Durable queue of rendered notification emails waiting to be delivered.
+
+    Each message has an idempotency key: enqueueing a key twice returns the
+    existing message, and the key is passed to Resend so a retried send
+    cannot deliver the same email twice.
+    """
+
+    def __init__(self, path: Optional[str] = None, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._conn = open_database("outbox.db", path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                message TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                provider_id TEXT,
+                created_at REAL NOT NULL,
+                sent_at REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+
+    def _row(self, row) -> Dict:
+        entry = dict(row)
+        entry["message"] = json.loads(entry["message"])
+        return entry
+
+    def enqueue(self, message: Dict, idempotency_key: Optional[str] = None) -> Dict:
+        """Queue a message for delivery, returning its outbox entry"""
+        key = idempotency_key or str(uuid.uuid4())
+        now = self.clock()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR IGNORE INTO outbox (idempotency_key, message, status, next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (key, json.dumps(message), PENDING, now, now)
+            )
+            row = self._conn.execute("SELECT * FROM outbox WHERE idempotency_key = ?", (key,)).fetchone()
+        return self._row(row)
+
+    def get(self, message_id: int) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM outbox WHERE id = ?", (message_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def due(self, now: float, limit: int) -> List[Dict]:
+        """Pending messages whose next attempt is due, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM outbox WHERE status = ? AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                (PENDING, now, limit)
+            ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def next_attempt_at(self) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_attempt_at) AS next_at FROM outbox WHERE status = ?", (PENDING,)
+            ).fetchone()
+        return row["next_at"]
+
+    def mark_sent(self, message_id: int, provider_id: Optional[str]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, attempts = attempts + 1, provider_id = ?, sent_at = ?, last_error = NULL WHERE id = ?",
+                (SENT, provider_id, self.clock(), message_id)
+            )
+
+    def mark_failed(self, message_id: int, error: str, next_attempt_at: Optional[float]) -> None:
+        """Record a failed attempt; without a next attempt the message is dead-lettered"""
+        with self._lock:
+            if next_attempt_at is None:
+                self._conn.execute(
+                    "UPDATE outbox SET status = ?, attempts = attempts + 1, last_error = ? WHERE id = ?",
+                    (DEAD, error, message_id)
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE outbox SET attempts = attempts + 1, last_error = ?, next_attempt_at = ? WHERE id = ?",
+                    (error, next_attempt_at, message_id)
+                )
+
+    def dead_letters(self, limit: int = 100) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM outbox WHERE status = ? ORDER BY id DESC LIMIT ?", (DEAD, limit)
+            ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM outbox GROUP BY status").fetchall()
+        return {PENDING: 0, SENT: 0, DEAD: 0, **{row["status"]: row["n"] for row in rows}}
+
+def is_permanent(error: ResendError) -> bool:
+    """Rejections that a retry cannot fix (bad recipient, bad key); 429 is only throttling"""
+    return error.status_code is not None and 400 <= error.status_code < 500 and error.status_code not in (408, 409, 429)
+
+class OutboxDispatcher:
+    """
+    Drains the outbox in the background.
+
+    Failed sends are retried with exponential backoff and jitter; messages
+    that Resend rejects permanently or that run out of attempts are
+    dead-lettered. The loop sleeps until the next message is due or a new
+    one is enqueued.
+    """
+
+    def __init__(
+        self,
+        outbox: Outbox,
+        client: ResendClient,
+        max_attempts: Optional[int] = None,
+        base_delay: Optional[float] = None,
+        max_delay: Optional[float] = None,
+        batch_size: Optional[int] = None
+    ):
+        self.outbox = outbox
+        self.client = client
+        self.max_attempts = max_attempts or settings.OUTBOX_MAX_ATTEMPTS
+        self.base_delay = base_delay if base_delay is not None else settings.OUTBOX_BASE_DELAY_SECONDS
+        self.max_delay = max_delay if max_delay is not None else settings.OUTBOX_MAX_DELAY_SECONDS
+        self.batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+        self.clock = outbox.clock
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def wake(self) -> None:
+        """Deliver newly enqueued messages without waiting for the next due time"""
+        self._wake.set()
+
+    def backoff(self, attempts: int) -> float:
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _deliver(self, entry: Dict) -> None:
+        try:
+            response = await self.client.send(entry["message"], idempotency_key=entry["idempotency_key"])
+            self.outbox.mark_sent(entry["id"], response.get("id"))
+            return
+        except ResendError as e:
+            error, permanent = str(e), is_permanent(e)
+        except Exception as e:
+            error, permanent = str(e), False
+        attempts = entry["attempts"] + 1
+        if permanent or attempts >= self.max_attempts:
+            logger.error(f"Dead-lettering notification {entry['id']} after {attempts} attempts: {error}")
+            self.outbox.mark_failed(entry["id"], error, None)
+        else:
+            self.outbox.mark_failed(entry["id"], error, self.clock() + self.backoff(attempts))
+
+    async def drain_once(self) -> int:
+        """Attempt every due message once, returning how many were attempted"""
+        attempted = 0
+        while True:
+            entries = self.outbox.due(self.clock(), self.batch_size)
+            if not entries:
+                return attempted
+            # The client bounds how many sends are in flight
+            await asyncio.gather(*(self._deliver(entry) for entry in entries))
+            attempted += len(entries)
+
+    async def run(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                await self.drain_once()
+            except Exception as e:
+                logger.error(f"Error draining notification outbox: {str(e)}")
+            next_at = self.outbox.next_attempt_at()
+            timeout = settings.OUTBOX_POLL_SECONDS if next_at is None else max(0.0, min(next_at - self.clock(), settings.OUTBOX_POLL_SECONDS))
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
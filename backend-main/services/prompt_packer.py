@@ -0,0 +1,103 @@
+from config import settings
+from models.email import EmailRecord
+from typing import Any, List, Optional, Tuple
+import re
+
+# Rough size of a token for English text with the tokenizers OpenRouter models use
+CHARS_PER_TOKEN = 4
+
+_QUOTED_LINE = re.compile(r"^\s*>.*$", re.MULTILINE)
+# Start of the quoted history of a reply or a forward; everything after it is dropped
+_REPLY_HEADER = re.compile(
+    r"^(On .{0,200}wrote:|-{2,}\s*Original Message\s*-{2,}|-{2,}\s*Forwarded message\s*-{2,}|From: .+\nSent: .+)\s*$",
+    re.MULTILINE | re.IGNORECASE
+)
+_SIGNATURE = re.compile(r"^-- ?$", re.MULTILINE)
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+_SPACES = re.compile(r"[ \t\r\f\v]+")
+_SENTENCE_END = re.compile(r"[.!?](?=\s)")
+
+class PromptPacker:
+    """
+    Pack emails into LLM prompts that fill a token budget.
+
+    Each email is rendered once with its body cleaned up and trimmed, then
+    emails are packed greedily in order until the next one would exceed the
+    batch budget or the per-batch email cap.
+    """
+
+    def __init__(
+        self,
+        token_budget: Optional[int] = None,
+        max_email_tokens: Optional[int] = None,
+        max_batch_emails: Optional[int] = None
+    ):
+        self.token_budget = token_budget or settings.LLM_BATCH_TOKEN_BUDGET
+        self.max_email_tokens = max_email_tokens or settings.LLM_MAX_EMAIL_TOKENS
+        self.max_batch_emails = max_batch_emails or settings.LLM_MAX_BATCH_EMAILS
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """Estimate the number of tokens in text"""
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+    def trim_body(self, body: str) -> str:
+        """Drop quoted history, signatures and extra whitespace, then cut long bodies at a sentence end"""
+        match = _REPLY_HEADER.search(body)
+        if match:
+            body = body[:match.start()]
+        match = _SIGNATURE.search(body)
+        if match:
+            body = body[:match.start()]
+        body = _QUOTED_LINE.sub("", body)
+        body = _SPACES.sub(" ", body)
+        body = _BLANK_LINES.sub("\n", body).strip()
+
+        max_chars = self.max_email_tokens * CHARS_PER_TOKEN
+        if len(body) <= max_chars:
+            return body
+        cut = body[:max_chars]
+        # Prefer ending on a full sentence as long as that keeps most of the text
+        sentence_end = None
+        for sentence_end in _SENTENCE_END.finditer(cut):
+            pass
+        if sentence_end and sentence_end.end() > max_chars // 2:
+            cut = cut[:sentence_end.end()]
+        elif " " in cut[max_chars // 2:]:
+            cut = cut[:cut.rindex(" ")]
+        return cut + " [...]"
+
+    def render(self, email: EmailRecord) -> str:
+        """Render an email as a block of the batch prompt"""
+        body = self.trim_body(email.body)
+        return (
+            f"ID: {email.id}\n"
+            f"Subject: {email.subject}\n"
+            f"From: {email.sender}\n"
+            f"Date: {email.date or 'Unknown'}\n"
+            f"Body: {body}\n"
+            "---\n"
+        )
+
+    def pack(self, items: List[Any], blocks: List[str]) -> List[Tuple[List[Any], str]]:
+        """
+        Group items into batches by the estimated size of their rendered blocks.
+
+        Returns (batch items, batch text) pairs. An email that is larger than the
+        budget on its own still gets a batch of its own.
+        """
+        batches = []
+        batch_items = []
+        batch_blocks = []
+        batch_tokens = 0
+        for item, block in zip(items, blocks):
+            tokens = self.estimate_tokens(block)
+            if batch_items and (batch_tokens + tokens > self.token_budget or len(batch_items) >= self.max_batch_emails):
+                batches.append((batch_items, "".join(batch_blocks)))
+                batch_items, batch_blocks, batch_tokens = [], [], 0
+            batch_items.append(item)
+            batch_blocks.append(block)
+            batch_tokens += tokens
+        if batch_items:
+            batches.append((batch_items, "".join(batch_blocks)))
+        return batches
@@ -0,0 +1,192 @@
+from collections import OrderedDict
+from config import settings
+from typing import Callable, Dict, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Quota units Gmail charges per API method
+GMAIL_UNIT_COSTS = {
+    "users.getProfile": 1,
+    "users.history.list": 2,
+    "users.messages.list": 5,
+    "users.messages.get": 5,
+    "users.messages.send": 100,
+}
+
+class TokenBucket:
+    """
+    A token bucket refilled at rate tokens per second up to capacity.
+
+    Taking tokens never fails: the bucket may go negative, and the caller is
+    told how long to wait until its tokens have been refilled. Callers are
+    therefore served in the order they reserved capacity.
+    """
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, cost: float) -> float:
+        """Take cost tokens, returning how many seconds to wait before using them"""
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            self._tokens -= cost
+            return max(0.0, -self._tokens / self.rate)
+
+    def refund(self, cost: float) -> None:
+        """Give back tokens that were reserved but will not be used"""
+        with self._lock:
+            self._refill(self.clock())
+            self._tokens = min(self.capacity, self._tokens + cost)
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no capacity for the next seconds, after an upstream throttled us"""
+        with self._lock:
+            self._refill(self.clock())
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+    def level(self) -> float:
+        with self._lock:
+            self._refill(self.clock())
+            return self._tokens
+
+def user_key(value: Optional[str]) -> Optional[str]:
+    """Key per-user buckets by a hash, so tokens used as identities are never kept"""
+    return hashlib.sha256(value.encode()).hexdigest()[:16] if value else None
+
+class RateLimiter:
+    """
+    Token buckets per upstream (Gmail, OpenRouter, Resend), and per user
+    where the upstream enforces per-user quotas.
+
+    Callers wait for capacity instead of failing: acquire() sleeps on the
+    event loop, acquire_blocking() in worker threads. When an upstream
+    answers 429 anyway, throttled() pauses the bucket for the retry delay.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, Tuple[float, float]]] = None,
+        user_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+        max_user_buckets: int = 10000,
+        default_retry_after: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        # upstream -> (tokens per second, burst capacity)
+        self.limits = limits if limits is not None else {
+            "gmail": (settings.GMAIL_UNITS_PER_SECOND, settings.GMAIL_UNITS_PER_SECOND),
+            "openrouter": (settings.OPENROUTER_REQUESTS_PER_MINUTE / 60, settings.OPENROUTER_BURST),
+            "resend": (settings.RESEND_REQUESTS_PER_SECOND, settings.RESEND_REQUESTS_PER_SECOND),
+        }
+        self.user_limits = user_limits if user_limits is not None else {
+            "gmail": (settings.GMAIL_USER_UNITS_PER_SECOND, settings.GMAIL_USER_UNITS_PER_SECOND),
+        }
+        self.default_retry_after = default_retry_after if default_retry_after is not None else settings.RATE_LIMIT_DEFAULT_RETRY_AFTER_SECONDS
+        self.clock = clock
+        self.max_user_buckets = max_user_buckets
+        self._buckets = {upstream: TokenBucket(rate, capacity, clock) for upstream, (rate, capacity) in self.limits.items()}
+        self._user_buckets: "OrderedDict[Tuple[str, str], TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.waited = dict.fromkeys(self.limits, 0.0)
+        self.throttles = dict.fromkeys(self.limits, 0)
+
+    def _user_bucket(self, upstream: str, user: str) -> TokenBucket:
+        with self._lock:
+            key = (upstream, user)
+            bucket = self._user_buckets.get(key)
+            if bucket is None:
+                rate, capacity = self.user_limits[upstream]
+                bucket = self._user_buckets[key] = TokenBucket(rate, capacity, self.clock)
+                if len(self._user_buckets) > self.max_user_buckets:
+                    self._user_buckets.popitem(last=False)
+            else:
+                self._user_buckets.move_to_end(key)
+            return bucket
+
+    def _buckets_for(self, upstream: str, user: Optional[str]):
+        buckets = [self._buckets[upstream]] if upstream in self._buckets else []
+        if user and upstream in self.user_limits:
+            buckets.append(self._user_bucket(upstream, user))
+        return buckets
+
+    def reserve(self, upstream: str, cost: float = 1, user: Optional[str] = None) -> float:
+        """Reserve capacity, returning how long to wait before making the call"""
+        delay = max((bucket.reserve(cost) for bucket in self._buckets_for(upstream, user)), default=0.0)
+        if delay:
+            with self._lock:
+                self.waited[upstream] = self.waited.get(upstream, 0.0) + delay
+        return delay
+
+    def release(self, upstream: str, cost: float = 1, user: Optional[str] = None) -> None:
+        """Return capacity reserved by a caller that gave up before making its call"""
+        for bucket in self._buckets_for(upstream, user):
+            bucket.refund(cost)
+
+    async def acquire(self, upstream: str, cost: float = 1, user: Optional[str] = None) -> None:
+        delay = self.reserve(upstream, cost, user)
+        if delay:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                # Otherwise cancelled waits would keep pushing back everyone queued after them
+                self.release(upstream, cost, user)
+                raise
+
+    def acquire_blocking(self, upstream: str, cost: float = 1, user: Optional[str] = None) -> None:
+        delay = self.reserve(upstream, cost, user)
+        if delay:
+            time.sleep(delay)
+
+    def throttled(self, upstream: str, retry_after: Optional[float] = None, user: Optional[str] = None) -> float:
+        """Record a 429 from upstream, pausing its buckets; returns the pause in seconds"""
+        seconds = retry_after if retry_after is not None else self.default_retry_after
+        for bucket in self._buckets_for(upstream, user):
+            bucket.pause(seconds)
+        with self._lock:
+            self.throttles[upstream] = self.throttles.get(upstream, 0) + 1
+        logger.warning(f"{upstream} is throttling requests, pausing for {seconds}s")
+        return seconds
+
+    def levels(self) -> Dict:
+        """Current bucket levels, for metrics"""
+        with self._lock:
+            user_buckets = list(self._user_buckets.items())
+        per_user: Dict[str, list] = {}
+        for (upstream, _), bucket in user_buckets:
+            per_user.setdefault(upstream, []).append(bucket.level())
+        return {
+            upstream: {
+                "level": round(bucket.level(), 2),
+                "capacity": bucket.capacity,
+                "rate_per_second": bucket.rate,
+                "waited_seconds": round(self.waited.get(upstream, 0.0), 3),
+                "throttled": self.throttles.get(upstream, 0),
+                "user_buckets": len(per_user.get(upstream, [])),
+                "lowest_user_level": round(min(per_user[upstream]), 2) if per_user.get(upstream) else None
+            }
+            for upstream, bucket in self._buckets.items()
+        }
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """The Retry-After delay of a throttled response, if it gave one in seconds"""
+    value = headers.get("retry-after") if headers is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,194 @@
+from config import settings
+from services.metrics import STAGE_LATENCY
+from services.rate_limiter import RateLimiter, rate_limiter, retry_after_seconds
+from typing import Dict, List, Optional, Set
+import asyncio
+import functools
+import httpx
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ResendError(Exception):
+    """Raised when Resend rejects a request or cannot be reached"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class ResendClient:
+    """
+    Async client for the Resend email API.
+
+    One pooled HTTP connection set is reused for all sends. Messages passed to
+    submit() are coalesced for a short moment and sent through the batch
+    endpoint, up to batch_size messages per request and at most concurrency
+    requests at a time. Every message gets its own result.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        batch_wait_ms: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        limiter: RateLimiter = rate_limiter
+    ):
+        self.api_key = api_key or settings.RESEND_API_KEY
+        self.base_url = base_url or settings.RESEND_API_URL
+        self.batch_size = batch_size or settings.RESEND_BATCH_SIZE
+        self.batch_wait = (batch_wait_ms if batch_wait_ms is not None else settings.RESEND_BATCH_WAIT_MS) / 1000
+        self.concurrency = concurrency or settings.RESEND_CONCURRENCY
+        self.timeout = timeout or settings.RESEND_TIMEOUT_SECONDS
+        self.transport = transport
+        self.limiter = limiter
+        self._loop = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._requests: Optional[asyncio.Semaphore] = None
+        self._pending: List = []
+        self._flush_task: Optional[asyncio.Task] = None
+        # The event loop only keeps weak references to tasks, so running flushes are held here
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {"requests": 0, "batches": 0, "sent": 0, "failed": 0}
+
+    def _bind(self) -> None:
+        # The HTTP client and semaphore belong to the event loop that created them
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=self.timeout,
+                transport=self.transport,
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+            )
+            self._requests = asyncio.Semaphore(self.concurrency)
+            self._pending = []
+            self._flush_task = None
+
+    async def _post(self, path: str, payload, headers: Optional[Dict] = None):
+        self._bind()
+        for attempt in range(settings.RATE_LIMIT_MAX_RETRIES + 1):
+            # Wait for Resend's rate limit rather than be rejected by it
+            await self.limiter.acquire("resend")
+            async with self._requests:
+                self.stats["requests"] += 1
+                try:
+                    with STAGE_LATENCY.time(stage="resend_send"):
+                        response = await self._client.post(path, json=payload, headers=headers)
+                except httpx.HTTPError as e:
+                    raise ResendError(f"Resend request failed: {str(e)}") from e
+            if response.status_code != 429 or attempt == settings.RATE_LIMIT_MAX_RETRIES:
+                break
+            self.limiter.throttled("resend", retry_after_seconds(response.headers))
+        if response.status_code >= 400:
+            raise ResendError(f"Resend returned {response.status_code}: {response.text}", response.status_code)
+        return response.json()
+
+    async def send(self, message: Dict, idempotency_key: Optional[str] = None) -> Dict:
+        """Send one email right away, returning Resend's response ({"id": ...})"""
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else None
+        try:
+            result = await self._post("/emails", message, headers)
+        except ResendError:
+            self.stats["failed"] += 1
+            raise
+        self.stats["sent"] += 1
+        return result
+
+    async def send_batch(self, messages: List[Dict]) -> List[Dict]:
+        """
+        Send many emails through the batch endpoint.
+
+        Returns one result per message, in order: {"id": ...} when Resend
+        accepted it, {"error": ...} when it could not be sent. A batch Resend
+        rejects as invalid is split in halves and resent, so one bad message
+        only fails itself.
+        """
+        chunks = [messages[i:i + self.batch_size] for i in range(0, len(messages), self.batch_size)]
+        results = await asyncio.gather(*(self._send_chunk(chunk) for chunk in chunks))
+        return [result for chunk_results in results for result in chunk_results]
+
+    async def _send_chunk(self, messages: List[Dict]) -> List[Dict]:
+        self.stats["batches"] += 1
+        try:
+            response = await self._post("/emails/batch", messages)
+            ids = response.get("data", [])
+            if len(ids) != len(messages):
+                raise ResendError(f"Resend returned {len(ids)} results for {len(messages)} emails")
+        except ResendError as e:
+            if len(messages) > 1 and e.status_code is not None and 400 <= e.status_code < 500 and e.status_code != 429:
+                # Resend validates the whole batch, so find the messages it objects to
+                logger.warning(f"Resend rejected a batch of {len(messages)} emails, splitting it: {str(e)}")
+                half = len(messages) // 2
+                results = await asyncio.gather(self._send_chunk(messages[:half]), self._send_chunk(messages[half:]))
+                return results[0] + results[1]
+            logger.error(f"Error sending batch of {len(messages)} emails: {str(e)}")
+            self.stats["failed"] += len(messages)
+            return [{"error": str(e)} for _ in messages]
+        self.stats["sent"] += len(messages)
+        return [{"id": item.get("id")} for item in ids]
+
+    async def submit(self, message: Dict) -> Dict:
+        """
+        Queue an email for the next batch and wait for its result.
+
+        Raises ResendError if the email was not accepted.
+        """
+        self._bind()
+        future = self._loop.create_future()
+        self._pending.append((message, future))
+        if len(self._pending) >= self.batch_size:
+            self._start_flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+        result = await future
+        if "error" in result:
+            raise ResendError(result["error"])
+        return result
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.batch_wait)
+        self._flush_task = None
+        self._start_flush()
+
+    def _start_flush(self) -> None:
+        pending, self._pending = self._pending, []
+        if pending:
+            task = asyncio.create_task(self._flush(pending))
+            self._tasks.add(task)
+            task.add_done_callback(functools.partial(self._flush_done, pending))
+
+    def _flush_done(self, pending: List, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        error = None if task.cancelled() else task.exception()
+        if task.cancelled() or error is not None:
+            logger.error(f"Flushing a batch of {len(pending)} emails failed: {error or 'cancelled'}", exc_info=error)
+            # Callers waiting on the batch get an error instead of waiting forever
+            for _, future in pending:
+                if not future.done():
+                    future.set_result({"error": str(error or "cancelled")})
+
+    async def _flush(self, pending: List) -> None:
+        try:
+            results = await self.send_batch([message for message, _ in pending])
+        except Exception as e:
+            results = [{"error": str(e)} for _ in pending]
+        for (_, future), result in zip(pending, results):
+            if not future.done():
+                future.set_result(result)
+
+    @property
+    def queued(self) -> int:
+        """Emails waiting to be coalesced into the next batch"""
+        return len(self._pending)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
@@ -0,0 +1,153 @@
+from config import settings
+from models.email import EmailRecord
+from services.metrics import STAGE_LATENCY
+from string import Formatter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import functools
+import html
+import re
+
+_BETWEEN_TAGS = re.compile(r">\s+<")
+_WHITESPACE = re.compile(r"\s+")
+
+class Markup(str):
+    """Text that is already safe HTML and is inserted into templates as is"""
+
+def escape(value: Any) -> Markup:
+    """Escape a value for HTML unless it is already Markup"""
+    if isinstance(value, Markup):
+        return value
+    return Markup(html.escape(str(value), quote=True))
+
+def minify(source: str) -> str:
+    """Drop the indentation and line breaks of template markup"""
+    return _WHITESPACE.sub(" ", _BETWEEN_TAGS.sub("><", source)).strip()
+
+class Template:
+    """
+    An HTML template with {name} fields, minified and compiled once into a
+    format string so rendering is a single str.format call. Field values
+    are escaped.
+    """
+
+    def __init__(self, source: str):
+        source = minify(source)
+        parsed = list(Formatter().parse(source))
+        self.fields: Tuple[str, ...] = tuple(dict.fromkeys(field for _, field, _, _ in parsed if field))
+        self._format = source.format
+        # Most fragments wrap a single value, which is faster to concatenate than to format
+        self._wrap = None
+        if len(parsed) == 2 and parsed[0][1] and not parsed[1][1] and not parsed[0][2]:
+            self._wrap = (parsed[0][0], parsed[1][0])
+        elif len(parsed) == 1 and parsed[0][1] and not parsed[0][2]:
+            self._wrap = (parsed[0][0], "")
+
+    def render(self, **values: Any) -> Markup:
+        if self._wrap:
+            return Markup(self._wrap[0] + escape(values[self.fields[0]]) + self._wrap[1])
+        return Markup(self._format(**{field: escape(values[field]) for field in self.fields}))
+
+_PAGE = """
+<html>
+    <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px; line-height: 1.6;">
+        <h2 style="color: #2c3e50; border-bottom: 2px solid #3498db; padding-bottom: 10px;">{title}</h2>
+        <div style="background-color: #f8f9fa; padding: 20px; border-radius: 8px; margin: 20px 0;">{content}</div>
+        <div style="margin-top: 20px; padding-top: 20px; border-top: 1px solid #eee; color: #7f8c8d; font-size: 12px;">
+            <p>Powered by mailbot</p>
+        </div>
+    </body>
+</html>
+"""
+
+TEMPLATES = {
+    "page": _PAGE,
+    "paragraph": '<p style="color: #34495e;">{text}</p>',
+    "greeting": '<p style="color: #34495e; font-size: 18px; margin-top: 0;">{text}</p>',
+    "preformatted": '<div style="white-space: pre-line; color: #34495e;">{text}</div>',
+    "list_item": '<li style="margin-bottom: 5px;">{text}</li>',
+    "list_section": """
+        <div style="margin: 15px 0;">
+            <h3 style="color: {color}; margin: 0 0 10px 0;">{title}</h3>
+            <ul style="margin: 0; padding-left: 20px; color: #34495e;">{items}</ul>
+        </div>
+    """,
+    "email_line": '<p style="margin: 0 0 15px 0;"><strong>{text}</strong></p>',
+    "email_section": """
+        <div style="margin-top: 20px; border-top: 1px solid #eee; padding-top: 20px;">
+            <h3 style="color: #2c3e50; margin: 0 0 15px 0;">{title}</h3>
+            <div style="color: #34495e;">{items}</div>
+        </div>
+    """,
+    "closing": '<p style="color: #7f8c8d; margin-top: 20px; font-style: italic;">{text}</p>'
+}
+
+class TemplateRenderer:
+    """
+    Renders the HTML of notification emails from templates compiled once.
+
+    Rendered fragments (sections, greetings, closings) are cached by their
+    text, since notifications sent to many users repeat most of them.
+    """
+
+    def __init__(self, templates: Dict[str, str] = TEMPLATES, fragment_cache_size: Optional[int] = None):
+        self.templates = {name: Template(source) for name, source in templates.items()}
+        cache_size = fragment_cache_size if fragment_cache_size is not None else settings.TEMPLATE_FRAGMENT_CACHE_SIZE
+        # Cached arguments are plain text, never Markup, so equal keys always render the same
+        self._fragment = functools.lru_cache(maxsize=cache_size)(self._render_fragment)
+        self._section = functools.lru_cache(maxsize=cache_size)(self._render_section)
+
+    def render(self, name: str, **values: Any) -> Markup:
+        return self.templates[name].render(**values)
+
+    def _render_fragment(self, name: str, text: str) -> Markup:
+        return self.templates[name].render(text=text)
+
+    def _render_section(self, name: str, item_name: str, title: str, color: str, items: Tuple[str, ...]) -> Markup:
+        item = self.templates[item_name]
+        return self.templates[name].render(
+            title=title,
+            color=color,
+            items=Markup("".join(item.render(text=text) for text in items))
+        )
+
+    def fragment(self, name: str, text: Any) -> Markup:
+        """Render a single-field template, from the cache if the text was rendered before"""
+        return self._fragment(name, str(text)) if text else Markup("")
+
+    def section(self, name: str, item_name: str, title: str, items: Iterable[Any], color: str = "") -> Markup:
+        """Render a titled list of items, from the cache if the same list was rendered before"""
+        items = tuple(str(item) for item in items)
+        return self._section(name, item_name, title, color, items) if items else Markup("")
+
+    def cache_info(self) -> Dict[str, Any]:
+        return {"fragments": self._fragment.cache_info()._asdict(), "sections": self._section.cache_info()._asdict()}
+
+    def notification(self, summary: Dict) -> str:
+        """Render the new email summary built by AIService.generate_notification_summary"""
+        with STAGE_LATENCY.time(stage="html_render"):
+            email_summary = summary.get("email_summary", {})
+            content = Markup("".join((
+                self.fragment("greeting", email_summary.get("greeting", "Hey there!")),
+                self.fragment("paragraph", email_summary.get("overview", "")),
+                self.section("list_section", "list_item", "⚠️ Needs Your Attention", email_summary.get("attention_needed", []), "#e74c3c"),
+                self.section("list_section", "list_item", "✅ Action Items", email_summary.get("action_items", []), "#27ae60"),
+                self.section("email_section", "email_line", "📥 Your Emails", email_summary.get("email_list", [])),
+                self.fragment("closing", email_summary.get("closing", ""))
+            )))
+            return self.render("page", title="📧 New Email Summary", content=content)
+
+    def plain_summary(self, title: str, text: str) -> str:
+        """Render free text, keeping its line breaks"""
+        with STAGE_LATENCY.time(stage="html_render"):
+            return self.render("page", title=title, content=self.render("preformatted", text=text))
+
+    def important_emails(self, emails: List[EmailRecord]) -> str:
+        """Render the list of emails that need the user's attention"""
+        with STAGE_LATENCY.time(stage="html_render"):
+            content = Markup(
+                self.fragment("paragraph", "The following emails require your attention:")
+                + self.section("list_section", "list_item", "⚠️ Important Emails", [email.subject for email in emails], "#e74c3c")
+            )
+            return self.render("page", title="⚠️ Important Emails", content=content)
+
+template_renderer = TemplateRenderer()
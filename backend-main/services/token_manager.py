@@ -0,0 +1,176 @@
+from auth.google_auth import GoogleAuth, google_auth
+from collections import OrderedDict
+from config import settings
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException
+from google.oauth2.credentials import Credentials
+from models.user import UserCredentials
+from services.gmail import run_blocking
+from services.user_service import UserService, user_service
+from typing import Callable, Dict, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+GMAIL_SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+
+def _utc_naive(value: datetime) -> datetime:
+    # google-auth compares expiries as naive UTC datetimes
+    if value.tzinfo:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def user_google_credentials(user: UserCredentials) -> Credentials:
+    """Google credentials for a stored user, refreshable with their refresh token"""
+    return Credentials(
+        token=user.access_token,
+        refresh_token=user.refresh_token,
+        token_uri="https://oauth2.googleapis.com/token",
+        client_id=settings.GOOGLE_CLIENT_ID,
+        client_secret=settings.GOOGLE_CLIENT_SECRET,
+        scopes=GMAIL_SCOPES,
+        expiry=_utc_naive(user.token_expiry) if user.token_expiry else None
+    )
+
+def token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+class TokenManager:
+    """
+    Hands out Google credentials whose access token is valid.
+
+    Tokens are refreshed shortly before they expire, so requests and digests
+    never fail on an expired token mid-way. Concurrent callers for the same
+    user share a single refresh, and refreshed tokens are persisted. Access
+    tokens presented by the frontend are mapped to their user by hash. The
+    frontend never sees a refreshed token, so a token that was refreshed away
+    keeps resolving to the user's current credentials until its own expiry.
+    """
+
+    def __init__(
+        self,
+        users: UserService = user_service,
+        auth: GoogleAuth = google_auth,
+        margin_seconds: Optional[int] = None,
+        clock: Callable[[], datetime] = lambda: datetime.now(timezone.utc).replace(tzinfo=None)
+    ):
+        self.users = users
+        self.auth = auth
+        self.margin = timedelta(seconds=margin_seconds if margin_seconds is not None else settings.TOKEN_REFRESH_MARGIN_SECONDS)
+        self.clock = clock
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        # Token hash -> (user id, the token's own expiry)
+        self._token_users: "OrderedDict[str, Tuple[str, Optional[datetime]]]" = OrderedDict()
+        self.refreshes = 0
+
+    def remember(self, access_token: Optional[str], user_id: str, expiry: Optional[datetime] = None) -> None:
+        """Map an access token issued to a user to them until it expires"""
+        if not access_token:
+            return
+        key = token_hash(access_token)
+        self._token_users[key] = (user_id, _utc_naive(expiry) if expiry else None)
+        self._token_users.move_to_end(key)
+        if len(self._token_users) > settings.CREDENTIAL_CACHE_SIZE:
+            self._token_users.popitem(last=False)
+
+    def accepts(self, user: UserCredentials, access_token: str, expiry: Optional[datetime]) -> bool:
+        """
+        Whether access_token stands for the user: their current token, which
+        is refreshed if it has expired, or a token refreshed away that has
+        not expired yet
+        """
+        if user.access_token == access_token:
+            return True
+        return expiry is not None and expiry > self.clock()
+
+    def needs_refresh(self, user: UserCredentials) -> bool:
+        if not user.token_expiry:
+            return False
+        return _utc_naive(user.token_expiry) - self.clock() <= self.margin
+
+    async def _refresh(self, user_id: str) -> UserCredentials:
+        # Read the user again: another process may have refreshed the token already
+        user = await self.users.get_user_credentials(user_id)
+        if not user:
+            raise ValueError(f"User {user_id} not found")
+        if not self.needs_refresh(user):
+            return user
+        credentials = await run_blocking(self.auth.refresh_credentials, user_google_credentials(user))
+        user.access_token = credentials.token
+        user.token_expiry = credentials.expiry
+        if credentials.refresh_token:
+            user.refresh_token = credentials.refresh_token
+        await self.users.store_user_credentials(user)
+        self.remember(user.access_token, user.user_id, user.token_expiry)
+        self.refreshes += 1
+        logger.debug(f"Refreshed access token for user {user.email}")
+        return user
+
+    async def fresh_user(self, user: UserCredentials) -> UserCredentials:
+        """The user with an access token that does not expire within the refresh margin"""
+        if not self.needs_refresh(user):
+            return user
+        task = self._refreshing.get(user.user_id)
+        if task is None:
+            task = asyncio.create_task(self._refresh(user.user_id))
+            self._refreshing[user.user_id] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(user.user_id, None))
+        # Shielded so one cancelled caller does not abort the refresh for the others
+        return await asyncio.shield(task)
+
+    async def credentials_for(self, user: UserCredentials) -> Credentials:
+        """Ready Google credentials for a stored user"""
+        return user_google_credentials(await self.fresh_user(user))
+
+    async def _owner(self, access_token: str) -> Tuple[Optional[str], Optional[UserCredentials]]:
+        """
+        The id of the user an access token was issued to, with the stored user
+        if the token still stands for them. Google is asked only about tokens
+        that are not mapped.
+        """
+        key = token_hash(access_token)
+        user_id, expiry = self._token_users.get(key, (None, None))
+        verified = user_id is None
+        if verified:
+            raw = Credentials(token=access_token, scopes=GMAIL_SCOPES)
+            user_info = await run_blocking(self.auth.get_user_info, raw)
+            if not user_info:
+                return None, None
+            user_id = user_info["id"]
+        user = await self.users.get_user_credentials(user_id)
+        # Google just accepted an unmapped token, so it has not expired either
+        if user and (verified or self.accepts(user, access_token, expiry)):
+            if user.access_token == access_token:
+                self.remember(access_token, user_id, user.token_expiry)
+            return user_id, user
+        self._token_users.pop(key, None)
+        return user_id, None
+
+    async def user_for_token(self, access_token: str) -> Optional[UserCredentials]:
+        """The stored user the access token stands for, None for any other token"""
+        return (await self._owner(access_token))[1]
+
+    async def credentials_for_token(self, access_token: str) -> Credentials:
+        """
+        Ready Google credentials for an access token sent by the frontend.
+
+        Tokens of users who never completed the OAuth callback cannot be
+        refreshed and are used as they are. A stored user's token that was
+        refreshed away is rejected with a 401 once it has expired.
+        """
+        user_id, user = await self._owner(access_token)
+        if user:
+            return await self.credentials_for(user)
+        if user_id is not None:
+            raise HTTPException(status_code=401, detail="Access token is no longer valid, sign in again")
+        return Credentials(
+            token=access_token,
+            token_uri="https://oauth2.googleapis.com/token",
+            client_id=settings.GOOGLE_CLIENT_ID,
+            client_secret=settings.GOOGLE_CLIENT_SECRET,
+            scopes=GMAIL_SCOPES
+        )
+
+token_manager = TokenManager()
@@ -1,63 +1,162 @@
 from models.user import UserCredentials
 from config import settings
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from datetime import datetime
+from services.db import open_database
+from services.metrics import record_cache
 import jwt
-from typing import Optional
-import json
-import os
+from typing import Dict, List, Optional, Tuple
+import logging
+import threading
+import time
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
 class UserService:
-    def __init__(self):
-        self.credentials_dir = Path("credentials")
-        self.credentials_dir.mkdir(exist_ok=True)
+    """
+    Stores user credentials and preferences in SQLite.
 
-    async def store_user_credentials(self, user_credentials: UserCredentials) -> None:
-        """Store user credentials securely"""
+    The credentials are kept as a signed token blob, next to indexed columns
+    for the fields the app queries on (email and digest preferences), so
+    finding users never decodes every stored credential. Decoded credentials
+    are kept in a bounded LRU.
+    """
+
+    def __init__(self, path: Optional[str] = None, legacy_dir: Optional[str] = None, cache_size: Optional[int] = None):
+        self.cache_size = cache_size or settings.CREDENTIAL_CACHE_SIZE
+        self._cache: "OrderedDict[str, UserCredentials]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = open_database("users.db", path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id TEXT PRIMARY KEY,
+                email TEXT NOT NULL,
+                digest_enabled INTEGER NOT NULL,
+                timezone TEXT NOT NULL,
+                digest_time TEXT NOT NULL,
+                token TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS users_email ON users (email)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS users_digest_enabled ON users (digest_enabled)")
+        self._migrate_legacy_files(Path(legacy_dir or settings.LEGACY_CREDENTIALS_DIR))
+
+    def _encode(self, user_credentials: UserCredentials) -> str:
         # Convert the model to a dict with datetime as ISO format string
         cred_dict = user_credentials.dict()
         cred_dict['token_expiry'] = user_credentials.token_expiry.isoformat() if user_credentials.token_expiry else None
-        
-        # Encrypt sensitive data before storing
-        encrypted_data = jwt.encode(
-            cred_dict,
-            settings.SECRET_KEY,
-            algorithm=settings.ALGORITHM
-        )
-        
-        file_path = self.credentials_dir / f"{user_credentials.user_id}.enc"
-        with open(file_path, "w") as f:
-            f.write(encrypted_data)
-
-    async def get_user_credentials(self, user_id: str) -> Optional[UserCredentials]:
-        """Retrieve user credentials"""
-        file_path = self.credentials_dir / f"{user_id}.enc"
-        if not file_path.exists():
-            return None
-
-        with open(file_path, "r") as f:
-            encrypted_data = f.read()
+        return jwt.encode(cred_dict, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
 
+    def _decode(self, encrypted_data: str) -> Optional[UserCredentials]:
         try:
-            data = jwt.decode(
-                encrypted_data,
-                settings.SECRET_KEY,
-                algorithms=[settings.ALGORITHM]
-            )
+            data = jwt.decode(encrypted_data, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
             # Convert ISO format string back to datetime
             if data.get('token_expiry'):
                 data['token_expiry'] = datetime.fromisoformat(data['token_expiry'])
             return UserCredentials(**data)
-        except:
+        except Exception as e:
+            logger.error(f"Error decoding stored credentials: {str(e)}")
             return None
 
+    def _cache_put(self, user_credentials: UserCredentials) -> None:
+        self._cache[user_credentials.user_id] = user_credentials
+        self._cache.move_to_end(user_credentials.user_id)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _write(self, user_credentials: UserCredentials) -> None:
+        preferences = user_credentials.preferences
+        self._conn.execute(
+            """
+            INSERT OR REPLACE INTO users (user_id, email, digest_enabled, timezone, digest_time, token, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                user_credentials.user_id,
+                user_credentials.email,
+                int(bool(preferences.get("digest_enabled", True))),
+                preferences.get("timezone", "UTC"),
+                preferences.get("digest_time", "00:00"),
+                self._encode(user_credentials),
+                time.time()
+            )
+        )
+
+    def _migrate_legacy_files(self, legacy_dir: Path) -> None:
+        """Import credentials stored as one token file per user by earlier versions"""
+        if not legacy_dir.is_dir():
+            return
+        migrated = 0
+        with self._lock:
+            for file_path in legacy_dir.glob("*.enc"):
+                if self._conn.execute("SELECT 1 FROM users WHERE user_id = ?", (file_path.stem,)).fetchone():
+                    continue
+                user_credentials = self._decode(file_path.read_text())
+                if user_credentials:
+                    self._write(user_credentials)
+                    migrated += 1
+        if migrated:
+            logger.info(f"Migrated {migrated} users from {legacy_dir} to the credential store")
+
+    async def store_user_credentials(self, user_credentials: UserCredentials) -> None:
+        """Store user credentials securely"""
+        stored = user_credentials.model_copy(deep=True)
+        with self._lock:
+            self._write(stored)
+            self._cache_put(stored)
+
+    async def get_user_credentials(self, user_id: str) -> Optional[UserCredentials]:
+        """Retrieve user credentials"""
+        with self._lock:
+            cached = self._cache.get(user_id)
+            record_cache("credentials", int(cached is not None), int(cached is None))
+            if cached is not None:
+                self._cache.move_to_end(user_id)
+            else:
+                row = self._conn.execute("SELECT token FROM users WHERE user_id = ?", (user_id,)).fetchone()
+                if not row:
+                    return None
+                cached = self._decode(row["token"])
+                if cached is None:
+                    return None
+                self._cache_put(cached)
+        # Callers modify the credentials they get, so never hand out the cached object
+        return cached.model_copy(deep=True)
+
+    async def get_user_by_email(self, email: str) -> Optional[UserCredentials]:
+        """Retrieve the credentials of the user with an email address"""
+        with self._lock:
+            row = self._conn.execute("SELECT user_id FROM users WHERE email = ?", (email,)).fetchone()
+        return await self.get_user_credentials(row["user_id"]) if row else None
+
+    async def update_history_id(self, user_id: str, history_id: str) -> None:
+        """Persist the Gmail history cursor of a user's last sync"""
+        user_credentials = await self.get_user_credentials(user_id)
+        if not user_credentials:
+            return
+        user_credentials.history_id = history_id
+        await self.store_user_credentials(user_credentials)
+
+    async def get_digest_schedules(self) -> List[Tuple[str, Dict]]:
+        """(user id, digest preferences) of every user with the daily digest enabled"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id, timezone, digest_time FROM users WHERE digest_enabled = 1"
+            ).fetchall()
+        return [
+            (row["user_id"], {"digest_enabled": True, "timezone": row["timezone"], "digest_time": row["digest_time"]})
+            for row in rows
+        ]
+
     async def get_all_users_for_digest(self) -> list[UserCredentials]:
         """Get all users who have enabled daily digest"""
         users = []
-        for file_path in self.credentials_dir.glob("*.enc"):
-            user = await self.get_user_credentials(file_path.stem)
-            if user and user.preferences.get("digest_enabled", True):
+        for user_id, _ in await self.get_digest_schedules():
+            user = await self.get_user_credentials(user_id)
+            if user:
                 users.append(user)
         return users
 
-user_service = UserService() 
\ No newline at end of file
+user_service = UserService()
@@ -1,10 +1,20 @@
 import pytest
+import json
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Modules create their service singletons at import time, so make sure the
+# settings they validate exist before any test module is collected
+os.environ.setdefault("GOOGLE_CLIENT_ID", "test_client_id")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test_client_secret")
+os.environ.setdefault("OPENROUTER_API_KEY", "test_openrouter_key")
+# Keep the local databases created by service singletons out of the working tree
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="mailbot-test-"))
+
 @pytest.fixture(scope="session")
 def test_env():
     """Set up test environment variables"""
@@ -13,4 +23,218 @@ def test_env():
     os.environ["GOOGLE_CLIENT_SECRET"] = os.getenv("TEST_GOOGLE_CLIENT_SECRET", "test_client_secret")
     os.environ["RESEND_API_KEY"] = os.getenv("TEST_RESEND_API_KEY", "test_resend_key")
     os.environ["SECRET_KEY"] = os.getenv("TEST_SECRET_KEY", "test_secret_key")
-    return os.environ 
\ No newline at end of file
+    return os.environ 
+
+class FakeGmailServer:
+    """
+    Local stand-in for the Gmail REST API serving messages.list, messages.get
+    and the batch endpoint, with an optional per-request delay.
+    """
+
+    def __init__(self, messages, delay=0.0):
+        from http.server import ThreadingHTTPServer
+        import threading
+
+        self.messages = list(messages)
+        self.delay = delay
+        # Mailbox history: (history id, history type, record) entries
+        self.history_id = 1000
+        self.oldest_history_id = self.history_id
+        self.history = []
+        # History records per history.list page
+        self.history_page_size = 100
+        self.requests = []
+        self.batches = 0
+        # Message ids whose messages.get answers a server error
+        self.failing = set()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def root_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add_message(self, message):
+        """Deliver a new message, recording it in the mailbox history"""
+        self.history_id += 1
+        self.messages.append(message)
+        self.history.append((self.history_id, "messageAdded", {"messagesAdded": [{"message": {"id": message["id"], "threadId": message["id"]}}]}))
+
+    def change_labels(self, message_id, added=(), removed=()):
+        """Add and remove labels of a message, recording both in the mailbox history"""
+        message = next(m for m in self.messages if m["id"] == message_id)
+        for history_type, key, labels in (("labelAdded", "labelsAdded", added), ("labelRemoved", "labelsRemoved", removed)):
+            if not labels:
+                continue
+            if history_type == "labelAdded":
+                message["labelIds"] = message["labelIds"] + [label for label in labels if label not in message["labelIds"]]
+            else:
+                message["labelIds"] = [label for label in message["labelIds"] if label not in labels]
+            self.history_id += 1
+            entry = {"message": {"id": message_id, "threadId": message_id, "labelIds": list(message["labelIds"])}, "labelIds": list(labels)}
+            self.history.append((self.history_id, history_type, {key: [entry]}))
+
+    def expire_history(self):
+        """Drop all history so older cursors get a 404"""
+        self.oldest_history_id = self.history_id
+        self.history = []
+
+    def _list_history(self, query):
+        start = int(query["startHistoryId"][0])
+        if start < self.oldest_history_id:
+            return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+        history_types = query.get("historyTypes", ["messageAdded"])
+        records = [
+            {"id": str(history_id), **record}
+            for history_id, history_type, record in self.history
+            if history_id > start and history_type in history_types
+        ]
+        offset = int(query.get("pageToken", ["0"])[0])
+        page = {"history": records[offset:offset + self.history_page_size], "historyId": str(self.history_id)}
+        if offset + self.history_page_size < len(records):
+            page["nextPageToken"] = str(offset + self.history_page_size)
+        return 200, page
+
+    def handle(self, method, path):
+        """Return (status, body) for a single Gmail API call"""
+        import time
+        from urllib.parse import parse_qs, urlparse
+
+        time.sleep(self.delay)
+        self.requests.append((method, path))
+        url = urlparse(path)
+        route = url.path.rstrip("/").split("/")
+        if route[-1] == "profile":
+            return 200, {"emailAddress": "me@example.com", "historyId": str(self.history_id)}
+        if route[-1] == "history":
+            return self._list_history(parse_qs(url.query))
+        if route[-1] == "messages":
+            return 200, {
+                "messages": [{"id": message["id"], "threadId": message["id"]} for message in self.messages],
+                "resultSizeEstimate": len(self.messages),
+            }
+        if route[-2] == "messages":
+            if route[-1] in self.failing:
+                return 500, {"error": {"code": 500, "message": "Backend Error"}}
+            message = next((m for m in self.messages if m["id"] == route[-1]), None)
+            if message is None:
+                return 404, {"error": {"code": 404, "message": "Not Found"}}
+            return 200, message
+        return 404, {"error": {"code": 404, "message": "Not Found"}}
+
+    def _handle_batch(self, body, content_type):
+        from email.parser import BytesParser
+        import uuid
+
+        self.batches += 1
+        multipart = BytesParser().parsebytes(
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+        )
+        boundary = uuid.uuid4().hex
+        parts = []
+        for part in multipart.get_payload():
+            request_line = part.get_payload().split("\n", 1)[0]
+            method, path, _ = request_line.split(" ", 2)
+            status, payload = self.handle(method, path)
+            parts.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{part['Content-ID'][1:-1]}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                "Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(payload)}\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n")
+        return "".join(parts).encode(), f"multipart/mixed; boundary={boundary}"
+
+    def _handler(self):
+        from http.server import BaseHTTPRequestHandler
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body, content_type="application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                status, payload = server.handle("GET", self.path)
+                self._reply(status, json.dumps(payload).encode())
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.startswith("/batch"):
+                    content, content_type = server._handle_batch(body, self.headers["Content-Type"])
+                    self._reply(200, content, content_type)
+                else:
+                    self._reply(404, b"{}")
+
+        return Handler
+
+
+def make_gmail_message(message_id, subject="Hello", sender="sender@example.com", body="Hi there"):
+    """Build a Gmail API message resource with a single text/plain body"""
+    import base64
+
+    return {
+        "id": message_id,
+        "threadId": message_id,
+        "labelIds": ["INBOX"],
+        "snippet": body[:100],
+        "payload": {
+            "mimeType": "text/plain",
+            "headers": [
+                {"name": "Subject", "value": subject},
+                {"name": "From", "value": sender},
+                {"name": "Date", "value": "Mon, 1 Jan 2024 09:00:00 +0000"},
+            ],
+            "body": {"data": base64.urlsafe_b64encode(body.encode()).decode()},
+        },
+    }
+
+
+@pytest.fixture
+def fake_gmail():
+    """Start a fake Gmail server; call it with the messages to serve"""
+    servers = []
+
+    def _start(messages, delay=0.0):
+        server = FakeGmailServer(messages, delay=delay).start()
+        servers.append(server)
+        return server
+
+    yield _start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def gmail_service_factory():
+    """Build Gmail clients that talk to a fake Gmail server instead of Google"""
+    from googleapiclient.discovery import build_from_document
+    from services.discovery import discovery_cache
+    import httplib2
+
+    document = discovery_cache.get_document("gmail", "v1")
+
+    def _factory(server):
+        def build_service(credentials):
+            return build_from_document(dict(document, rootUrl=server.root_url), http=httplib2.Http())
+        return build_service
+
+    return _factory
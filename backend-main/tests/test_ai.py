@@ -1,3 +1,4 @@
+import asyncio
 from services.ai import ai_service
 import json
 from datetime import datetime, timedelta
@@ -37,7 +38,7 @@ def test_summarize_emails():
     print("\n=== Testing Email Summarization ===")
     try:
         # Test direct service call
-        result = ai_service.summarize_emails(test_emails)
+        result = asyncio.run(ai_service.summarize_emails(test_emails))
         print("\nDirect Service Result:")
         print(json.dumps(result, indent=2))
 
@@ -55,7 +56,7 @@ def test_notification_summary():
     print("\n=== Testing Notification Summary ===")
     try:
         # Test direct service call
-        summary = ai_service.generate_notification_summary(test_emails)
+        summary = asyncio.run(ai_service.generate_notification_summary(test_emails))
         print("\nDirect Service Notification Summary:")
         print(summary)
 
@@ -77,7 +78,7 @@ def test_daily_digest():
     print("\n=== Testing Daily Digest ===")
     try:
         # Test direct service call
-        digest = ai_service.generate_daily_digest(test_emails)
+        digest = asyncio.run(ai_service.generate_daily_digest(test_emails))
         print("\nDirect Service Daily Digest:")
         print(digest)
 
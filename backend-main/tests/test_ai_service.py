@@ -0,0 +1,299 @@
+import asyncio
+import json
+import re
+import time
+from types import SimpleNamespace
+import httpx
+import pytest
+from openai import RateLimitError
+from services.ai import AIService
+from services.llm_client import LLMRouter
+from services.llm_json import JSONObjectStream
+from services.prompt_packer import PromptPacker
+from services.analysis_cache import AnalysisCache
+from services.rate_limiter import RateLimiter
+
+
+def _emails(count):
+    return [
+        {"id": str(i), "subject": f"Subject {i}", "from": "a@example.com", "date": "2024-01-01", "body": "Body"}
+        for i in range(count)
+    ]
+
+
+class FakeCompletions:
+    """Async stand-in for client.chat.completions answering batch prompts with delay"""
+
+    def __init__(self, delay=0.1):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+
+    async def create(self, messages, stream=False, **kwargs):
+        if stream:
+            return self._stream(messages)
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            prompt = messages[-1]["content"]
+            ids = re.findall(r"ID: (\S+)", prompt)
+            # Later batches answer first so completion order differs from batch order
+            await asyncio.sleep(self.delay / (1 + int(ids[0])) if ids else self.delay)
+            if ids:
+                content = json.dumps({"emails": [
+                    {"id": i, "category": "work", "summary": f"summary {i}", "importance": ""} for i in ids
+                ]})
+            elif '"email_summary"' in prompt:
+                content = json.dumps({"email_summary": {"greeting": "Hi!", "email_list": re.findall(r"\] (Subject \d+)", prompt)}})
+            else:
+                content = "Overall summary"
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+        finally:
+            self.in_flight -= 1
+
+
+    async def _stream(self, messages):
+        completion = await self.create(messages)
+        content = completion.choices[0].message.content
+        for i in range(0, len(content), 7):
+            await asyncio.sleep(0)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content[i:i + 7]))])
+
+
+@pytest.fixture
+def ai_service():
+    service = AIService(cache=None, classifier=None, limiter=RateLimiter(limits={}))
+    # Five emails per batch regardless of size keeps the batch count predictable
+    service.packer = PromptPacker(max_batch_emails=5)
+    completions = FakeCompletions()
+    service.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return service, completions
+
+
+def test_batches_run_concurrently_in_deterministic_order(ai_service):
+    service, completions = ai_service
+
+    started = time.monotonic()
+    result = asyncio.run(service.summarize_emails(_emails(20)))
+    elapsed = time.monotonic() - started
+
+    assert result["categories"]["work"] == [str(i) for i in range(20)]
+    assert completions.calls == 5  # four batches and the overall summary
+    assert completions.max_in_flight == 4
+    # Batches overlap: roughly the slowest batch plus the summary, not the sum of all calls
+    assert elapsed < 5 * completions.delay
+
+
+def test_concurrency_limit_is_respected(ai_service):
+    service, completions = ai_service
+    service.semaphore = asyncio.Semaphore(2)
+
+    asyncio.run(service.summarize_emails(_emails(30)))
+
+    assert completions.max_in_flight == 2
+
+
+def test_object_stream_yields_objects_as_they_close():
+    scanner = JSONObjectStream()
+    text = '```json\n{"emails": [{"id": "1", "summary": "uses { and \\" in text"}, {"id": "2", "summary": "b"}]}\n```'
+    seen = []
+    for i in range(0, len(text), 5):
+        seen.extend(obj["id"] for obj in scanner.feed(text[i:i + 5]))
+    assert seen == ["1", "2"]
+    assert scanner.text == text
+
+
+def test_stream_emits_emails_before_summary(ai_service):
+    service, _ = ai_service
+
+    async def collect():
+        return [event async for event in service.stream_summarize_emails(_emails(7))]
+
+    events = asyncio.run(collect())
+
+    kinds = [event["event"] for event in events]
+    assert kinds == ["email"] * 7 + ["summary"]
+    assert sorted(event["data"]["id"] for event in events[:-1]) == [str(i) for i in range(7)]
+    assert events[0]["data"]["category"] == "work"
+    assert events[-1]["data"]["summary_text"] == "Overall summary"
+    assert events[-1]["data"]["category_counts"]["work"] == 7
+
+
+def test_stream_reports_failed_batches(ai_service):
+    service, completions = ai_service
+
+    async def broken_stream(prompt, task="categorize"):
+        raise RuntimeError("upstream closed the stream")
+        yield
+
+    service._stream_openrouter = broken_stream
+
+    async def collect():
+        return [event async for event in service.stream_summarize_emails(_emails(2))]
+
+    events = asyncio.run(collect())
+
+    assert events[0] == {"event": "error", "data": {"ids": ["0", "1"], "error": "upstream closed the stream"}}
+    assert events[-1]["event"] == "summary"
+
+
+def test_notification_takes_one_call_after_analysis_and_none_when_cached(ai_service, tmp_path):
+    service, completions = ai_service
+    service.cache = AnalysisCache(path=str(tmp_path / "analysis.db"))
+
+    summary = json.loads(asyncio.run(service.generate_notification_summary(_emails(10))))
+    # Two concurrent batches and a single call building the final structure
+    assert completions.calls == 3
+    assert summary["email_summary"]["email_list"] == [f"Subject {i}" for i in range(10)]
+
+    completions.calls = 0
+    summary = json.loads(asyncio.run(service.generate_notification_summary(_emails(10))))
+    assert completions.calls == 0
+    assert summary["email_summary"]["overview"] == "You have 10 new emails (10 work)."
+    assert summary["email_summary"]["email_list"][0] == "Subject 0 (From: a@example.com) - summary 0"
+
+
+def test_digest_is_composed_locally_when_the_final_call_fails(ai_service):
+    service, completions = ai_service
+
+    digest = json.loads(asyncio.run(service.generate_daily_digest(_emails(3))))
+
+    # The fake model does not know the digest format, so the local composition is used
+    overview = digest["daily_digest"]["overview"]
+    assert overview["total_emails_processed"] == "3"
+    assert overview["main_topics"] == ["Work (3)"]
+    assert digest["daily_digest"]["key_discussions_and_decisions"]["discussions"][0] == "Subject 0: summary 0"
+    assert completions.calls == 2
+
+
+def _batch_answer(ids, skip=()):
+    return json.dumps({"emails": [
+        {"id": i, "category": "work", "summary": f"summary {i}", "importance": ""} for i in ids if i not in skip
+    ]})
+
+
+def test_only_emails_missing_from_a_response_are_retried(ai_service):
+    service, _ = ai_service
+    batch_prompts = []
+
+    async def call(prompt, task="categorize"):
+        if task != "categorize":
+            return "Overall summary"
+        ids = re.findall(r"ID: (\S+)", prompt)
+        batch_prompts.append(ids)
+        # The first answer leaves out email 2 and misnames email 3's category
+        if len(batch_prompts) == 1:
+            answer = json.loads(_batch_answer(ids, skip={"2"}))
+            answer["emails"][-1]["category"] = "urgent stuff"
+            return json.dumps(answer)
+        return _batch_answer(ids)
+
+    service._call_openrouter = call
+
+    result = asyncio.run(service.summarize_emails(_emails(4)))
+
+    assert batch_prompts == [["0", "1", "2", "3"], ["2", "3"]]
+    assert result["categories"]["work"] == ["0", "1", "2", "3"]
+
+
+def test_a_failing_batch_is_bisected_down_to_the_email_that_breaks_it(ai_service):
+    service, _ = ai_service
+    batch_prompts = []
+
+    async def call(prompt, task="categorize"):
+        if task != "categorize":
+            return "Overall summary"
+        ids = re.findall(r"ID: (\S+)", prompt)
+        batch_prompts.append(ids)
+        return "Sorry, I cannot help with that." if "3" in ids else _batch_answer(ids)
+
+    service._call_openrouter = call
+
+    result = asyncio.run(service.summarize_emails(_emails(4)))
+
+    assert result["categories"]["work"] == ["0", "1", "2"]
+    assert batch_prompts[:3] == [["0", "1", "2", "3"], ["0", "1"], ["2", "3"]]
+    # Retries stop after LLM_BATCH_RETRIES rounds
+    assert len(batch_prompts) == 5
+
+
+def test_results_with_unknown_ids_are_paired_by_position(ai_service):
+    service, completions = ai_service
+
+    async def call(prompt, task="categorize"):
+        if task != "categorize":
+            return "Overall summary"
+        return json.dumps({"emails": [
+            {"id": 1, "category": "Work", "summary": "known id"},
+            {"id": "email-2", "category": "personal", "summary": "renumbered", "importance": ""}
+        ]})
+
+    service._call_openrouter = call
+
+    result = asyncio.run(service.summarize_emails(_emails(2)))
+
+    assert result["categories"]["work"] == ["1"]
+    assert result["categories"]["personal"] == ["0"]
+
+
+def test_categorization_requests_a_json_schema_response(ai_service):
+    service, _ = ai_service
+
+    kwargs = service._completion_kwargs("prompt", "categorize")
+
+    assert kwargs["response_format"]["type"] == "json_schema"
+    assert kwargs["response_format"]["json_schema"]["schema"]["required"] == ["emails"]
+    assert "response_format" not in service._completion_kwargs("prompt", "summary")
+
+
+def test_waiting_for_rate_limit_capacity_does_not_trip_the_breakers():
+    service = AIService(cache=None, classifier=None, limiter=RateLimiter(limits={"openrouter": (20, 1)}))
+    completions = FakeCompletions(delay=0)
+    service.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    routes = {"categorize": {"models": ["m1", "m2"], "max_tokens": 100, "temperature": 0, "timeout": 0.05}}
+    service.router = LLMRouter(
+        create=service._create_completion, acquire=service._acquire_capacity, routes=routes,
+        deadline_seconds=5, hedge_percentile=0, failure_threshold=1
+    )
+
+    async def scenario():
+        # Six calls share one request of burst and 20 per second, so most wait longer than the timeout
+        return await asyncio.gather(*(service._call_openrouter("Overall?") for _ in range(6)))
+
+    assert asyncio.run(scenario()) == ["Overall summary"] * 6
+    stats = service.router.stats()["models"]["categorize"]
+    assert {stats[model]["circuit"] for model in ("m1", "m2")} == {"closed"}
+    assert stats["m1"]["failures"] == 0
+
+
+def test_retry_after_longer_than_the_attempt_timeout_is_waited_out_by_the_router():
+    service = AIService(cache=None, classifier=None, limiter=RateLimiter(limits={"openrouter": (100, 10)}))
+    completions = FakeCompletions(delay=0)
+    answer = completions.create
+    throttled = []
+
+    async def create(**kwargs):
+        if not throttled:
+            throttled.append(kwargs["model"])
+            response = httpx.Response(429, headers={"retry-after": "0.2"}, request=httpx.Request("POST", "https://openrouter.ai/api/v1"))
+            raise RateLimitError("Too many requests", response=response, body=None)
+        return await answer(**kwargs)
+
+    completions.create = create
+    service.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    routes = {"categorize": {"models": ["m1", "m2"], "max_tokens": 100, "temperature": 0, "timeout": 0.05}}
+    service.router = LLMRouter(
+        create=service._create_completion, acquire=service._acquire_capacity, routes=routes,
+        deadline_seconds=5, hedge_percentile=0, failure_threshold=1
+    )
+
+    started = time.monotonic()
+    assert asyncio.run(service._call_openrouter("Overall?")) == "Overall summary"
+
+    assert time.monotonic() - started >= 0.2
+    assert completions.calls == 1
+    stats = service.router.stats()["models"]["categorize"]
+    # The retry went to the same model and the 429 is not held against it
+    assert (stats["m1"]["failures"], stats["m1"]["circuit"], stats["m2"]["calls"]) == (0, "closed", 0)
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import time
+import pytest
+from services.ai import AIService
+from services.analysis_cache import AnalysisCache
+from models.email import EmailRecord
+
+
+def _email(message_id, subject="Quarterly report"):
+    return EmailRecord(id=message_id, subject=subject, sender="boss@example.com", date="2024-01-01", body="Please review.")
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return AnalysisCache(path=str(tmp_path / "analysis.db"))
+
+
+def test_key_changes_with_content_and_model():
+    key = AnalysisCache.make_key(_email("1"), "model-a")
+    assert key == AnalysisCache.make_key(_email("1"), "model-a")
+    assert key != AnalysisCache.make_key(_email("1", subject="Other"), "model-a")
+    assert key != AnalysisCache.make_key(_email("1"), "model-b")
+
+
+def test_entries_expire(tmp_path):
+    cache = AnalysisCache(path=str(tmp_path / "analysis.db"), ttl_seconds=1)
+    cache.put_many({"k": {"category": "work"}})
+    assert cache.get_many(["k"]) == {"k": {"category": "work"}}
+    cache._conn.execute("UPDATE analyses SET created_at = ?", (time.time() - 5,))
+    assert cache.get_many(["k"]) == {}
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = AnalysisCache(path=str(tmp_path / "analysis.db"), max_entries=10)
+    cache.put_many({f"k{i}": {"category": "work"} for i in range(10)})
+    time.sleep(0.01)
+    cache.get_many(["k0"])
+    cache.put_many({"new": {"category": "work"}})
+    remaining = cache.get_many([f"k{i}" for i in range(10)] + ["new"])
+    assert len(remaining) == 9
+    assert "k0" in remaining and "new" in remaining
+
+
+def test_summarize_only_sends_uncached_emails(cache, monkeypatch):
+    ai_service = AIService(cache=cache, classifier=None)
+    prompts = []
+
+    async def fake_call(prompt, task="categorize"):
+        prompts.append(prompt)
+        if "Emails to analyze" not in prompt:
+            return "Overall summary"
+        ids = [line.split("ID:")[1].strip() for line in prompt.splitlines() if line.strip().startswith("ID:")]
+        return json.dumps({"emails": [
+            {"id": i, "category": "work", "summary": f"summary {i}", "importance": ""} for i in ids
+        ]})
+
+    monkeypatch.setattr(ai_service, "_call_openrouter", fake_call)
+
+    first = asyncio.run(ai_service.summarize_emails([_email("1"), _email("2")]))
+    assert first["categories"]["work"] == ["1", "2"]
+    assert len(prompts) == 2  # one batch and the overall summary
+
+    prompts.clear()
+    second = asyncio.run(ai_service.summarize_emails([_email("1"), _email("2"), _email("3")]))
+    assert [e["ai_summary"] for e in second["emails"]] == ["summary 1", "summary 2", "summary 3"]
+    batch_prompts = [p for p in prompts if "Emails to analyze" in p]
+    assert len(batch_prompts) == 1
+    assert "ID: 3" in batch_prompts[0] and "ID: 1" not in batch_prompts[0]
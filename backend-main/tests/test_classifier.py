@@ -0,0 +1,89 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from services.ai import AIService
+from services.classifier import EmailClassifier
+from services.prompt_packer import PromptPacker
+from test_ai_service import FakeCompletions
+from models.email import EmailRecord
+
+
+def _email(id, subject="Quarterly planning", sender="Alice <alice@example.com>", **extra):
+    return EmailRecord.from_dict({"id": id, "subject": subject, "from": sender, "date": "2024-01-01", "body": "Body", "labels": ["INBOX"], **extra})
+
+
+@pytest.fixture
+def classifier(tmp_path):
+    return EmailClassifier(path=str(tmp_path / "classifier.json"), confidence=0.9, min_training_emails=20)
+
+
+@pytest.mark.parametrize("email, rule", [
+    (_email("1", list_unsubscribe="<mailto:unsubscribe@example.com>"), "list_unsubscribe"),
+    (_email("2", precedence="bulk"), "precedence"),
+    (_email("3", labels=["INBOX", "CATEGORY_PROMOTIONS"]), "promotions_label"),
+    (_email("4", sender="Shop <deals@mail.shop.sendgrid.net>"), "bulk_sender_domain"),
+    (_email("5", sender="Service <no-reply@service.com>"), "no_reply_sender"),
+])
+def test_header_rules_mark_bulk_mail_as_newsletters(classifier, email, rule):
+    analysis = classifier.classify(email)
+
+    assert analysis["category"] == "newsletters"
+    assert analysis["classified_by"] == rule
+    assert analysis["summary"] == email.subject
+
+
+def test_personal_email_goes_to_the_model_until_trained(classifier):
+    assert classifier.classify(_email("1")) is None
+    assert classifier.stats()["hit_rate"] == 0.0
+
+
+def test_learned_model_classifies_confident_emails(classifier):
+    for i in range(15):
+        classifier.observe(_email(f"w{i}", subject=f"Sprint review {i} agenda", sender="Boss <boss@corp.com>"), "work")
+        classifier.observe(_email(f"p{i}", subject=f"Dinner on Sunday {i}", sender="Mom <mom@family.net>"), "personal")
+
+    work = classifier.classify(_email("a", subject="Sprint review agenda", sender="Boss <boss@corp.com>"))
+    personal = classifier.classify(_email("b", subject="Sunday dinner", sender="Mom <mom@family.net>"))
+    unknown = classifier.classify(_email("c", subject="Invoice attached", sender="Vendor <billing@vendor.io>"))
+
+    assert work["category"] == "work"
+    assert personal["category"] == "personal"
+    assert unknown is None
+    stats = classifier.stats()
+    assert stats["hits"] == 2
+    assert stats["hits_by_rule"] == {"naive_bayes": 2}
+
+
+def test_model_persists_across_instances(classifier, tmp_path):
+    for i in range(20):
+        classifier.observe(_email(str(i), subject="Sprint review", sender="boss@corp.com"), "work")
+    classifier.save()
+
+    reloaded = EmailClassifier(path=str(tmp_path / "classifier.json"), confidence=0.5, min_training_emails=20)
+
+    assert reloaded.stats()["training_emails"] == 20
+    assert reloaded.classify(_email("x", subject="Sprint review", sender="boss@corp.com"))["category"] == "work"
+
+
+def test_ai_service_skips_model_for_classified_emails(classifier):
+    service = AIService(cache=None, classifier=classifier)
+    service.packer = PromptPacker(max_batch_emails=5)
+    completions = FakeCompletions(delay=0)
+    service.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    newsletters = [_email(str(i), subject=f"Weekly news {i}", list_unsubscribe="<https://x.io/u>") for i in range(10)]
+    personal = [_email(str(i)) for i in range(10, 15)]
+    rendered = []
+    render = service.packer.render
+    service.packer.render = lambda email: rendered.append(email.id) or render(email)
+
+    result = asyncio.run(service.summarize_emails(newsletters + personal))
+
+    assert result["categories"]["newsletters"] == [str(i) for i in range(10)]
+    assert result["categories"]["work"] == [str(i) for i in range(10, 15)]
+    assert completions.calls == 2  # one batch for the personal emails and the overall summary
+    assert sorted(rendered, key=int) == [str(i) for i in range(15)]  # each email is rendered once
+    stats = classifier.stats()
+    assert stats["hit_rate"] == 10 / 15
+    assert stats["llm_calls_avoided"] == 2
+    # The model's answers train the classifier
+    assert stats["training_emails"] == 5
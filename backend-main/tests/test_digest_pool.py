@@ -0,0 +1,114 @@
+import asyncio
+from datetime import datetime
+from models.user import UserCredentials
+from services.digest_pool import DigestWorkerPool
+from services.token_manager import user_google_credentials
+
+
+def _user(user_id):
+    return UserCredentials(
+        user_id=user_id, email=f"{user_id}@example.com", access_token="token",
+        refresh_token="refresh", token_expiry=datetime(2024, 1, 1)
+    )
+
+
+class Tracker:
+    """Counts how many calls of a stage overlap"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+
+    async def run(self, fail=False, hang=False):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(60 if hang else self.delay)
+            if fail:
+                raise RuntimeError("upstream error")
+        finally:
+            self.active -= 1
+
+
+class FakeEmailService:
+    def __init__(self, tracker):
+        self.tracker = tracker
+
+    async def fetch_emails(self, credentials, time_range=None):
+        await self.tracker.run(hang=credentials.token == "hang")
+        return [{"id": "1"}]
+
+
+class FakeAI:
+    def __init__(self, tracker):
+        self.tracker = tracker
+
+    async def generate_daily_digest(self, emails):
+        await self.tracker.run()
+        return "{}"
+
+
+class FakeNotifications:
+    def __init__(self, tracker):
+        self.tracker = tracker
+        self.sent = []
+
+    async def send_daily_digest(self, to, digest_content):
+        await self.tracker.run(fail=to.startswith("bad"))
+        self.sent.append(to)
+
+
+class FakeTokens:
+    async def credentials_for(self, user):
+        return user_google_credentials(user)
+
+
+def _pool(**kwargs):
+    gmail, llm, resend = Tracker(0.02), Tracker(0.02), Tracker(0.02)
+    notifications = FakeNotifications(resend)
+    pool = DigestWorkerPool(
+        email_service=FakeEmailService(gmail),
+        ai=FakeAI(llm),
+        notifications=notifications,
+        tokens=FakeTokens(),
+        **kwargs
+    )
+    return pool, (gmail, llm, resend), notifications
+
+
+def test_stages_respect_their_limits():
+    pool, (gmail, llm, resend), notifications = _pool(
+        concurrency=10, stage_concurrency={"gmail": 3, "openrouter": 2, "resend": 1}
+    )
+
+    async def scenario():
+        return await asyncio.gather(*(pool.process(_user(f"u{i}")) for i in range(20)))
+
+    results = asyncio.run(scenario())
+
+    assert all(results)
+    assert len(notifications.sent) == 20
+    assert (gmail.peak, llm.peak, resend.peak) == (3, 2, 1)
+    metrics = pool.metrics()
+    assert metrics["completed"] == 20
+    assert metrics["digests_per_minute"] == 20
+    assert metrics["stages"]["gmail"]["runs"] == 20
+    assert metrics["queued"] == metrics["in_progress"] == 0
+
+
+def test_failures_and_timeouts_are_isolated_per_user():
+    pool, _, notifications = _pool(concurrency=4, user_timeout=0.2)
+    hanging = _user("slow")
+    hanging.access_token = "hang"
+
+    async def scenario():
+        return await asyncio.gather(pool.process(_user("ok")), pool.process(_user("bad")), pool.process(hanging))
+
+    results = asyncio.run(scenario())
+
+    assert results == [True, False, False]
+    assert notifications.sent == ["ok@example.com"]
+    metrics = pool.metrics()
+    assert (metrics["completed"], metrics["failed"], metrics["timed_out"]) == (1, 1, 1)
+    assert {error["user_id"] for error in metrics["recent_errors"]} == {"bad", "slow"}
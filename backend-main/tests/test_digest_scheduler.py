@@ -0,0 +1,115 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+import pytest
+from models.user import UserCredentials
+from services.digest_scheduler import DigestScheduler, next_fire_time, validate_preferences
+
+NOW = datetime(2024, 1, 15, 7, 59, 59, 700000, tzinfo=timezone.utc)
+
+
+def _user(user_id, digest_time, tz="UTC", enabled=True):
+    return UserCredentials(
+        user_id=user_id,
+        email=f"{user_id}@example.com",
+        access_token="token",
+        refresh_token="refresh",
+        token_expiry=NOW,
+        preferences={"digest_time": digest_time, "timezone": tz, "digest_enabled": enabled}
+    )
+
+
+class FakeUsers:
+    def __init__(self, users):
+        self.users = {user.user_id: user for user in users}
+
+    async def get_digest_schedules(self):
+        return [(user.user_id, user.preferences) for user in self.users.values() if user.preferences["digest_enabled"]]
+
+    async def get_user_credentials(self, user_id):
+        return self.users.get(user_id)
+
+
+def _clock():
+    """A clock starting 0.3s before 08:00 UTC and running in real time"""
+    started = time.monotonic()
+    return lambda: NOW + timedelta(seconds=time.monotonic() - started)
+
+
+def test_next_fire_time_in_user_timezone():
+    prefs = {"digest_time": "08:00", "timezone": "America/New_York"}
+
+    assert next_fire_time(prefs, NOW) == datetime(2024, 1, 15, 13, 0, tzinfo=timezone.utc)
+    assert next_fire_time({"digest_time": "07:00", "timezone": "UTC"}, NOW) == datetime(2024, 1, 16, 7, 0, tzinfo=timezone.utc)
+    # Summer time shifts the UTC fire time
+    assert next_fire_time(prefs, datetime(2024, 7, 1, tzinfo=timezone.utc)) == datetime(2024, 7, 1, 12, 0, tzinfo=timezone.utc)
+    # 02:30 does not exist on the spring forward day; the digest still fires that night
+    gap = next_fire_time({"digest_time": "02:30", "timezone": "America/New_York"}, datetime(2024, 3, 10, 5, tzinfo=timezone.utc))
+    assert gap.date() == datetime(2024, 3, 10).date()
+
+
+def test_single_digit_hours_are_accepted_and_bad_preferences_rejected():
+    assert next_fire_time({"digest_time": "7:30", "timezone": "UTC"}, NOW) == next_fire_time({"digest_time": "07:30", "timezone": "UTC"}, NOW)
+    validate_preferences({"digest_time": "7:30", "timezone": "Europe/Paris"})
+    with pytest.raises(ValueError, match="digest_time"):
+        validate_preferences({"digest_time": "25:00"})
+    with pytest.raises(ValueError, match="timezone"):
+        validate_preferences({"digest_time": "07:00", "timezone": "Mars/Olympus"})
+
+
+def test_runs_only_due_users_and_reschedules_them():
+    users = FakeUsers([_user("early", "08:00"), _user("later", "09:00"), _user("off", "08:00", enabled=False)])
+    ran = []
+
+    async def job(user):
+        ran.append(user.user_id)
+
+    async def scenario():
+        scheduler = DigestScheduler(job=job, users=users, clock=_clock())
+        await scheduler.start()
+        await asyncio.sleep(0.6)
+        await scheduler.stop()
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+
+    assert ran == ["early"]
+    assert scheduler.next_due() == datetime(2024, 1, 15, 9, 0, tzinfo=timezone.utc)
+    assert set(scheduler._versions) == {"early", "later"}
+
+
+def test_preference_change_wakes_scheduler():
+    user = _user("user", "10:00")
+    users = FakeUsers([user])
+    ran = []
+
+    async def job(user):
+        ran.append(user.user_id)
+        raise RuntimeError("Resend is down")
+
+    async def scenario():
+        scheduler = DigestScheduler(job=job, users=users, clock=_clock())
+        await scheduler.start()
+        await asyncio.sleep(0.05)
+        assert ran == []
+        user.preferences["digest_time"] = "08:00"
+        scheduler.reschedule(user)
+        await asyncio.sleep(0.6)
+        await scheduler.stop()
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+
+    # The failure is logged and the user stays scheduled for the next day
+    assert ran == ["user"]
+    assert scheduler.next_due() == datetime(2024, 1, 16, 8, 0, tzinfo=timezone.utc)
+
+
+def test_disabling_digest_removes_user():
+    user = _user("user", "08:00")
+    scheduler = DigestScheduler(job=None, users=FakeUsers([user]), clock=lambda: NOW)
+    scheduler.reschedule(user)
+    user.preferences["digest_enabled"] = False
+    scheduler.reschedule(user)
+
+    assert scheduler.next_due() is None
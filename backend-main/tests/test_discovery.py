@@ -0,0 +1,28 @@
+import json
+from google.oauth2.credentials import Credentials
+from services.discovery import DiscoveryCache
+
+
+def test_documents_are_parsed_once():
+    cache = DiscoveryCache()
+    cache.preload()
+    assert cache.get_document("gmail", "v1") is cache.get_document("gmail", "v1")
+
+
+def test_build_uses_cached_document():
+    cache = DiscoveryCache()
+    service = cache.build("gmail", "v1", credentials=Credentials(token="token"))
+    request = service.users().messages().get(userId="me", id="abc")
+    assert request.uri.startswith("https://gmail.googleapis.com/gmail/v1/users/me/messages/abc")
+
+
+def test_building_clients_does_not_modify_the_shared_document():
+    cache = DiscoveryCache()
+    document = cache.get_document("gmail", "v1")
+    settled = json.dumps(document, sort_keys=True)
+
+    service = cache.build("gmail", "v1", credentials=Credentials(token="token"))
+    service.users().messages().get(userId="me", id="abc")
+    service.users().history().list(userId="me", startHistoryId="1")
+
+    assert json.dumps(document, sort_keys=True) == settled
@@ -0,0 +1,43 @@
+import asyncio
+from types import SimpleNamespace
+from models.email import EmailRecord, to_records
+from services.ai import AIService
+from test_ai_service import FakeCompletions
+
+
+def test_from_dict_accepts_gmail_snippet():
+    record = EmailRecord.from_dict({"id": 7, "from": "a@example.com", "snippet": "Short preview"})
+
+    assert record.id == "7"
+    assert record.sender == "a@example.com"
+    assert record.subject == "No Subject"
+    assert record.body == "Short preview"
+
+
+def test_round_trip_keeps_analysis():
+    record = EmailRecord(id="1", subject="Hi", sender="a@example.com", body="Body")
+    assert "category" not in record.to_dict()
+
+    record.apply_analysis({"category": "work", "summary": "A summary", "importance": "Deadline"})
+
+    assert EmailRecord.from_dict(record.to_dict()).to_dict() == record.to_dict()
+    assert record.to_dict()["ai_summary"] == "A summary"
+
+
+def test_records_have_no_instance_dict():
+    record = EmailRecord(id="1")
+
+    assert not hasattr(record, "__dict__")
+    assert [r.id for r in to_records([record, {"id": "2"}])] == ["1", "2"]
+
+
+def test_summarize_leaves_caller_dicts_alone_and_references_ids():
+    service = AIService(cache=None, classifier=None)
+    service.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(delay=0)))
+    emails = [{"id": "1", "subject": "Report", "from": "a@example.com", "body": "Body"}]
+
+    result = asyncio.run(service.summarize_emails(emails))
+
+    assert emails == [{"id": "1", "subject": "Report", "from": "a@example.com", "body": "Body"}]
+    assert result["categories"]["work"] == ["1"]
+    assert [email["ai_summary"] for email in result["emails"]] == ["summary 1"]
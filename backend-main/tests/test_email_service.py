@@ -0,0 +1,193 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from conftest import make_gmail_message
+from services.email_service import EmailService
+from services.message_store import MessageStore
+import pytest
+
+
+@pytest.fixture
+def store(tmp_path):
+    return MessageStore(path=str(tmp_path / "messages.db"))
+
+
+def test_fetch_emails_from_fake_gmail(fake_gmail, gmail_service_factory, store):
+    server = fake_gmail([
+        make_gmail_message("a1", subject="First", body="Body one"),
+        make_gmail_message("b2", subject="Second", body="Body two"),
+    ])
+    email_service = EmailService(service_factory=gmail_service_factory(server), store=store)
+
+    emails = asyncio.run(email_service.fetch_emails(credentials=None))
+
+    assert [e.id for e in emails] == ["a1", "b2"]
+    assert emails[0].subject == "First"
+    assert emails[1].body == "Body two"
+    # One list call, the profile naming the mailbox and its history id, plus a single batch for both messages
+    assert server.requests[0][1].startswith("/gmail/v1/users/me/messages?")
+    assert server.requests[1][1].startswith("/gmail/v1/users/me/profile?")
+    assert len(server.requests) == 4
+    assert server.batches == 1
+
+
+def test_concurrent_fetches_do_not_block_the_event_loop(fake_gmail, gmail_service_factory, store):
+    delay = 0.2
+    server = fake_gmail([make_gmail_message("a1")], delay=delay)
+    email_service = EmailService(service_factory=gmail_service_factory(server), store=store)
+
+    async def run():
+        ticks = 0
+        done = asyncio.Event()
+
+        async def ticker():
+            nonlocal ticks
+            while not done.is_set():
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker_task = asyncio.create_task(ticker())
+        started = time.monotonic()
+        results = await asyncio.gather(*(email_service.fetch_emails(None) for _ in range(8)))
+        elapsed = time.monotonic() - started
+        done.set()
+        await ticker_task
+        return results, elapsed, ticks
+
+    results, elapsed, ticks = asyncio.run(run())
+
+    assert all(len(emails) == 1 for emails in results)
+    # Each fetch is a list call and a batch call; run serially 8 fetches take >= 3.2s
+    assert elapsed < 8 * 2 * delay / 2
+    # The loop kept running other coroutines while Gmail calls were in flight
+    assert ticks > 10
+
+
+def test_time_range_is_sent_as_query(fake_gmail, gmail_service_factory, store):
+    server = fake_gmail([make_gmail_message("a1")])
+    email_service = EmailService(service_factory=gmail_service_factory(server), store=store)
+
+    asyncio.run(email_service.fetch_emails(None, time_range="1d"))
+
+    assert any("newer_than%3A1d" in path for _, path in server.requests)
+
+
+def test_sync_returns_only_new_messages(fake_gmail, gmail_service_factory, store):
+    server = fake_gmail([make_gmail_message("a1"), make_gmail_message("b2")])
+    email_service = EmailService(service_factory=gmail_service_factory(server), store=store)
+
+    first = asyncio.run(email_service.sync_emails(None))
+    assert first["full_sync"] is True
+    assert [e.id for e in first["emails"]] == ["a1", "b2"]
+
+    server.add_message(make_gmail_message("c3", subject="New"))
+    second = asyncio.run(email_service.sync_emails(None, first["history_id"]))
+    assert second["full_sync"] is False
+    assert [e.id for e in second["emails"]] == ["c3"]
+    assert second["history_id"] == str(server.history_id)
+
+    third = asyncio.run(email_service.sync_emails(None, second["history_id"]))
+    assert third["emails"] == []
+
+
+def test_sync_falls_back_to_full_sync_when_cursor_expires(fake_gmail, gmail_service_factory, store):
+    server = fake_gmail([make_gmail_message("a1")])
+    email_service = EmailService(service_factory=gmail_service_factory(server), store=store)
+    cursor = asyncio.run(email_service.sync_emails(None))["history_id"]
+
+    server.add_message(make_gmail_message("b2"))
+    server.expire_history()
+    result = asyncio.run(email_service.sync_emails(None, cursor))
+
+    assert result["full_sync"] is True
+    assert [e.id for e in result["emails"]] == ["a1", "b2"]
+
+
+def test_sync_does_not_move_the_cursor_past_messages_it_did_not_return(fake_gmail, gmail_service_factory, store):
+    server = fake_gmail([make_gmail_message("a1")])
+    email_service = EmailService(service_factory=gmail_service_factory(server), store=store)
+    cursor = asyncio.run(email_service.sync_emails(None))["history_id"]
+
+    server.add_message(make_gmail_message("b2"))
+    server.failing.add("b2")
+    with pytest.raises(Exception):
+        asyncio.run(email_service.sync_emails(None, cursor))
+
+    server.failing.clear()
+    result = asyncio.run(email_service.sync_emails(None, cursor))
+    assert [e.id for e in result["emails"]] == ["b2"]
+
+
+def test_sync_returns_a_backlog_in_bounded_batches(fake_gmail, gmail_service_factory, store, monkeypatch):
+    server = fake_gmail([make_gmail_message("seed")])
+    server.history_page_size = 7
+    email_service = EmailService(service_factory=gmail_service_factory(server), store=store)
+    cursor = asyncio.run(email_service.sync_emails(None))["history_id"]
+    monkeypatch.setattr("config.settings.MAX_SYNC_EMAILS", 20)
+    arrived = [f"m{i}" for i in range(45)]  # more than MAX_SYNC_EMAILS and MAX_EMAILS
+    for message_id in arrived:
+        server.add_message(make_gmail_message(message_id))
+
+    synced = []
+    batches = 0
+    has_more = True
+    while has_more:
+        result = asyncio.run(email_service.sync_emails(None, cursor))
+        assert result["full_sync"] is False
+        assert len(result["emails"]) <= 20
+        synced.extend(e.id for e in result["emails"])
+        cursor, has_more = result["history_id"], result["has_more"]
+        batches += 1
+
+    assert synced == arrived
+    assert batches == 3
+    assert cursor == str(server.history_id)
+
+
+def test_stored_messages_are_not_downloaded_again(fake_gmail, gmail_service_factory, store):
+    server = fake_gmail([make_gmail_message("a1"), make_gmail_message("b2")])
+    email_service = EmailService(service_factory=gmail_service_factory(server), store=store)
+    first = asyncio.run(email_service.fetch_emails(None))
+
+    server.add_message(make_gmail_message("c3"))
+    server.change_labels("a1", added=["STARRED"], removed=["INBOX"])
+    server.requests.clear()
+    second = asyncio.run(email_service.fetch_emails(None))
+
+    assert [e.id for e in second] == ["a1", "b2", "c3"]
+    assert [e.to_dict() for e in second[1:2]] == [e.to_dict() for e in first[1:]]
+    # Label changes are replayed from the mailbox history into the store
+    assert second[0].labels == ["STARRED"]
+    assert any("/history?" in path for _, path in server.requests)
+    # Only the new message was requested from Gmail
+    gets = [path for _, path in server.requests if "/messages/" in path]
+    assert len(gets) == 1 and "/messages/c3" in gets[0]
+
+
+def test_stored_messages_survive_access_token_rotation(fake_gmail, gmail_service_factory, store):
+    server = fake_gmail([make_gmail_message("a1")])
+    email_service = EmailService(service_factory=gmail_service_factory(server), store=store)
+    # Without a refresh token, the quota key changes with every access token
+    asyncio.run(email_service.fetch_emails(SimpleNamespace(token="first", refresh_token=None)))
+    server.requests.clear()
+
+    emails = asyncio.run(email_service.fetch_emails(SimpleNamespace(token="second", refresh_token=None)))
+
+    assert [e.id for e in emails] == ["a1"]
+    assert not any(path.endswith("/messages/a1") for _, path in server.requests)
+    assert set(store.get_many("me@example.com", ["a1"])) == {"a1"}
+
+
+def test_stored_labels_are_fetched_again_when_the_label_history_expires(fake_gmail, gmail_service_factory, store):
+    server = fake_gmail([make_gmail_message("a1")])
+    email_service = EmailService(service_factory=gmail_service_factory(server), store=store)
+    asyncio.run(email_service.fetch_emails(None))
+
+    server.change_labels("a1", added=["STARRED"])
+    server.expire_history()
+    server.requests.clear()
+    emails = asyncio.run(email_service.fetch_emails(None))
+
+    assert emails[0].labels == ["INBOX", "STARRED"]
+    gets = [path for _, path in server.requests if "/messages/" in path]
+    assert len(gets) == 1 and "format=minimal" in gets[0]
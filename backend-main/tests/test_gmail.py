@@ -0,0 +1,82 @@
+import httplib2
+from googleapiclient.errors import HttpError
+from services.gmail import batch_get_messages
+from services.rate_limiter import RateLimiter
+
+
+def _http_error(status):
+    return HttpError(httplib2.Response({"status": status}), b"{}")
+
+
+class FakeBatch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append(request_id)
+
+    def execute(self):
+        self.service.batches.append(list(self.requests))
+        for request_id in self.requests:
+            failures = self.service.failures.get(request_id)
+            if failures:
+                self.callback(request_id, None, failures.pop(0))
+            else:
+                self.callback(request_id, {"id": request_id}, None)
+
+
+class FakeService:
+    """Minimal stand-in for the Gmail discovery resource"""
+
+    def __init__(self, failures=None):
+        self.batches = []
+        self.failures = failures or {}
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def get(self, userId, id, **params):
+        return id
+
+
+def test_groups_calls_into_batches():
+    service = FakeService()
+    ids = [str(i) for i in range(7)]
+    messages, errors = batch_get_messages(service, ids, batch_size=3)
+    assert service.batches == [["0", "1", "2"], ["3", "4", "5"], ["6"]]
+    assert list(messages) == ids
+    assert errors == {}
+
+
+def test_partial_failures_are_reported_per_message():
+    service = FakeService(failures={"1": [_http_error(404)]})
+    messages, errors = batch_get_messages(service, ["0", "1", "2"], batch_size=10)
+    assert list(messages) == ["0", "2"]
+    assert list(errors) == ["1"]
+    # A 404 is not retried
+    assert len(service.batches) == 1
+
+
+def test_rate_limited_messages_are_retried():
+    service = FakeService(failures={"1": [_http_error(429)]})
+    limiter = RateLimiter(default_retry_after=0.05)
+    messages, errors = batch_get_messages(service, ["0", "1", "2"], batch_size=10, user="u", limiter=limiter)
+    assert list(messages) == ["0", "1", "2"]
+    assert errors == {}
+    assert service.batches == [["0", "1", "2"], ["1"]]
+    assert limiter.levels()["gmail"]["throttled"] == 1
+
+
+def test_duplicate_ids_are_fetched_once():
+    service = FakeService()
+    messages, _ = batch_get_messages(service, ["a", "b", "a"], batch_size=10)
+    assert service.batches == [["a", "b"]]
+    assert list(messages) == ["a", "b"]
@@ -112,7 +112,8 @@ def test_notifications(summary):
     try:
         test_data = {
             "phone_number": os.getenv("TEST_EMAIL", "test@example.com"),
-            "emails": summary["categories"]["work"][:1]  # Test with first work email
+            # Categories list email ids; the analyzed emails themselves are under "emails"
+            "emails": [email for email in summary["emails"] if email["id"] in summary["categories"]["work"][:1]]  # Test with first work email
         }
         response = requests.post(
             f"{BASE_URL}/api/notifications",
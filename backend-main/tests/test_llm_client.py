@@ -0,0 +1,116 @@
+import asyncio
+import time
+from types import SimpleNamespace
+import pytest
+from services.llm_client import CircuitBreaker, LLMError, LLMRouter, ResilientLLM
+
+
+def _completion(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class FakeProvider:
+    """Answers per model after a scripted delay, or fails"""
+
+    def __init__(self, delays, failing=()):
+        self.delays = delays
+        self.failing = set(failing)
+        self.calls = []
+
+    async def create(self, model, timeout, **kwargs):
+        self.calls.append(model)
+        delay = self.delays[model]
+        await asyncio.sleep(delay() if callable(delay) else delay)
+        if model in self.failing:
+            raise RuntimeError(f"{model} is down")
+        return _completion(f"answer from {model}")
+
+
+def _llm(provider, **kwargs):
+    options = {"models": ["primary", "fallback"], "deadline_seconds": 1, "attempt_timeout": 1, "hedge_percentile": 0}
+    options.update(kwargs)
+    return ResilientLLM(create=provider.create, **options)
+
+
+def test_fails_over_to_the_next_model_and_opens_the_circuit():
+    provider = FakeProvider({"primary": 0, "fallback": 0}, failing={"primary"})
+    llm = _llm(provider, failure_threshold=2, reset_seconds=60)
+
+    async def scenario():
+        return [await llm.complete(messages=[]) for _ in range(3)]
+
+    answers = asyncio.run(scenario())
+
+    assert answers == ["answer from fallback"] * 3
+    # The third request skips the primary model once its circuit is open
+    assert provider.calls == ["primary", "fallback", "primary", "fallback", "fallback"]
+    assert llm.stats()["primary"]["circuit"] == "open"
+
+
+def test_slow_model_is_bounded_by_the_attempt_timeout_and_deadline():
+    provider = FakeProvider({"primary": 5, "fallback": 5})
+    llm = _llm(provider, deadline_seconds=0.3, attempt_timeout=0.2)
+
+    started = time.monotonic()
+    with pytest.raises(LLMError):
+        asyncio.run(llm.complete(messages=[]))
+
+    assert time.monotonic() - started < 0.5
+    assert provider.calls == ["primary", "fallback"]
+
+
+def test_slow_call_is_hedged_after_the_latency_percentile():
+    delays = iter([0.01] * 20 + [2, 0.01])
+    provider = FakeProvider({"primary": lambda: next(delays), "fallback": 0})
+    llm = _llm(provider, hedge_percentile=95, hedge_min_samples=20)
+
+    async def scenario():
+        for _ in range(20):
+            await llm.complete(messages=[])
+        started = time.monotonic()
+        answer = await llm.complete(messages=[])
+        return answer, time.monotonic() - started
+
+    answer, elapsed = asyncio.run(scenario())
+
+    assert answer == "answer from primary"
+    assert elapsed < 0.5
+    assert llm.stats()["primary"]["hedged"] == 1
+
+
+def test_half_open_circuit_lets_one_probe_through():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=10, clock=lambda: now[0])
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    now[0] = 10
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_router_applies_each_task_models_and_generation_settings():
+    seen = []
+
+    async def create(model, timeout, **kwargs):
+        seen.append((model, timeout, kwargs["max_tokens"], kwargs["temperature"]))
+        return _completion(f"answer from {model}")
+
+    routes = {
+        "categorize": {"models": ["fast"], "max_tokens": 300, "temperature": 0.0, "timeout": 5},
+        "digest": {"models": ["large", "fast"], "max_tokens": 1500, "temperature": 0.7, "timeout": 20}
+    }
+    router = LLMRouter(create=create, routes=routes, deadline_seconds=30, hedge_percentile=0)
+
+    async def scenario():
+        return await router.complete("categorize", messages=[]), await router.complete("digest", messages=[])
+
+    assert asyncio.run(scenario()) == ("answer from fast", "answer from large")
+    assert seen == [("fast", 5, 300, 0.0), ("large", 20, 1500, 0.7)]
+    stats = router.stats()
+    assert stats["tasks"]["categorize"]["calls"] == 1
+    assert stats["tasks"]["digest"]["p50_seconds"] is not None
+    # Both tasks see the same circuit for a model they share
+    assert router.llms["categorize"].breakers["fast"] is router.llms["digest"].breakers["fast"]
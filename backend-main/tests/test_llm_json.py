@@ -0,0 +1,58 @@
+import json
+from pathlib import Path
+import pytest
+from services.llm_json import LLMJSONError, extract_json, validate_schema
+
+CORPUS = {
+    sample["name"]: sample["text"]
+    for sample in map(json.loads, (Path(__file__).parent.parent / "benchmarks" / "llm_outputs.jsonl").read_text().splitlines())
+}
+
+
+@pytest.mark.parametrize("name", [name for name in CORPUS if name not in ("no_json", "error_string")])
+def test_recovers_object_from_every_malformed_sample(name):
+    assert isinstance(extract_json(CORPUS[name]), dict)
+
+
+@pytest.mark.parametrize("name", ["no_json", "error_string"])
+def test_raises_when_there_is_no_json(name):
+    with pytest.raises(LLMJSONError):
+        extract_json(CORPUS[name])
+
+
+def test_ignores_prose_and_fences_around_the_object():
+    text = 'Here you go {with braces}:\n```json\n{"email_summary": {"greeting": "Hi } there"}}\n```\nAnything else?'
+
+    assert extract_json(text, "email_summary") == {"email_summary": {"greeting": "Hi } there"}}
+
+
+def test_truncated_output_keeps_complete_results():
+    text = '{"emails": [{"id": "1", "category": "work"}, {"id": "2", "category": "pers'
+
+    assert extract_json(text, "emails") == {"emails": [{"id": "1", "category": "work"}]}
+
+
+def test_required_key_skips_other_objects():
+    text = '{"note": "draft"}\n{"daily_digest": {"overview": {}}}'
+
+    assert extract_json(text, "daily_digest") == {"daily_digest": {"overview": {}}}
+    with pytest.raises(LLMJSONError):
+        extract_json(text, "email_summary")
+
+
+def test_repairs_trailing_commas_and_ellipsis_lines():
+    text = '{\n  "items": [1, 2,],\n  ...\n  "done": true,\n}'
+
+    assert extract_json(text) == {"items": [1, 2], "done": True}
+
+
+def test_schema_validation_names_the_offending_value():
+    schema = {"type": "object", "required": ["emails"], "properties": {"emails": {"type": "array", "items": {
+        "type": "object", "required": ["id"], "properties": {"id": {"type": "string"}, "category": {"enum": ["work"]}}
+    }}}}
+
+    validate_schema({"emails": [{"id": "1", "category": "work"}]}, schema)
+    with pytest.raises(LLMJSONError, match=r"\$\.emails\[1\]\.category"):
+        validate_schema({"emails": [{"id": "1"}, {"id": "2", "category": "spam"}]}, schema)
+    with pytest.raises(LLMJSONError, match="missing 'id'"):
+        validate_schema({"emails": [{}]}, schema)
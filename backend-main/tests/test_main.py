@@ -70,8 +70,9 @@ def test_send_notification():
     }
     response = client.post("/api/notifications", json=test_data)
     assert response.status_code == 200
-    assert response.json()["message"] == "Notification sent successfully"
-    assert "resend_response" in response.json()
+    assert response.json()["message"] == "Notification queued"
+    assert response.json()["status"] == "pending"
+    assert "notification_id" in response.json()
 
 def test_daily_digest():
     # This test requires a valid Google OAuth token
@@ -0,0 +1,50 @@
+import time
+from services.message_store import MessageStore
+from models.email import EmailRecord
+
+
+def _email(message_id, body="x"):
+    return EmailRecord(id=message_id, subject="Subject", sender="a@example.com", body=body)
+
+
+def test_round_trip_survives_reopen(tmp_path):
+    path = str(tmp_path / "messages.db")
+    MessageStore(path=path).put_many("me@example.com", [_email("a"), _email("b")])
+
+    store = MessageStore(path=path)
+    found = store.get_many("me@example.com", ["a", "b", "missing"])
+
+    assert {message_id: email.to_dict() for message_id, email in found.items()} == {"a": _email("a").to_dict(), "b": _email("b").to_dict()}
+
+
+def test_evicts_least_recently_read_messages(tmp_path):
+    store = MessageStore(path=str(tmp_path / "messages.db"), max_bytes=1000)
+    store.put_many("me@example.com", [_email("old", "a" * 300), _email("read", "b" * 300)])
+    time.sleep(0.01)
+    store.get_many("me@example.com", ["read"])
+    store.put_many("me@example.com", [_email("new", "c" * 300)])
+
+    assert store.total_bytes <= 1000
+    assert set(store.get_many("me@example.com", ["old", "read", "new"])) == {"read", "new"}
+
+
+def test_messages_are_kept_per_mailbox_with_replayed_labels(tmp_path):
+    store = MessageStore(path=str(tmp_path / "messages.db"))
+    labelled = _email("a")
+    labelled.labels = ["INBOX", "UNREAD"]
+    store.put_many("alice@example.com", [labelled])
+
+    updated = store.apply_label_changes("alice@example.com", [("a", ["STARRED"], []), ("a", [], ["UNREAD"]), ("other", ["X"], [])])
+    store.set_label_cursor("alice@example.com", "42")
+
+    assert updated == 1
+    assert store.get_many("bob@example.com", ["a"]) == {}
+    assert store.get_many("alice@example.com", ["a"])["a"].labels == ["INBOX", "STARRED"]
+    assert (store.label_cursor("alice@example.com"), store.label_cursor("bob@example.com")) == ("42", None)
+
+
+def test_lookups_larger_than_a_statement_are_chunked(tmp_path):
+    store = MessageStore(path=str(tmp_path / "messages.db"))
+    store.put_many("me@example.com", [_email(str(i)) for i in range(1200)])
+
+    assert len(store.get_many("me@example.com", [str(i) for i in range(1200)])) == 1200
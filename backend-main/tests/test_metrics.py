@@ -0,0 +1,81 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from fastapi.testclient import TestClient
+from main import app
+from services.ai import AIService
+from services.metrics import HTTP_REQUESTS, LLM_CALL_LATENCY, STAGE_LATENCY, MetricsRegistry, cache_hit_ratios, record_cache
+from services.rate_limiter import RateLimiter
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    latency = registry.histogram("test_seconds", "Test latency", ("stage",), buckets=(0.1, 1))
+    requests = registry.counter("test_total", "Test requests", ("path",))
+
+    latency.observe(0.05, stage="a")
+    latency.observe(0.5, stage="a")
+    latency.observe(5, stage="a")
+    requests.inc(path='say "hi"')
+
+    lines = registry.render().splitlines()
+    assert "# TYPE test_seconds histogram" in lines
+    assert 'test_seconds_bucket{stage="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="a",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{stage="a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="a"} 3' in lines
+    assert 'test_total{path="say \\"hi\\""} 1.0' in lines
+
+
+def test_summarize_records_stage_and_llm_call_timings():
+    service = AIService(cache=None, classifier=None, limiter=RateLimiter(limits={}))
+
+    async def create(messages, **kwargs):
+        prompt = messages[-1]["content"]
+        content = json.dumps({"emails": [{"id": "1", "category": "work", "summary": "s", "importance": ""}]}) if "ID: 1" in prompt else "Overall"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    service.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    model = service.router.route("categorize").models[0]
+    summary_model = service.router.route("summary").models[0]
+    before = {
+        "prompt_build": STAGE_LATENCY.count(stage="prompt_build"),
+        "json_parse": STAGE_LATENCY.count(stage="json_parse"),
+        "categorize": LLM_CALL_LATENCY.count(task="categorize", model=model, outcome="ok"),
+        "summary": LLM_CALL_LATENCY.count(task="summary", model=summary_model, outcome="ok")
+    }
+
+    asyncio.run(service.summarize_emails([{"id": "1", "subject": "s", "from": "a@example.com", "body": "b"}]))
+
+    assert STAGE_LATENCY.count(stage="prompt_build") == before["prompt_build"] + 1
+    assert STAGE_LATENCY.count(stage="json_parse") == before["json_parse"] + 1
+    assert LLM_CALL_LATENCY.count(task="categorize", model=model, outcome="ok") == before["categorize"] + 1
+    assert LLM_CALL_LATENCY.count(task="summary", model=summary_model, outcome="ok") == before["summary"] + 1
+
+
+def test_cache_hit_ratio_counts_hits_and_misses():
+    record_cache("test_cache", hits=3, misses=1)
+
+    assert cache_hit_ratios()[("test_cache",)] == 0.75
+
+
+def test_metrics_endpoint_labels_requests_by_route_template():
+    client = TestClient(app)
+    # The registry is process-wide, so compare with the counts before the requests
+    template = ("GET", "/api/notifications/{notification_id}", "404")
+    unmatched = ("GET", "unmatched", "404")
+    before = HTTP_REQUESTS.values()
+    assert client.get("/api/notifications/987654321").status_code == 404
+    assert client.get("/no/such/path").status_code == 404
+    after = HTTP_REQUESTS.values()
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/plain; version=0.0.4; charset=utf-8"
+    assert after[template] - before.get(template, 0) == 1
+    assert after[unmatched] - before.get(unmatched, 0) == 1
+    lines = response.text.splitlines()
+    assert any(line.startswith('mailbot_http_requests_total{method="GET",route="/api/notifications/{notification_id}",status="404"} ') for line in lines)
+    assert not any("987654321" in line for line in lines)
+    assert any(line.startswith('mailbot_queue_depth{queue="outbox_pending"}') for line in lines)
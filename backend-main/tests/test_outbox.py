@@ -0,0 +1,93 @@
+import asyncio
+import httpx
+import json
+from services.outbox import DEAD, PENDING, SENT, Outbox, OutboxDispatcher
+from services.rate_limiter import RateLimiter
+from services.resend_client import ResendClient
+
+
+# Rate limiting has its own tests
+UNLIMITED = RateLimiter(limits={}, default_retry_after=0.01)
+
+
+class FlakyResend:
+    """Fake Resend endpoint answering each recipient with a scripted list of status codes"""
+
+    def __init__(self, script):
+        self.script = {to: list(codes) for to, codes in script.items()}
+        self.keys = []
+        self.transport = httpx.MockTransport(self.handle)
+
+    def handle(self, request):
+        to = json.loads(request.content)["to"][0]
+        self.keys.append(request.headers.get("idempotency-key"))
+        status = self.script[to].pop(0) if self.script[to] else 200
+        if status != 200:
+            return httpx.Response(status, json={"message": "error"})
+        return httpx.Response(200, json={"id": f"id-{to}"})
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _message(to):
+    return {"from": "mailbot <n@example.com>", "to": [to], "subject": "s", "html": "<p>x</p>"}
+
+
+def _dispatcher(tmp_path, fake, clock, **kwargs):
+    outbox = Outbox(path=str(tmp_path / "outbox.db"), clock=clock)
+    client = ResendClient(api_key="key", base_url="https://resend.test", transport=fake.transport, limiter=UNLIMITED)
+    return outbox, OutboxDispatcher(outbox, client, base_delay=10, max_delay=60, **kwargs)
+
+
+def test_enqueue_is_idempotent_and_durable(tmp_path):
+    outbox = Outbox(path=str(tmp_path / "outbox.db"))
+    first = outbox.enqueue(_message("a@example.com"), "key-1")
+    again = outbox.enqueue(_message("changed@example.com"), "key-1")
+
+    reopened = Outbox(path=str(tmp_path / "outbox.db"))
+
+    assert again["id"] == first["id"]
+    assert reopened.get(first["id"])["message"]["to"] == ["a@example.com"]
+    assert reopened.counts() == {PENDING: 1, SENT: 0, DEAD: 0}
+
+
+def test_transient_failures_are_retried_with_backoff(tmp_path):
+    fake = FlakyResend({"a@example.com": [500, 503]})
+    clock = Clock()
+    outbox, dispatcher = _dispatcher(tmp_path, fake, clock)
+    entry = outbox.enqueue(_message("a@example.com"), "key-1")
+
+    asyncio.run(dispatcher.drain_once())
+    first_retry = outbox.get(entry["id"])
+    clock.now = first_retry["next_attempt_at"]
+    asyncio.run(dispatcher.drain_once())
+    second_retry = outbox.get(entry["id"])
+    clock.now = second_retry["next_attempt_at"]
+    asyncio.run(dispatcher.drain_once())
+
+    assert 1005 <= first_retry["next_attempt_at"] <= 1010
+    assert second_retry["next_attempt_at"] - first_retry["next_attempt_at"] >= 10
+    sent = outbox.get(entry["id"])
+    assert (sent["status"], sent["attempts"], sent["provider_id"]) == (SENT, 3, "id-a@example.com")
+    assert fake.keys == ["key-1"] * 3
+
+
+def test_permanent_rejections_and_exhausted_retries_are_dead_lettered(tmp_path):
+    fake = FlakyResend({"bad@example.com": [422], "down@example.com": [503] * 5})
+    clock = Clock()
+    outbox, dispatcher = _dispatcher(tmp_path, fake, clock, max_attempts=2)
+    outbox.enqueue(_message("bad@example.com"))
+    outbox.enqueue(_message("down@example.com"))
+
+    asyncio.run(dispatcher.drain_once())
+    clock.now += 60
+    asyncio.run(dispatcher.drain_once())
+
+    assert outbox.counts() == {PENDING: 0, SENT: 0, DEAD: 2}
+    assert {entry["attempts"] for entry in outbox.dead_letters()} == {1, 2}
@@ -0,0 +1,44 @@
+from services.prompt_packer import PromptPacker
+from models.email import EmailRecord
+
+
+def _email(message_id, body):
+    return EmailRecord(id=message_id, subject="Subject", sender="a@example.com", date="2024-01-01", body=body)
+
+
+def test_short_emails_share_a_batch():
+    packer = PromptPacker(token_budget=1000, max_batch_emails=20)
+    emails = [_email(str(i), "Short note.") for i in range(10)]
+    batches = packer.pack(emails, [packer.render(e) for e in emails])
+    assert len(batches) == 1
+    assert batches[0][0] == emails
+    assert batches[0][1].count("ID: ") == 10
+
+
+def test_batches_respect_token_budget_and_email_cap():
+    packer = PromptPacker(token_budget=200, max_email_tokens=100, max_batch_emails=3)
+    emails = [_email(str(i), "word " * 300) for i in range(4)] + [_email(str(i), "hi") for i in range(4, 10)]
+    blocks = [packer.render(e) for e in emails]
+    batches = packer.pack(emails, blocks)
+    for batch, text in batches:
+        assert len(batch) <= 3
+        assert len(batch) == 1 or packer.estimate_tokens(text) <= 200
+    assert [e for batch, _ in batches for e in batch] == emails
+
+
+def test_trim_body_drops_quoted_history_and_signature():
+    packer = PromptPacker()
+    body = (
+        "Can you send the report by Friday?\n\n\n"
+        "Thanks,\nAnna\n-- \nAnna Smith | Sales\n"
+        "On Mon, Jan 1, 2024 at 9:00 AM Bob <bob@example.com> wrote:\n> earlier message\n"
+    )
+    assert packer.trim_body(body) == "Can you send the report by Friday?\nThanks,\nAnna"
+
+
+def test_trim_body_cuts_long_text_at_a_sentence_end():
+    packer = PromptPacker(max_email_tokens=20)
+    body = "First sentence is here. Second sentence follows along. " * 10
+    trimmed = packer.trim_body(body)
+    assert trimmed.endswith(". [...]")
+    assert len(trimmed) <= 20 * 4 + len(" [...]")
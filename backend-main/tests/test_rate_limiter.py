@@ -0,0 +1,75 @@
+import asyncio
+import time
+import httpx
+from services.rate_limiter import RateLimiter, TokenBucket
+from services.resend_client import ResendClient
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_hands_out_waits_in_reservation_order():
+    clock = Clock()
+    bucket = TokenBucket(rate=10, capacity=20, clock=clock)
+
+    assert bucket.reserve(20) == 0
+    assert bucket.reserve(5) == 0.5
+    assert bucket.reserve(5) == 1.0
+    clock.now = 1.0
+    assert bucket.level() == 0
+    clock.now = 10.0
+    assert bucket.level() == 20
+
+
+def test_per_user_quota_is_shared_with_the_project_quota():
+    clock = Clock()
+    limiter = RateLimiter(limits={"gmail": (1000, 1000)}, user_limits={"gmail": (250, 250)}, clock=clock)
+
+    assert limiter.reserve("gmail", 250, user="a") == 0
+    assert limiter.reserve("gmail", 50, user="a") == 0.2
+    assert limiter.reserve("gmail", 250, user="b") == 0
+    levels = limiter.levels()["gmail"]
+    assert (levels["level"], levels["user_buckets"], levels["lowest_user_level"]) == (450, 2, -50)
+
+
+def test_throttled_upstream_pauses_its_bucket():
+    clock = Clock()
+    limiter = RateLimiter(limits={"openrouter": (1, 5)}, clock=clock)
+
+    assert limiter.throttled("openrouter", retry_after=3) == 3
+    assert limiter.reserve("openrouter") == 4
+    assert limiter.levels()["openrouter"]["throttled"] == 1
+
+
+def test_callers_wait_instead_of_failing_on_429():
+    responses = [httpx.Response(429, headers={"retry-after": "0.1"}), httpx.Response(200, json={"id": "1"})]
+    transport = httpx.MockTransport(lambda request: responses.pop(0))
+    limiter = RateLimiter(limits={"resend": (100, 100)})
+    client = ResendClient(api_key="key", base_url="https://resend.test", transport=transport, limiter=limiter)
+
+    started = time.monotonic()
+    result = asyncio.run(client.send({"to": ["a@example.com"]}))
+
+    assert result == {"id": "1"}
+    assert time.monotonic() - started >= 0.1
+    assert limiter.levels()["resend"]["throttled"] == 1
+
+
+def test_cancelled_wait_gives_its_capacity_back():
+    limiter = RateLimiter(limits={"openrouter": (1, 1)})
+
+    async def scenario():
+        await limiter.acquire("openrouter")
+        waiter = asyncio.create_task(limiter.acquire("openrouter"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        return limiter.reserve("openrouter")
+
+    # The next caller waits for one refill, not two
+    assert asyncio.run(scenario()) <= 1.0
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import httpx
+import pytest
+from services.notification import NotificationService
+from services.rate_limiter import RateLimiter
+from services.resend_client import ResendClient, ResendError
+
+
+# Rate limiting has its own tests
+UNLIMITED = RateLimiter(limits={}, default_retry_after=0.01)
+
+
+class FakeResend:
+    """Local stand-in for the Resend API that records every request"""
+
+    def __init__(self, fail_recipients=()):
+        self.requests = []
+        self.fail_recipients = set(fail_recipients)
+        self.transport = httpx.MockTransport(self.handle)
+
+    def handle(self, request):
+        payload = json.loads(request.content)
+        self.requests.append((request.url.path, request.headers, payload))
+        messages = payload if isinstance(payload, list) else [payload]
+        if any(message["to"][0] in self.fail_recipients for message in messages):
+            return httpx.Response(422, json={"message": "invalid recipient"})
+        ids = [{"id": f"id-{message['to'][0]}"} for message in messages]
+        return httpx.Response(200, json={"data": ids} if isinstance(payload, list) else ids[0])
+
+
+def _message(to):
+    return {"from": "mailbot <n@example.com>", "to": [to], "subject": "s", "html": "<p>x</p>"}
+
+
+def test_batch_results_are_per_message_and_requests_are_chunked():
+    fake = FakeResend(fail_recipients={"bad@example.com"})
+    client = ResendClient(api_key="key", base_url="https://resend.test", batch_size=2, transport=fake.transport, limiter=UNLIMITED)
+    recipients = ["a@example.com", "b@example.com", "bad@example.com", "c@example.com", "d@example.com"]
+
+    results = asyncio.run(client.send_batch([_message(to) for to in recipients]))
+
+    # Only the bad recipient fails; the rejected batch is split to find it
+    assert [result.get("id") for result in results] == ["id-a@example.com", "id-b@example.com", None, "id-c@example.com", "id-d@example.com"]
+    assert "422" in results[2]["error"]
+    assert [path for path, _, _ in fake.requests] == ["/emails/batch"] * 5
+    assert client.stats["failed"] == 1
+    assert fake.requests[0][1]["authorization"] == "Bearer key"
+
+
+def test_submitted_digests_are_coalesced_into_batches():
+    fake = FakeResend()
+    service = NotificationService(ResendClient(api_key="key", base_url="https://resend.test", batch_size=100, batch_wait_ms=20, transport=fake.transport, limiter=UNLIMITED))
+
+    async def scenario():
+        results = await asyncio.gather(*(service.send_daily_digest(f"u{i}@example.com", "digest") for i in range(150)))
+        await service.aclose()
+        return results
+
+    results = asyncio.run(scenario())
+
+    assert results[7] == {"id": "id-u7@example.com"}
+    assert sorted(len(payload) for _, _, payload in fake.requests) == [50, 100]
+
+
+def test_single_send_raises_on_rejection():
+    fake = FakeResend(fail_recipients={"bad@example.com"})
+    client = ResendClient(api_key="key", base_url="https://resend.test", transport=fake.transport, limiter=UNLIMITED)
+
+    assert asyncio.run(client.send(_message("a@example.com"), idempotency_key="k1")) == {"id": "id-a@example.com"}
+    assert fake.requests[0][1]["idempotency-key"] == "k1"
+    with pytest.raises(ResendError):
+        asyncio.run(client.send(_message("bad@example.com")))
+
+
+def test_a_failed_flush_is_logged_and_fails_its_submits(caplog):
+    client = ResendClient(api_key="key", base_url="https://resend.test", batch_size=2, transport=FakeResend().transport, limiter=UNLIMITED)
+
+    async def broken_flush(pending):
+        raise RuntimeError("flush bug")
+
+    client._flush = broken_flush
+
+    async def scenario():
+        results = await asyncio.gather(*(client.submit(_message(f"u{i}@example.com")) for i in range(2)), return_exceptions=True)
+        await client.aclose()
+        return results
+
+    results = asyncio.run(scenario())
+
+    assert [str(result) for result in results] == ["flush bug", "flush bug"]
+    assert client._tasks == set()
+    assert "flush bug" in caplog.text
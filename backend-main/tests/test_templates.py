@@ -0,0 +1,61 @@
+from models.email import EmailRecord
+from services.templates import Markup, Template, TemplateRenderer, escape
+
+SUMMARY = {
+    "email_summary": {
+        "greeting": "Hey <b>there</b>!",
+        "overview": "You have 2 new emails.",
+        "attention_needed": ["Reply to <script>alert(1)</script>"],
+        "action_items": [],
+        "email_list": ["Q3 planning (From: Dana <dana@example.com>)", "Invoice & receipt"],
+        "closing": ""
+    }
+}
+
+
+def test_template_is_minified_and_escapes_values():
+    template = Template("""
+        <p class="x">
+            {text}
+        </p>
+    """)
+
+    assert template.render(text='a < b & "c"') == '<p class="x"> a &lt; b &amp; &quot;c&quot; </p>'
+    assert template.render(text=Markup("<b>ok</b>")) == '<p class="x"> <b>ok</b> </p>'
+    assert escape(escape("<")) == "&lt;"
+
+
+def test_notification_escapes_content_and_skips_empty_sections():
+    html = TemplateRenderer().notification(SUMMARY)
+
+    assert "<script>" not in html
+    assert "Reply to &lt;script&gt;alert(1)&lt;/script&gt;" in html
+    assert "Hey &lt;b&gt;there&lt;/b&gt;!" in html
+    assert "Dana &lt;dana@example.com&gt;" in html
+    assert "Needs Your Attention" in html
+    assert "Action Items" not in html
+    assert "\n" not in html
+
+
+def test_plain_summary_keeps_line_breaks_of_the_text():
+    html = TemplateRenderer().plain_summary("Digest", "line one\nline <two>")
+
+    assert "line one\nline &lt;two&gt;" in html
+
+
+def test_fragments_and_sections_are_cached():
+    renderer = TemplateRenderer(fragment_cache_size=3)
+    renderer.notification(SUMMARY)
+    html = renderer.notification(SUMMARY)
+
+    info = renderer.cache_info()
+    assert info["fragments"]["hits"] == 2
+    assert info["sections"]["hits"] == 2
+    assert info["sections"]["currsize"] <= 3
+    assert html == TemplateRenderer().notification(SUMMARY)
+
+
+def test_important_emails_lists_subjects():
+    html = TemplateRenderer().important_emails([EmailRecord(id="1", subject="Contract <draft>")])
+
+    assert "<li style=\"margin-bottom: 5px;\">Contract &lt;draft&gt;</li>" in html
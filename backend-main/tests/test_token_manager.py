@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+import pytest
+from fastapi import HTTPException
+from models.user import UserCredentials
+from services.token_manager import TokenManager, user_google_credentials
+from services.user_service import UserService
+
+NOW = datetime(2024, 1, 15, 8, 0)
+
+
+class FakeAuth:
+    def __init__(self):
+        self.refreshes = 0
+        self.user_info_calls = 0
+        self._lock = threading.Lock()
+
+    def refresh_credentials(self, credentials):
+        time.sleep(0.05)
+        with self._lock:
+            self.refreshes += 1
+        credentials.token = f"fresh-{self.refreshes}"
+        credentials.expiry = NOW + timedelta(hours=1)
+        return credentials
+
+    def get_user_info(self, credentials):
+        self.user_info_calls += 1
+        # Google still accepts a refreshed-away token until it expires
+        return {"id": "a"} if credentials.token == "issued" or credentials.token.startswith("fresh-") else None
+
+
+def _manager(tmp_path, expires_in):
+    users = UserService(path=str(tmp_path / "users.db"), legacy_dir=str(tmp_path / "credentials"))
+    user = UserCredentials(
+        user_id="a", email="a@example.com", access_token="issued",
+        refresh_token="refresh", token_expiry=NOW + expires_in
+    )
+    asyncio.run(users.store_user_credentials(user))
+    auth = FakeAuth()
+    return TokenManager(users=users, auth=auth, margin_seconds=300, clock=lambda: NOW), users, auth, user
+
+
+def test_concurrent_callers_share_one_proactive_refresh(tmp_path):
+    manager, users, auth, user = _manager(tmp_path, timedelta(minutes=2))
+
+    async def scenario():
+        return await asyncio.gather(*(manager.credentials_for(user) for _ in range(10)))
+
+    credentials = asyncio.run(scenario())
+
+    assert auth.refreshes == 1
+    assert {creds.token for creds in credentials} == {"fresh-1"}
+    stored = asyncio.run(users.get_user_credentials("a"))
+    assert (stored.access_token, stored.token_expiry) == ("fresh-1", NOW + timedelta(hours=1))
+
+
+def test_valid_tokens_are_not_refreshed(tmp_path):
+    manager, _, auth, user = _manager(tmp_path, timedelta(minutes=30))
+
+    credentials = asyncio.run(manager.credentials_for(user))
+
+    assert auth.refreshes == 0
+    assert credentials.token == "issued"
+    assert credentials.refresh_token == "refresh"
+    assert user_google_credentials(user).expiry == NOW + timedelta(minutes=30)
+
+
+def test_frontend_tokens_resolve_to_refreshed_credentials(tmp_path):
+    manager, _, auth, _ = _manager(tmp_path, timedelta(minutes=2))
+    manager.remember("issued", "a", NOW + timedelta(minutes=2))
+
+    first = asyncio.run(manager.credentials_for_token("issued"))
+    current = asyncio.run(manager.credentials_for_token("fresh-1"))
+    # The frontend never sees the refreshed token, so its own keeps working until it expires
+    again = asyncio.run(manager.credentials_for_token("issued"))
+    unknown = asyncio.run(manager.credentials_for_token("someone-else"))
+
+    assert (first.token, current.token, again.token) == ("fresh-1", "fresh-1", "fresh-1")
+    assert auth.refreshes == 1
+    # Mapped tokens are resolved without asking Google
+    assert auth.user_info_calls == 1
+    assert unknown.token == "someone-else"
+
+    manager.clock = lambda: NOW + timedelta(minutes=3)
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(manager.credentials_for_token("issued"))
+    assert rejected.value.status_code == 401
+    assert asyncio.run(manager.user_for_token("fresh-1")).access_token == "fresh-1"
+
+
+def test_expired_current_token_is_refreshed(tmp_path):
+    manager, _, auth, _ = _manager(tmp_path, timedelta(minutes=-1))
+    manager.remember("issued", "a", NOW - timedelta(minutes=1))
+
+    credentials = asyncio.run(manager.credentials_for_token("issued"))
+
+    assert credentials.token == "fresh-1"
+    assert auth.refreshes == 1
+    # Refreshed away and expired, the token no longer stands for the user
+    assert asyncio.run(manager.user_for_token("issued")) is None
@@ -0,0 +1,70 @@
+import asyncio
+from datetime import datetime, timezone
+import jwt
+from config import settings
+from models.user import UserCredentials
+from services.user_service import UserService
+
+
+def _user(user_id, enabled=True, digest_time="08:00"):
+    return UserCredentials(
+        user_id=user_id,
+        email=f"{user_id}@example.com",
+        access_token="token",
+        refresh_token="refresh",
+        token_expiry=datetime(2024, 1, 15, tzinfo=timezone.utc),
+        preferences={"digest_time": digest_time, "timezone": "Europe/Berlin", "digest_enabled": enabled}
+    )
+
+
+def _service(tmp_path, **kwargs):
+    return UserService(path=str(tmp_path / "users.db"), legacy_dir=str(tmp_path / "credentials"), **kwargs)
+
+
+def test_round_trip_survives_reopen(tmp_path):
+    asyncio.run(_service(tmp_path).store_user_credentials(_user("a")))
+
+    found = asyncio.run(_service(tmp_path).get_user_credentials("a"))
+
+    assert found == _user("a")
+    assert asyncio.run(_service(tmp_path).get_user_credentials("missing")) is None
+
+
+def test_digest_selection_uses_indexed_columns(tmp_path):
+    service = _service(tmp_path)
+    for user in (_user("a"), _user("b", enabled=False), _user("c", digest_time="19:30")):
+        asyncio.run(service.store_user_credentials(user))
+
+    schedules = dict(asyncio.run(service.get_digest_schedules()))
+
+    assert schedules == {
+        "a": {"digest_enabled": True, "timezone": "Europe/Berlin", "digest_time": "08:00"},
+        "c": {"digest_enabled": True, "timezone": "Europe/Berlin", "digest_time": "19:30"}
+    }
+    assert [user.user_id for user in asyncio.run(service.get_all_users_for_digest())] == ["a", "c"]
+    assert asyncio.run(service.get_user_by_email("b@example.com")).user_id == "b"
+
+
+def test_cached_credentials_are_not_shared_with_callers(tmp_path):
+    service = _service(tmp_path, cache_size=1)
+    asyncio.run(service.store_user_credentials(_user("a")))
+    asyncio.run(service.store_user_credentials(_user("b")))
+
+    user = asyncio.run(service.get_user_credentials("a"))
+    user.preferences["digest_enabled"] = False
+
+    assert list(service._cache) == ["a"]
+    assert asyncio.run(service.get_user_credentials("a")).preferences["digest_enabled"] is True
+
+
+def test_imports_legacy_credential_files(tmp_path):
+    legacy_dir = tmp_path / "credentials"
+    legacy_dir.mkdir()
+    data = _user("old").dict()
+    data["token_expiry"] = data["token_expiry"].isoformat()
+    (legacy_dir / "old.enc").write_text(jwt.encode(data, settings.SECRET_KEY, algorithm=settings.ALGORITHM))
+
+    service = _service(tmp_path)
+
+    assert asyncio.run(service.get_user_credentials("old")) == _user("old")
+    assert [user_id for user_id, _ in asyncio.run(service.get_digest_schedules())] == ["old"]